@@ -6,16 +6,13 @@ Flask application startup for Lab Portal Management System
 from dotenv import load_dotenv
 
 from app import create_app, db
+from app.models import create_indexes
 from app.models.user import User, AuditLog
 
 # Load environment variables
 load_dotenv()
 
-# Create Flask application
-app = create_app()
 
-
-@app.shell_context_processor
 def make_shell_context():
     """Make database models available in flask shell"""
     return {
@@ -25,14 +22,14 @@ def make_shell_context():
     }
 
 
-@app.cli.command()
 def init_db():
     """Initialize the database with tables"""
     db.create_all()
     print('Database tables created successfully.')
+    for name in create_indexes():
+        print(f'Created missing index {name}')
 
 
-@app.cli.command()
 def create_admin():
     """Create an administrative user"""
     import getpass
@@ -57,5 +54,15 @@ def create_admin():
         print(f'Error creating admin user: {e}')
 
 
+# Password hashing pool workers start by re-running this script as
+# __mp_main__; they need the hashing functions, not an application
+if __name__ != '__mp_main__':
+    # Create Flask application
+    app = create_app()
+    app.shell_context_processor(make_shell_context)
+    app.cli.command()(init_db)
+    app.cli.command()(create_admin)
+
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
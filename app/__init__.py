@@ -4,6 +4,7 @@ Flask application factory for the Lab Portal Management System
 """
 
 import os
+import atexit
 import logging
 from logging.handlers import RotatingFileHandler
 from flask import Flask
@@ -13,6 +14,8 @@ from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_migrate import Migrate
 from flask_wtf.csrf import CSRFProtect
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
 
 from config.config import get_config
 
@@ -47,13 +50,17 @@ def create_app(config_name=None):
         app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + dev_db_path
     
     # Initialize extensions with app
+    configure_engine_options(app)
     db.init_app(app)
+    configure_sqlite_pragmas(app)
     login_manager.init_app(app)
     migrate.init_app(app, db)
     csrf.init_app(app)
     
     # Initialize rate limiter if enabled
     if app.config.get('RATELIMIT_ENABLED', True):
+        from app.services.rate_limit import configure_rate_limiting
+        configure_rate_limiting(app)
         limiter.init_app(app)
     
     # Configure login manager
@@ -63,15 +70,21 @@ def create_app(config_name=None):
     
     @login_manager.user_loader
     def load_user(user_id):
-        from app.models.user import User
-        return User.query.get(int(user_id))
+        from app.services.user_cache import user_cache
+        return user_cache.load(int(user_id))
     
     # Configure logging
     configure_logging(app)
     
+    # Initialize application services
+    init_services(app)
+    
     # Register blueprints
     register_blueprints(app)
     
+    # Management commands, run as `flask <command>` or `python cli.py`
+    register_commands(app)
+    
     # Create database tables with error handling
     with app.app_context():
         try:
@@ -85,6 +98,11 @@ def create_app(config_name=None):
             
             db.create_all()
             app.logger.info('Database tables created successfully')
+            
+            # Tables from before an index was added do not get it above
+            from app.models import create_indexes
+            for name in create_indexes():
+                app.logger.info(f'Created missing index {name}')
         except Exception as e:
             app.logger.error(f'Failed to create database tables: {e}')
             raise
@@ -112,6 +130,117 @@ def register_blueprints(app):
     app.register_blueprint(routes.bp)
 
 
+def register_commands(app):
+    """Register the management commands defined in cli.py"""
+    from cli import COMMANDS
+    for command in COMMANDS:
+        app.cli.add_command(command)
+
+
+def init_services(app):
+    """Initialize application services and their shutdown hooks"""
+    
+    from app.services.user_cache import user_cache
+    user_cache.init_app(app)
+    
+    from app.services.user_stats import user_stats
+    user_stats.init_app(app)
+    
+    from app.services.user_index import user_index
+    user_index.init_app(app)
+    
+    from app.services.pam_auth import pam_authenticator
+    pam_authenticator.init_app(app)
+    
+    # Worker processes start lazily on the first hashed request
+    from app.services.password_hasher import password_hasher
+    password_hasher.init_app(app)
+    atexit.unregister(password_hasher.shutdown)
+    atexit.register(password_hasher.shutdown)
+    
+    from app.services.audit_writer import audit_writer
+    audit_writer.init_app(app)
+    # Flush queued audit entries when the worker process exits
+    atexit.unregister(audit_writer.shutdown)
+    atexit.register(audit_writer.shutdown)
+    
+    from app.services.audit_archive import audit_archive
+    audit_archive.init_app(app)
+    
+    from app.services.audit_rollups import audit_rollups
+    audit_rollups.init_app(app)
+    
+    from app.services.query_profiler import query_profiler
+    query_profiler.init_app(app)
+    
+    from app.services.metrics import metrics
+    metrics.init_app(app)
+    # Leave a final snapshot for the other workers' scrapes
+    atexit.unregister(metrics.shutdown)
+    atexit.register(metrics.shutdown)
+    
+    from app.services.health import health_checks
+    health_checks.init_app(app)
+    atexit.unregister(health_checks.shutdown)
+    atexit.register(health_checks.shutdown)
+
+
+def configure_engine_options(app):
+    """Derive SQLAlchemy engine options from the DB_* settings"""
+    
+    # Explicit engine options take precedence
+    if app.config.get('SQLALCHEMY_ENGINE_OPTIONS'):
+        return
+    
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    backend = url.get_backend_name()
+    if backend == 'sqlite':
+        # SQLite connections are cheap; only make writers wait for locks
+        options = {'connect_args': {
+            'timeout': app.config['SQLITE_BUSY_TIMEOUT_MS'] / 1000
+        }}
+    else:
+        options = {
+            'pool_size': app.config['DB_POOL_SIZE'],
+            'max_overflow': app.config['DB_MAX_OVERFLOW'],
+            'pool_timeout': app.config['DB_POOL_TIMEOUT'],
+            'pool_recycle': app.config['DB_POOL_RECYCLE'],
+            'pool_pre_ping': app.config['DB_POOL_PRE_PING'],
+        }
+        timeout = app.config.get('DB_STATEMENT_TIMEOUT_MS', 0)
+        if timeout and backend == 'postgresql':
+            options['connect_args'] = {
+                'options': f'-c statement_timeout={timeout}'
+            }
+    
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+
+def configure_sqlite_pragmas(app):
+    """Apply the SQLite profile to every new SQLite connection"""
+    
+    with app.app_context():
+        engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        return
+    
+    # WAL lets readers run alongside the single writer; NORMAL sync is
+    # durable across application crashes in WAL mode
+    pragmas = [
+        f"PRAGMA journal_mode={app.config['SQLITE_JOURNAL_MODE']}",
+        f"PRAGMA synchronous={app.config['SQLITE_SYNCHRONOUS']}",
+        f"PRAGMA busy_timeout={int(app.config['SQLITE_BUSY_TIMEOUT_MS'])}",
+        f"PRAGMA mmap_size={int(app.config['SQLITE_MMAP_SIZE'])}"
+    ]
+    
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+
 def configure_logging(app):
     """Configure application logging"""
     
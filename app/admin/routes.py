@@ -3,13 +3,27 @@ Admin Routes
 Administrative interface routes for Lab Portal
 """
 
-from flask import render_template, redirect, url_for, flash, request
+from datetime import datetime
+
+from flask import (render_template, redirect, url_for, flash, request, jsonify,
+                   Response, stream_with_context)
 from flask_login import login_required, current_user
 from functools import wraps
 
-from app import db
 from app.admin import bp
-from app.models.user import User, AuditLog
+from app.models.user import User, AuditLog, unit_of_work
+from app.services.audit_archive import audit_archive
+from app.services.audit_export import EXPORT_FORMATS, stream_export
+from app.services.audit_rollups import audit_rollups
+from app.services.audit_search import AuditSearch
+from app.services.pagination import approximate_counts, keyset_paginate
+from app.services.query_profiler import query_profiler
+from app.services.user_bulk import (BULK_ACTIONS, apply_bulk_action,
+                                    select_targets)
+from app.services.user_cache import user_cache
+from app.services.user_index import user_index
+from app.services.user_search import LIST_COLUMNS, UserSearch, list_row_to_dict
+from app.services.user_stats import user_stats
 
 
 def admin_required(f):
@@ -28,31 +42,129 @@ def admin_required(f):
 @admin_required
 def index():
     """Admin dashboard"""
-    # Get basic statistics
-    total_users = User.query.count()
-    active_users = User.query.filter_by(active=True).count()
-    admin_users = User.query.filter_by(is_admin=True).count()
+    # Get basic statistics from the cached aggregate snapshot
+    stats = user_stats.snapshot()
     
     # Get recent audit logs
-    recent_logs = AuditLog.query.order_by(AuditLog.timestamp.desc()).limit(10).all()
+    recent_logs = AuditLog.query_with_users().order_by(
+        AuditLog.timestamp.desc(), AuditLog.id.desc()).limit(10).all()
+    
+    # Login analytics come from the rollups, never the raw audit table
+    analytics = audit_rollups.dashboard(days=14)
     
     return render_template('admin/index.html', 
                            title='Admin Panel',
-                           total_users=total_users,
-                           active_users=active_users,
-                           admin_users=admin_users,
-                           recent_logs=recent_logs)
+                           total_users=stats['total_users'],
+                           active_users=stats['active_users'],
+                           admin_users=stats['admin_users'],
+                           recent_logs=recent_logs,
+                           analytics=analytics)
+
+
+@bp.route('/api/stats')
+@login_required
+@admin_required
+def api_stats():
+    """User statistics as JSON for dashboard widgets"""
+    return jsonify(user_stats.snapshot())
+
+
+@bp.route('/api/analytics')
+@login_required
+@admin_required
+def api_analytics():
+    """Login analytics rollups as JSON for dashboard charts"""
+    days = min(max(request.args.get('days', 14, type=int), 1), 366)
+    return jsonify(audit_rollups.dashboard(days=days))
+
+
+@bp.route('/queries')
+@login_required
+@admin_required
+def queries():
+    """Slowest sampled SQL statements and per-endpoint query costs"""
+    order_by = request.args.get('order', 'max_ms')
+    if order_by not in ('max_ms', 'avg_ms', 'total_ms', 'count'):
+        order_by = 'max_ms'
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    
+    return render_template('admin/queries.html',
+                           title='Query Profiler',
+                           statements=query_profiler.top(limit, order_by),
+                           endpoints=query_profiler.endpoints(),
+                           profiler=query_profiler.stats(),
+                           order_by=order_by)
+
+
+@bp.route('/api/queries')
+@login_required
+@admin_required
+def api_queries():
+    """Query profiler aggregates as JSON"""
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    return jsonify({
+        'profiler': query_profiler.stats(),
+        'statements': query_profiler.top(limit),
+        'endpoints': query_profiler.endpoints(),
+    })
 
 
 @bp.route('/users')
 @login_required
 @admin_required
 def users():
-    """User management"""
-    users = User.query.order_by(User.created_at.desc()).all()
+    """User management with search filters"""
+    try:
+        search = UserSearch.from_args(request.args)
+    except ValueError as e:
+        flash(f'Invalid search: {e}', 'error')
+        search = UserSearch()
+    
+    users = _search_users(search, per_page=50)
+    
     return render_template('admin/users.html', 
                            title='User Management',
-                           users=users)
+                           users=users,
+                           search=search)
+
+
+@bp.route('/api/users')
+@login_required
+@admin_required
+def api_users():
+    """Search users as JSON, one keyset page at a time"""
+    try:
+        search = UserSearch.from_args(request.args)
+        per_page = min(max(int(request.args.get('per_page', 50)), 1), 500)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    users = _search_users(search, per_page=per_page)
+    
+    return jsonify({
+        'items': [list_row_to_dict(row) for row in users.items],
+        'next_cursor': users.next_cursor,
+        'prev_cursor': users.prev_cursor,
+        'total': users.total,
+        'filters': search.to_args(),
+    })
+
+
+@bp.route('/api/users/search')
+@login_required
+@admin_required
+def api_user_search():
+    """Typeahead lookup by username, email or name prefix"""
+    try:
+        limit = min(max(int(request.args.get('limit', 10)), 1), 50)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    
+    query = request.args.get('q', '')
+    return jsonify({
+        'query': query,
+        'items': user_index.search(query, limit=limit),
+    })
 
 
 @bp.route('/users/<int:user_id>/toggle')
@@ -66,23 +178,25 @@ def toggle_user(user_id):
         flash('You cannot deactivate your own account.', 'error')
         return redirect(url_for('admin.users'))
     
-    user.active = not user.active
-    db.session.commit()
+    # Apply the change and its audit entry in one commit
+    with unit_of_work():
+        user.active = not user.active
+        action = 'activated' if user.active else 'deactivated'
+        AuditLog.log_action(
+            user_id=current_user.id,
+            action=f'user_{action}',
+            resource_type='user',
+            resource_id=user.id,
+            details=f'User {user.username} {action} by '
+                    f'{current_user.username}',
+            ip_address=request.remote_addr,
+            user_agent=request.user_agent.string,
+            commit=False
+        )
+    user_cache.invalidate(user.id)
     
-    action = 'activated' if user.active else 'deactivated'
     flash(f'User {user.username} has been {action}.', 'success')
     
-    # Log the action
-    AuditLog.log_action(
-        user_id=current_user.id,
-        action=f'user_{action}',
-        resource_type='user',
-        resource_id=user.id,
-        details=f'User {user.username} {action} by {current_user.username}',
-        ip_address=request.remote_addr,
-        user_agent=request.user_agent.string
-    )
-    
     return redirect(url_for('admin.users'))
 
 
@@ -93,36 +207,198 @@ def toggle_pam(user_id):
     """Toggle PAM authentication for a user"""
     user = User.query.get_or_404(user_id)
     
-    user.use_pam_auth = not user.use_pam_auth
-    db.session.commit()
+    # Apply the change and its audit entry in one commit
+    with unit_of_work():
+        user.use_pam_auth = not user.use_pam_auth
+        state = 'enabled' if user.use_pam_auth else 'disabled'
+        AuditLog.log_action(
+            user_id=current_user.id,
+            action=f'pam_{state}',
+            resource_type='user',
+            resource_id=user.id,
+            details=f'PAM authentication {state} for {user.username}',
+            ip_address=request.remote_addr,
+            user_agent=request.user_agent.string,
+            commit=False
+        )
+    user_cache.invalidate(user.id)
     
     auth_type = 'PAM' if user.use_pam_auth else 'Database'
     flash(f'User {user.username} authentication changed to {auth_type}.', 'success')
     
-    # Log the action
-    AuditLog.log_action(
-        user_id=current_user.id,
-        action=f'pam_{"enabled" if user.use_pam_auth else "disabled"}',
-        resource_type='user',
-        resource_id=user.id,
-        details=f'PAM authentication {"enabled" if user.use_pam_auth else "disabled"} for {user.username}',
-        ip_address=request.remote_addr,
-        user_agent=request.user_agent.string
-    )
-    
     return redirect(url_for('admin.users'))
 
 
+@bp.route('/users/bulk', methods=['POST'])
+@login_required
+@admin_required
+def bulk_users():
+    """Apply one action to the selected or all matching users"""
+    action = request.form.get('action', '')
+    try:
+        user_ids = [int(value) for value in request.form.getlist('user_ids')]
+        search = (UserSearch.from_args(request.form)
+                  if request.form.get('scope') == 'filter' else None)
+        targets = _bulk_targets(action, user_ids, search)
+    except ValueError as e:
+        flash(f'Bulk update failed: {e}', 'error')
+        return redirect(url_for('admin.users'))
+    
+    changed = apply_bulk_action(action, targets, actor=current_user,
+                                ip_address=request.remote_addr,
+                                user_agent=request.user_agent.string)
+    flash(f'{BULK_ACTIONS[action][3].capitalize()} {changed} users.',
+          'success')
+    
+    args = search.to_args() if search is not None else {}
+    return redirect(url_for('admin.users', **args))
+
+
+@bp.route('/api/users/bulk', methods=['POST'])
+@login_required
+@admin_required
+def api_bulk_users():
+    """Apply one action to users given by id or by filters, as JSON"""
+    payload = request.get_json(silent=True) or {}
+    try:
+        user_ids = [int(value) for value in payload.get('user_ids') or []]
+        filters = payload.get('filters')
+        search = UserSearch.from_args(filters) if filters else None
+        targets = _bulk_targets(payload.get('action', ''), user_ids, search)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    
+    changed = apply_bulk_action(payload['action'], targets,
+                                actor=current_user,
+                                ip_address=request.remote_addr,
+                                user_agent=request.user_agent.string)
+    return jsonify({
+        'action': payload['action'],
+        'updated': changed,
+        'user_ids': [target.id for target in targets],
+    })
+
+
 @bp.route('/logs')
 @login_required
 @admin_required
 def logs():
-    """Audit log viewer"""
-    page = request.args.get('page', 1, type=int)
-    logs = AuditLog.query.order_by(AuditLog.timestamp.desc()).paginate(
-        page=page, per_page=50, error_out=False
-    )
+    """Audit log viewer with optional search filters"""
+    try:
+        search = AuditSearch.from_args(request.args)
+    except ValueError as e:
+        flash(f'Invalid search: {e}', 'error')
+        search = AuditSearch()
+    
+    logs = _search_logs(search, per_page=50)
     
     return render_template('admin/logs.html',
                            title='Audit Logs',
-                           logs=logs)
+                           logs=logs,
+                           search=search)
+
+
+@bp.route('/api/logs')
+@login_required
+@admin_required
+def api_logs():
+    """Search audit logs as JSON"""
+    try:
+        search = AuditSearch.from_args(request.args)
+        per_page = min(max(int(request.args.get('per_page', 50)), 1), 500)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    logs = _search_logs(search, per_page=per_page)
+    
+    return jsonify({
+        'items': [log.to_dict() for log in logs.items],
+        'next_cursor': logs.next_cursor,
+        'prev_cursor': logs.prev_cursor,
+        'filters': search.to_args(),
+    })
+
+
+@bp.route('/logs/export')
+@login_required
+@admin_required
+def export_logs():
+    """Stream matching audit logs as a CSV or JSONL download"""
+    fmt = request.args.get('format', 'csv')
+    compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+    try:
+        search = AuditSearch.from_args(request.args)
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f'Unsupported export format: {fmt!r}')
+    except ValueError as e:
+        flash(f'Invalid export: {e}', 'error')
+        return redirect(url_for('admin.logs'))
+    
+    AuditLog.log_action(
+        user_id=current_user.id,
+        action='audit_exported',
+        resource_type='audit_log',
+        details=f'Audit log exported as {fmt} by {current_user.username}',
+        ip_address=request.remote_addr,
+        user_agent=request.user_agent.string
+    )
+    
+    filename = f'audit_logs-{datetime.utcnow():%Y%m%d-%H%M%S}.{fmt}'
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    if compress:
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    
+    # Rows are read in keyset batches while the response is sent
+    return Response(
+        stream_with_context(stream_export(search, fmt, compress=compress)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+
+def _search_logs(search, per_page):
+    """Fetch one keyset page of audit logs matching ``search``"""
+    cursor = request.args.get('cursor')
+    direction = request.args.get('direction', 'next')
+    # Counting a filtered result means scanning it, so only the
+    # unfiltered listing shows a (cached) total, archived entries included
+    total = None
+    if not search.active:
+        total = (approximate_counts.get('audit_logs', AuditLog.query) +
+                 audit_archive.count())
+    query = search.apply(AuditLog.query_with_users())
+    
+    # Pages past the oldest live entry continue into the monthly archives
+    try:
+        return audit_archive.paginate(query, search, cursor=cursor,
+                                      direction=direction,
+                                      per_page=per_page, total=total)
+    except ValueError:
+        # Malformed or stale cursor - start from the newest entries
+        return audit_archive.paginate(query, search, per_page=per_page,
+                                      total=total)
+
+
+def _search_users(search, per_page):
+    """Fetch one keyset page of user rows matching ``search``"""
+    cursor = request.args.get('cursor')
+    direction = request.args.get('direction', 'next')
+    total = None if search.filtered else user_stats.snapshot()['total_users']
+    query = search.apply(User.query.with_entities(*LIST_COLUMNS))
+    
+    try:
+        return keyset_paginate(query, search.columns, cursor=cursor,
+                               direction=direction, per_page=per_page,
+                               descending=search.descending, total=total)
+    except ValueError:
+        # Malformed cursor or one from another sort - start over
+        return keyset_paginate(query, search.columns, per_page=per_page,
+                               descending=search.descending, total=total)
+
+
+def _bulk_targets(action, user_ids, search):
+    """Users a bulk action applies to; admins cannot deactivate themselves"""
+    exclude = [current_user.id] if action == 'deactivate' else []
+    return select_targets(action, user_ids=user_ids, search=search,
+                          exclude_ids=exclude)
@@ -3,18 +3,29 @@ Authentication Routes
 Login, logout, and user management routes for Lab Portal
 """
 
-from flask import render_template, redirect, url_for, flash, request, jsonify
+import hashlib
+
+from flask import (current_app, render_template, redirect, url_for, flash,
+                   request, jsonify, session)
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.urls import url_parse
 
 from app import db, limiter
 from app.auth import bp
-from app.models.user import User, AuditLog
+from app.models.user import User, AuditLog, unit_of_work
 from app.auth.forms import LoginForm, RegistrationForm
 
 
+def _login_username_key():
+    """Rate limit key for login attempts against a single account"""
+    username = (request.form.get('username') or '').strip().lower()
+    return f'login:{username}'
+
+
 @bp.route('/login', methods=['GET', 'POST'])
 @limiter.limit("5 per minute")
+@limiter.limit(lambda: current_app.config['LOGIN_USERNAME_RATE_LIMIT'],
+               key_func=_login_username_key, methods=['POST'])
 def login():
     """User login route"""
     if current_user.is_authenticated:
@@ -31,16 +42,18 @@ def login():
                 return redirect(url_for('auth.login'))
             
             login_user(user, remember=form.remember_me.data)
-            user.update_last_login()
             
-            # Log successful login
-            AuditLog.log_action(
-                user_id=user.id,
-                action='login',
-                resource_type='authentication',
-                ip_address=request.remote_addr,
-                user_agent=request.user_agent.string
-            )
+            # Record the login and its audit entry in one commit
+            with unit_of_work():
+                user.update_last_login(commit=False)
+                AuditLog.log_action(
+                    user_id=user.id,
+                    action='login',
+                    resource_type='authentication',
+                    ip_address=request.remote_addr,
+                    user_agent=request.user_agent.string,
+                    commit=False
+                )
             
             # Redirect to next page or dashboard
             next_page = request.args.get('next')
@@ -106,18 +119,19 @@ def register():
             is_admin=is_first_user
         )
         
-        db.session.add(user)
-        db.session.commit()
-        
-        # Log user registration
-        AuditLog.log_action(
-            user_id=user.id,
-            action='register',
-            resource_type='user',
-            details=f'New user registered: {user.username}',
-            ip_address=request.remote_addr,
-            user_agent=request.user_agent.string
-        )
+        # Create the user and its audit entry in one commit
+        with unit_of_work():
+            db.session.add(user)
+            db.session.flush()  # Assign user.id for the audit entry
+            AuditLog.log_action(
+                user_id=user.id,
+                action='register',
+                resource_type='user',
+                details=f'New user registered: {user.username}',
+                ip_address=request.remote_addr,
+                user_agent=request.user_agent.string,
+                commit=False
+            )
         
         admin_msg = ("You have been granted administrator privileges "
                      "as the first user." if is_first_user else "")
@@ -131,15 +145,38 @@ def register():
 @login_required
 def profile():
     """User profile page"""
+    # current_user may be a cached snapshot; the profile needs every field
+    user = db.session.get(User, current_user.id)
     return render_template('auth/profile.html', title='Profile',
-                           user=current_user)
+                           user=user)
+
+
+def _status_etag(user):
+    """Version tag for the auth status payload of the given user
+
+    Every field in the payload is stored on the user row, so the row's
+    ``updated_at`` together with the login session identifier changes
+    whenever the response body can change.
+    """
+    if not user.is_authenticated:
+        return 'anonymous'
+    updated_at = user.updated_at.isoformat() if user.updated_at else ''
+    version = f'{user.id}:{updated_at}:{session.get("_id", "")}'
+    return hashlib.sha1(version.encode()).hexdigest()
 
 
 @bp.route('/api/auth/status')
 def auth_status():
-    """API endpoint to check authentication status"""
-    if current_user.is_authenticated:
-        return jsonify({
+    """API endpoint to check authentication status
+
+    Answers ``If-None-Match`` revalidation with 304 so polling clients
+    skip serialization entirely while nothing has changed.
+    """
+    etag = _status_etag(current_user)
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    elif current_user.is_authenticated:
+        response = jsonify({
             'authenticated': True,
             'user': {
                 'id': current_user.id,
@@ -149,4 +186,9 @@ def auth_status():
             }
         })
     else:
-        return jsonify({'authenticated': False})
+        response = jsonify({'authenticated': False})
+    
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
@@ -3,6 +3,39 @@ Models Package
 Database models for the Lab Portal Management System
 """
 
-from .user import User, AuditLog
+from app import db
+from .user import User, AuditLog, unit_of_work
+from .analytics import AuditRollup, RollupWatermark
 
-__all__ = ['User', 'AuditLog']
+__all__ = ['User', 'AuditLog', 'unit_of_work', 'AuditRollup',
+           'RollupWatermark', 'create_indexes']
+
+
+def create_indexes():
+    """Create any model index missing from existing tables
+
+    ``db.create_all()`` skips tables that already exist, indexes
+    included, so indexes added to a model later never reach databases
+    created before them. Returns the names of the indexes created.
+    """
+    inspector = db.inspect(db.engine)
+    created = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = _index_names(inspector, table.name)
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name not in existing:
+                index.create(db.engine)
+                created.append(index.name)
+    return created
+
+
+def _index_names(inspector, table_name):
+    if db.engine.dialect.name == 'sqlite':
+        # SQLite reflection leaves out indexes on expressions
+        return set(db.session.execute(
+            db.text("SELECT name FROM sqlite_master "
+                    "WHERE type = 'index' AND tbl_name = :table"),
+            {'table': table_name}).scalars())
+    return {index['name'] for index in inspector.get_indexes(table_name)}
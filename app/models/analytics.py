@@ -0,0 +1,72 @@
+"""
+Analytics Models
+Pre-aggregated audit log rollups for the Lab Portal admin dashboard
+"""
+
+from datetime import datetime
+
+from app import db
+
+# Audit actions counted by the rollups, keyed by metric name
+ROLLUP_METRICS = {
+    'login': 'logins',
+    'login_failed': 'failed_logins',
+    'register': 'registrations',
+}
+
+ROLLUP_GRANULARITIES = ('hour', 'day')
+
+# Breakdown of each metric: overall, per user id and per client IP
+ROLLUP_DIMENSIONS = ('all', 'user', 'ip')
+
+
+class AuditRollup(db.Model):
+    """Event counts per time bucket, metric and dimension value"""
+
+    __tablename__ = 'audit_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('granularity', 'metric', 'dimension',
+                            'dimension_value', 'bucket',
+                            name='uq_audit_rollups_key'),
+        # Dashboard reads: one metric over a time range, or the top
+        # dimension values within one
+        db.Index('ix_audit_rollups_range', 'granularity', 'dimension',
+                 'bucket'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    granularity = db.Column(db.String(10), nullable=False)
+    bucket = db.Column(db.DateTime, nullable=False)
+    metric = db.Column(db.String(50), nullable=False)
+    dimension = db.Column(db.String(10), nullable=False)
+    dimension_value = db.Column(db.String(100), nullable=False, default='')
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def to_dict(self):
+        """Convert rollup row to dictionary"""
+        return {
+            'granularity': self.granularity,
+            'bucket': self.bucket.isoformat(),
+            'metric': self.metric,
+            'dimension': self.dimension,
+            'dimension_value': self.dimension_value,
+            'count': self.count
+        }
+
+    def __repr__(self):
+        return (f'<AuditRollup {self.metric} {self.granularity} '
+                f'{self.bucket:%Y-%m-%d %H:%M}: {self.count}>')
+
+
+class RollupWatermark(db.Model):
+    """Highest audit log id already folded into the rollups"""
+
+    __tablename__ = 'rollup_watermarks'
+
+    name = db.Column(db.String(50), primary_key=True)
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow,
+                           onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<RollupWatermark {self.name}: {self.last_id}>'
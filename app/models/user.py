@@ -3,17 +3,78 @@ User Model
 User authentication and management model for the Lab Portal
 """
 
+from contextlib import contextmanager
 from datetime import datetime
+from functools import lru_cache
+from flask import current_app, has_app_context
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
-
+from werkzeug.security import generate_password_hash
 from app import db
+from app.services.audit_writer import audit_writer
+from app.services.pam_auth import pam_authenticator
+from app.services.password_hasher import password_hasher
+
+
+# Werkzeug's default method, used outside an application context
+DEFAULT_PASSWORD_HASH_METHOD = 'scrypt:32768:8:1'
+
+# Werkzeug's scrypt memory limit rejects work factors below 2**7
+MIN_SCRYPT_LOG_ROUNDS = 7
+
+
+def password_hash_method():
+    """Return the Werkzeug hashing method configured for the current app
+
+    ``PASSWORD_HASH_METHOD`` wins when set; otherwise ``BCRYPT_LOG_ROUNDS``
+    is applied as the log2 scrypt work factor (15 gives Werkzeug's
+    default of N=32768).
+    """
+    if not has_app_context():
+        return DEFAULT_PASSWORD_HASH_METHOD
+    method = current_app.config.get('PASSWORD_HASH_METHOD')
+    if method:
+        return method
+    rounds = current_app.config.get('BCRYPT_LOG_ROUNDS')
+    if rounds is None:
+        return DEFAULT_PASSWORD_HASH_METHOD
+    return f'scrypt:{2 ** max(rounds, MIN_SCRYPT_LOG_ROUNDS)}:8:1'
+
+
+@lru_cache(maxsize=None)
+def expand_password_hash_method(method):
+    """Return ``method`` as Werkzeug records it in the hashes it generates
+
+    Shorthands such as ``pbkdf2:sha256`` are stored with their defaults
+    filled in (``pbkdf2:sha256:600000``), so the prefix of a throwaway
+    hash is taken once per method rather than duplicating those defaults.
+    """
+    return generate_password_hash('', method).split('$', 1)[0]
+
+
+@contextmanager
+def unit_of_work():
+    """Stage model changes and commit them in a single transaction
+
+    Use with the ``commit=False`` modes of ``User.update_last_login`` and
+    ``AuditLog.log_action`` so a request pays for exactly one commit. The
+    transaction is rolled back if the block raises.
+    """
+    try:
+        yield db.session
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
 
 
 class User(UserMixin, db.Model):
     """User model for authentication and authorization"""
     
     __tablename__ = 'users'
+    # Keyset sort key of the admin user listing
+    __table_args__ = (
+        db.Index('ix_users_created_at_id', 'created_at', 'id'),
+    )
     
     # Primary key
     id = db.Column(db.Integer, primary_key=True)
@@ -67,33 +128,56 @@ class User(UserMixin, db.Model):
     
     def set_password(self, password):
         """Set user password with secure hashing"""
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password,
+                                                  password_hash_method())
     
     def check_password(self, password):
-        """Check if provided password matches stored hash"""
+        """Check if provided password matches stored hash
+
+        A successful check against a hash made with other parameters than
+        the configured ones rehashes the password; the new hash is
+        persisted by the caller's next commit.
+        """
         if self.use_pam_auth:
             return self._check_pam_password(password)
         else:
             if self.password_hash is None:
                 return False
-            return check_password_hash(self.password_hash, password)
+            if not password_hasher.verify(self.password_hash, password):
+                return False
+            if self.needs_rehash:
+                self.set_password(password)
+            return True
+    
+    @property
+    def password_hash_params(self):
+        """Hashing method and cost recorded in the stored password hash"""
+        if self.password_hash is None:
+            return None
+        return self.password_hash.split('$', 1)[0]
+    
+    @property
+    def needs_rehash(self):
+        """Whether the stored hash differs from the configured method"""
+        return (self.password_hash is not None and
+                self.password_hash_params !=
+                expand_password_hash_method(password_hash_method()))
     
     def _check_pam_password(self, password):
         """Authenticate against PAM system"""
-        try:
-            import pam
-            p = pam.pam()
-            return p.authenticate(self.username, password)
-        except ImportError:
+        result = pam_authenticator.authenticate(self.username, password)
+        if result is None:
             # Fallback to database authentication if PAM not available
-            return check_password_hash(self.password_hash, password)
-        except Exception:
-            return False
+            if self.password_hash is None:
+                return False
+            return password_hasher.verify(self.password_hash, password)
+        return result
     
-    def update_last_login(self):
+    def update_last_login(self, commit=True):
         """Update the last login timestamp"""
         self.last_login = datetime.utcnow()
-        db.session.commit()
+        if commit:
+            db.session.commit()
     
     @property
     def full_name(self):
@@ -156,10 +240,32 @@ class User(UserMixin, db.Model):
         return f'<User {self.username}>'
 
 
+# Case-insensitive prefix searches compare lower(column) as a range
+db.Index('ix_users_username_lower', db.func.lower(User.username))
+db.Index('ix_users_email_lower', db.func.lower(User.email))
+
+
 class AuditLog(db.Model):
     """Audit logging for user actions"""
     
     __tablename__ = 'audit_logs'
+    __table_args__ = (
+        # Supports keyset pagination in reverse chronological order
+        db.Index('ix_audit_logs_timestamp_id', 'timestamp', 'id'),
+        # Filtered searches; each ends with the keyset sort key so a
+        # filtered page is read in order straight from the index
+        db.Index('ix_audit_logs_user_id_timestamp',
+                 'user_id', 'timestamp', 'id'),
+        db.Index('ix_audit_logs_action_timestamp',
+                 'action', 'timestamp', 'id'),
+        db.Index('ix_audit_logs_resource_type_timestamp',
+                 'resource_type', 'timestamp', 'id'),
+        db.Index('ix_audit_logs_ip_address_timestamp',
+                 'ip_address', 'timestamp', 'id'),
+        # Never reuse ids once old entries are archived; the analytics
+        # rollups track their progress by id
+        {'sqlite_autoincrement': True},
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -182,10 +288,26 @@ class AuditLog(db.Model):
         self.ip_address = ip_address
         self.user_agent = user_agent
     
+    @staticmethod
+    def query_with_users():
+        """Audit log query that loads each entry's username in the same
+        statement, so listings do not issue a query per row"""
+        return AuditLog.query.options(
+            db.joinedload(AuditLog.user).load_only(User.username)
+        )
+    
     @staticmethod
     def log_action(user_id, action, resource_type, resource_id=None,
-                   details=None, ip_address=None, user_agent=None):
-        """Log a user action"""
+                   details=None, ip_address=None, user_agent=None,
+                   commit=True):
+        """Log a user action
+
+        When the asynchronous audit writer is running the entry is queued
+        for a batched insert and the returned object is not yet persisted;
+        otherwise it is written and committed immediately. With
+        ``commit=False`` the entry is only added to the session so it is
+        committed together with the caller's other changes.
+        """
         log_entry = AuditLog(
             user_id=user_id,
             action=action,
@@ -195,6 +317,11 @@ class AuditLog(db.Model):
             ip_address=ip_address,
             user_agent=user_agent
         )
+        if not commit:
+            db.session.add(log_entry)
+            return log_entry
+        if audit_writer.submit(log_entry):
+            return log_entry
         db.session.add(log_entry)
         db.session.commit()
         return log_entry
@@ -3,8 +3,14 @@ Main Routes
 Core application routes for Lab Portal
 """
 
-from flask import Blueprint, render_template, redirect, url_for
-from flask_login import login_required
+import hmac
+
+from flask import (Blueprint, Response, current_app, render_template,
+                   redirect, request, url_for)
+from flask_login import current_user, login_required
+
+from app.services.health import health_checks
+from app.services.metrics import CONTENT_TYPE, metrics
 
 bp = Blueprint('main', __name__)
 
@@ -21,6 +27,46 @@ def health():
     return {'status': 'healthy', 'service': 'lab_portal'}, 200
 
 
+@bp.route('/health/live')
+def health_live():
+    """Liveness probe - the worker is up and serving requests"""
+    return {'status': 'alive', 'service': 'lab_portal'}, 200
+
+
+@bp.route('/health/ready')
+def health_ready():
+    """Readiness probe - dependencies answer within their timeouts"""
+    ready, checks = health_checks.run()
+    return {
+        'status': 'ready' if ready else 'unready',
+        'service': 'lab_portal',
+        'checks': checks
+    }, 200 if ready else 503
+
+
+@bp.route('/metrics')
+def metrics_endpoint():
+    """Request, database and authentication metrics for Prometheus
+
+    Scrapers send ``Authorization: Bearer <METRICS_TOKEN>``; signed-in
+    administrators can also read it.
+    """
+    if not (_metrics_token_valid() or
+            (current_user.is_authenticated and current_user.is_admin)):
+        return Response('Unauthorized\n', status=401,
+                        headers={'WWW-Authenticate': 'Bearer'})
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
+
+
+def _metrics_token_valid():
+    token = current_app.config.get('METRICS_TOKEN')
+    if not token:
+        return False
+    given = request.headers.get('Authorization', '')
+    return hmac.compare_digest(given.encode('utf-8'),
+                               f'Bearer {token}'.encode('utf-8'))
+
+
 @bp.route('/about')
 def about():
     """About page with system information"""
@@ -0,0 +1,4 @@
+"""
+Services Package
+Application-level services shared across blueprints for the Lab Portal
+"""
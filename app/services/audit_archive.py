@@ -0,0 +1,425 @@
+"""
+Audit Log Archive
+Monthly retention and compressed archives for the audit log
+"""
+
+import bisect
+import gzip
+import heapq
+import json
+import os
+import re
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from app import db
+from app.models.user import AuditLog
+from app.services.pagination import (approximate_counts, build_keyset_page,
+                                     decode_cursor, keyset_scan)
+
+ARCHIVE_NAME = re.compile(
+    r'^audit_logs-(\d{4})-(\d{2})(?:\.\d+)?\.jsonl\.gz$')
+
+# Fields written for each archived entry
+ARCHIVE_FIELDS = ('id', 'user_id', 'username', 'action', 'resource_type',
+                  'resource_id', 'details', 'ip_address', 'user_agent',
+                  'timestamp')
+
+SORT_COLUMNS = (AuditLog.timestamp, AuditLog.id)
+
+
+def month_start(moment):
+    """First instant of the month containing ``moment``"""
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(start):
+    """First instant of the month after ``start``"""
+    return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+class ArchivedUser:
+    """Username of an archived entry's author, as the views display it"""
+
+    def __init__(self, username):
+        self.username = username
+
+
+class ArchivedAuditLog:
+    """Read-only audit entry loaded from an archive file
+
+    Exposes the attributes and ``to_dict()`` of ``AuditLog`` so listings
+    can render live and archived entries side by side.
+    """
+
+    archived = True
+
+    def __init__(self, record):
+        for name in ARCHIVE_FIELDS:
+            setattr(self, name, record.get(name))
+        self.timestamp = datetime.fromisoformat(record['timestamp'])
+        self.user = ArchivedUser(self.username) if self.username else None
+
+    def to_dict(self):
+        """Convert archived entry to dictionary"""
+        data = {name: getattr(self, name) for name in ARCHIVE_FIELDS}
+        data['timestamp'] = self.timestamp.isoformat()
+        data['archived'] = True
+        return data
+
+
+class AuditArchive:
+    """Moves whole months of audit entries out of the live table
+
+    Months older than ``AUDIT_RETENTION_DAYS`` are written to gzipped
+    JSONL files under ``AUDIT_ARCHIVE_DIR``, one file per month, and then
+    deleted from ``audit_logs``. Archived entries are always older than
+    every live one, so searches reaching past the archive boundary read
+    the live table first and continue into the month files, keeping one
+    keyset ordering across both.
+    """
+
+    def __init__(self, app=None):
+        self.directory = None
+        self.retention_days = 0
+        self._indexes = {}
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configure the archive from app config"""
+        self.directory = app.config.get('AUDIT_ARCHIVE_DIR')
+        self.retention_days = int(app.config.get('AUDIT_RETENTION_DAYS', 0))
+        app.extensions['audit_archive'] = self
+
+    def horizon(self, now=None):
+        """Start of the oldest month kept live, or None if retention is off"""
+        if not self.retention_days:
+            return None
+        now = now or datetime.utcnow()
+        return month_start(now - timedelta(days=self.retention_days))
+
+    def months(self):
+        """Archived months as sorted ``(year, month)`` pairs"""
+        if not self.directory or not os.path.isdir(self.directory):
+            return []
+        found = set()
+        for name in os.listdir(self.directory):
+            match = ARCHIVE_NAME.match(name)
+            if match:
+                found.add((int(match.group(1)), int(match.group(2))))
+        return sorted(found)
+
+    def boundary(self):
+        """End of the newest archived month, or None if nothing is archived"""
+        months = self.months()
+        if not months:
+            return None
+        year, month = months[-1]
+        return next_month(datetime(year, month, 1))
+
+    def pending_months(self, before):
+        """Month starts with live entries older than ``before``"""
+        oldest = db.session.query(func.min(AuditLog.timestamp)).scalar()
+        months = []
+        start = month_start(oldest) if oldest else before
+        while next_month(start) <= before:
+            months.append(start)
+            start = next_month(start)
+        return months
+
+    def archive(self, before=None, batch_size=1000, dry_run=False):
+        """Archive every whole month older than ``before``
+
+        ``before`` defaults to the retention horizon. Returns a list of
+        ``(month start, entries)`` pairs; with ``dry_run`` the entries
+        are only counted.
+        """
+        before = before or self.horizon()
+        if before is None:
+            return []
+
+        results = []
+        for start in self.pending_months(month_start(before)):
+            if dry_run:
+                count = AuditLog.query.filter(
+                    AuditLog.timestamp >= start,
+                    AuditLog.timestamp < next_month(start)).count()
+            else:
+                count = self.archive_month(start, batch_size=batch_size)
+            if count:
+                results.append((start, count))
+        return results
+
+    def archive_month(self, start, batch_size=1000):
+        """Write one month to an archive file and delete it from the table
+
+        Each batch of ``batch_size`` entries is written as its own gzip
+        member, and a sidecar index records where every member starts,
+        its first sort key and the file's row count, so readers can seek
+        to the entries they need. The file and its index are fully
+        written and synced before any row is deleted, so an interrupted
+        run leaves every entry in at least one place. Returns the number
+        of entries archived.
+        """
+        end = next_month(start)
+        os.makedirs(self.directory, exist_ok=True)
+        month_filter = (AuditLog.timestamp >= start, AuditLog.timestamp < end)
+
+        # Rows an interrupted run archived but did not delete
+        archived_ids = [self._load_index(path)['max_id']
+                        for path in self._paths(start.year, start.month)]
+        if archived_ids:
+            self._delete_archived(month_filter, max(archived_ids),
+                                  batch_size)
+
+        path = self._new_path(start)
+        temp_path = f'{path}.tmp'
+        query = AuditLog.query_with_users().filter(*month_filter)
+
+        written = 0
+        max_id = 0
+        blocks = []
+        values = None
+        with open(temp_path, 'wb') as raw:
+            while True:
+                rows = keyset_scan(query, SORT_COLUMNS, values,
+                                   descending=False, limit=batch_size)
+                if not rows:
+                    break
+                lines = []
+                for log in rows:
+                    record = log.to_dict()
+                    lines.append(json.dumps({name: record[name]
+                                             for name in ARCHIVE_FIELDS}))
+                    max_id = max(max_id, log.id)
+                blocks.append([raw.tell(), rows[0].timestamp.isoformat(),
+                               rows[0].id])
+                raw.write(gzip.compress(
+                    ('\n'.join(lines) + '\n').encode('utf-8')))
+                written += len(rows)
+                values = [rows[-1].timestamp, rows[-1].id]
+            raw.flush()
+            os.fsync(raw.fileno())
+
+        if not written:
+            os.remove(temp_path)
+            return 0
+        self._write_index(path, {'rows': written, 'max_id': max_id,
+                                 'blocks': blocks})
+        os.replace(temp_path, path)
+
+        # Entries added to the month after the file was written stay live
+        self._delete_archived(month_filter, max_id, batch_size)
+        approximate_counts.invalidate('audit_logs')
+        return written
+
+    def read_month(self, year, month):
+        """All archived entries of one month, oldest first"""
+        return self._iter_month(year, month)
+
+    def count(self):
+        """Number of archived entries, read from the archive indexes"""
+        return sum(self._load_index(path)['rows']
+                   for year, month in self.months()
+                   for path in self._paths(year, month))
+
+    def overlaps(self, search):
+        """Whether ``search`` can match archived entries"""
+        boundary = self.boundary()
+        return boundary is not None and (search.since is None or
+                                         search.since < boundary)
+
+    def scan(self, search, values=None, descending=True, limit=None):
+        """Archived entries matching ``search`` past the sort key ``values``
+
+        Mirrors ``keyset_scan`` over ``(timestamp, id)``. Only the month
+        files that can hold matching entries are opened, reading starts
+        at the indexed block holding ``values``, and reading stops once
+        ``limit`` entries are found.
+        """
+        bound = tuple(values) if values is not None else None
+        rows = []
+        for start, end in self._search_months(search, descending):
+            if bound is not None and (start > bound[0] if descending
+                                      else end <= bound[0]):
+                continue
+            for entry in self._iter_month(start.year, start.month, bound,
+                                          descending):
+                if not search.matches(entry):
+                    continue
+                rows.append(entry)
+                if limit is not None and len(rows) >= limit:
+                    return rows
+        return rows
+
+    def iter_entries(self, search):
+        """Archived entries matching ``search``, oldest first
+
+        Streams each month straight from its ordered files, so memory is
+        bounded by one archive block per file rather than a month.
+        """
+        for start, _ in self._search_months(search, descending=False):
+            yield from self._read_matching(start, search)
+
+    def paginate(self, query, search, cursor=None, direction='next',
+                 per_page=50, total=None):
+        """Keyset page over live entries continuing into the archive
+
+        Behaves like ``keyset_paginate`` over ``(timestamp, id)``
+        descending. The archive is only read when a page runs past the
+        oldest live entry or starts inside the archived range.
+        """
+        values = decode_cursor(cursor) if cursor else None
+        if values is not None and len(values) != len(SORT_COLUMNS):
+            raise ValueError(f'Cursor does not match the sort key: {cursor!r}')
+
+        backwards = direction == 'prev'
+        limit = per_page + 1
+        if not self.overlaps(search):
+            rows = keyset_scan(query, SORT_COLUMNS, values,
+                               descending=not backwards, limit=limit)
+        elif not backwards:
+            rows = keyset_scan(query, SORT_COLUMNS, values,
+                               descending=True, limit=limit)
+            if len(rows) < limit:
+                rows += self.scan(search, values, descending=True,
+                                  limit=limit - len(rows))
+        else:
+            rows = []
+            if values is None or values[0] < self.boundary():
+                rows = self.scan(search, values, descending=False,
+                                 limit=limit)
+            if len(rows) < limit:
+                rows += keyset_scan(query, SORT_COLUMNS, values,
+                                    descending=False,
+                                    limit=limit - len(rows))
+
+        return build_keyset_page(rows, SORT_COLUMNS, per_page, values,
+                                 backwards, total=total)
+
+    def _search_months(self, search, descending):
+        """``(start, end)`` of the archived months ``search`` can match"""
+        for year, month in sorted(self.months(), reverse=descending):
+            start = datetime(year, month, 1)
+            end = next_month(start)
+            if search.since is not None and end <= search.since:
+                continue
+            if search.until is not None and start >= search.until:
+                continue
+            yield start, end
+
+    def _read_matching(self, start, search):
+        return (entry for entry in self.read_month(start.year, start.month)
+                if search.matches(entry))
+
+    def _iter_month(self, year, month, bound=None, descending=False):
+        """Entries of one month past ``bound``, merged across its files"""
+        parts = [self._iter_file(path, bound, descending)
+                 for path in self._paths(year, month)]
+        previous = None
+        for entry in heapq.merge(*parts, reverse=descending,
+                                 key=lambda entry: (entry.timestamp,
+                                                    entry.id)):
+            # Files from an interrupted run before indexes can repeat rows
+            if entry.id != previous:
+                previous = entry.id
+                yield entry
+
+    def _iter_file(self, path, bound, descending):
+        """Entries of one archive file past ``bound``, a block at a time"""
+        index = self._load_index(path)
+        blocks = index['blocks']
+        firsts = [(datetime.fromisoformat(timestamp), entry_id)
+                  for _, timestamp, entry_id in blocks]
+        ends = [offset for offset, _, _ in blocks[1:]] + [None]
+        if bound is None:
+            positions = range(len(blocks))
+        else:
+            # Last block starting at or before the bound
+            positions = range(max(bisect.bisect_right(firsts, bound) - 1,
+                                  0), len(blocks))
+        if descending:
+            positions = reversed(positions if bound is None
+                                 else range(positions.start + 1))
+        for position in positions:
+            entries = self._read_block(path, blocks[position][0],
+                                       ends[position])
+            if descending:
+                entries.reverse()
+            for entry in entries:
+                key = (entry.timestamp, entry.id)
+                if bound is None or (key < bound if descending
+                                     else key > bound):
+                    yield entry
+
+    def _read_block(self, path, offset, end):
+        with open(path, 'rb') as raw:
+            raw.seek(offset)
+            data = raw.read() if end is None else raw.read(end - offset)
+        return [ArchivedAuditLog(json.loads(line)) for line in
+                gzip.decompress(data).decode('utf-8').splitlines()]
+
+    def _load_index(self, path):
+        """The sidecar index of an archive file, built once if missing"""
+        cached = self._indexes.get(path)
+        if cached is not None:
+            return cached
+        try:
+            with open(f'{path}.index.json') as index_file:
+                index = json.load(index_file)
+        except FileNotFoundError:
+            # Written before indexes existed: one block, counted once
+            entries = self._read_block(path, 0, None)
+            index = {'rows': len(entries),
+                     'max_id': max(entry.id for entry in entries),
+                     'blocks': [[0, min(entries, key=lambda entry: (
+                         entry.timestamp, entry.id)).timestamp.isoformat(),
+                         0]]}
+            self._write_index(path, index)
+        self._indexes[path] = index
+        return index
+
+    def _write_index(self, path, index):
+        temp_path = f'{path}.index.json.tmp'
+        with open(temp_path, 'w') as index_file:
+            json.dump(index, index_file)
+        os.replace(temp_path, f'{path}.index.json')
+        self._indexes.pop(path, None)
+
+    def _delete_archived(self, month_filter, max_id, batch_size):
+        while True:
+            ids = (db.select(AuditLog.id)
+                   .where(*month_filter, AuditLog.id <= max_id)
+                   .limit(batch_size))
+            result = db.session.execute(
+                db.delete(AuditLog).where(AuditLog.id.in_(ids))
+                .execution_options(synchronize_session=False))
+            db.session.commit()
+            if result.rowcount < batch_size:
+                break
+
+    def _paths(self, year, month):
+        if not self.directory or not os.path.isdir(self.directory):
+            return []
+        prefix = f'audit_logs-{year:04d}-{month:02d}'
+        return sorted(
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if name.startswith(prefix) and ARCHIVE_NAME.match(name)
+        )
+
+    def _new_path(self, start):
+        base = os.path.join(self.directory,
+                            f'audit_logs-{start.year:04d}-{start.month:02d}')
+        path = f'{base}.jsonl.gz'
+        part = 1
+        while os.path.exists(path):
+            part += 1
+            path = f'{base}.{part}.jsonl.gz'
+        return path
+
+
+audit_archive = AuditArchive()
@@ -0,0 +1,149 @@
+"""
+Audit Log Export
+Streaming CSV and JSONL exports of the audit log
+"""
+
+import csv
+import io
+import itertools
+import json
+import time
+import zlib
+
+from app import db
+from app.models.user import AuditLog, User
+from app.services.audit_archive import audit_archive
+from app.services.audit_search import AuditSearch
+from app.services.pagination import keyset_scan
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+# Projected columns, in output order; rows never become ORM objects
+EXPORT_COLUMNS = (
+    AuditLog.id, AuditLog.timestamp, AuditLog.user_id, User.username,
+    AuditLog.action, AuditLog.resource_type, AuditLog.resource_id,
+    AuditLog.details, AuditLog.ip_address, AuditLog.user_agent,
+)
+EXPORT_FIELDS = tuple(column.key for column in EXPORT_COLUMNS)
+
+SORT_COLUMNS = (AuditLog.timestamp, AuditLog.id)
+
+
+class ExportStats:
+    """Row count and throughput of one export"""
+
+    def __init__(self):
+        self.rows = 0
+        self.batches = 0
+        self.started = time.perf_counter()
+        self.finished = None
+
+    @property
+    def elapsed(self):
+        end = self.finished if self.finished is not None \
+            else time.perf_counter()
+        return end - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed > 0 else 0.0
+
+
+def iter_batches(search=None, batch_size=1000, stats=None):
+    """Yield matching audit rows in chronological keyset batches
+
+    Archived months come first, since every archived entry is older than
+    the live ones; they stream from the archive files a block at a
+    time. Live rows
+    follow, each batch a short, independent query, so memory stays
+    bounded and no transaction is held open while a slow client
+    downloads.
+    """
+    search = search if search is not None else AuditSearch()
+    if audit_archive.overlaps(search):
+        for rows in _archived_batches(search, batch_size):
+            _count_batch(stats, rows)
+            yield rows
+
+    query = search.apply(db.session.query(*EXPORT_COLUMNS).outerjoin(
+        User, AuditLog.user_id == User.id))
+    values = None
+    while True:
+        rows = keyset_scan(query, SORT_COLUMNS, values, descending=False,
+                           limit=batch_size)
+        if not rows:
+            break
+        _count_batch(stats, rows)
+        yield rows
+        if len(rows) < batch_size:
+            break
+        values = [rows[-1].timestamp, rows[-1].id]
+
+
+def _archived_batches(search, batch_size):
+    entries = audit_archive.iter_entries(search)
+    while True:
+        rows = [tuple(getattr(entry, name) for name in EXPORT_FIELDS)
+                for entry in itertools.islice(entries, batch_size)]
+        if not rows:
+            break
+        yield rows
+
+
+def _count_batch(stats, rows):
+    if stats is not None:
+        stats.rows += len(rows)
+        stats.batches += 1
+
+
+def _row_values(row):
+    return [value.isoformat() if name == 'timestamp' and value else value
+            for name, value in zip(EXPORT_FIELDS, row)]
+
+
+def render_csv(batches):
+    """Encode row batches as CSV text chunks, one chunk per batch"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for rows in batches:
+        writer.writerows(_row_values(row) for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def render_jsonl(batches):
+    """Encode row batches as JSON Lines text chunks, one chunk per batch"""
+    for rows in batches:
+        yield ''.join(
+            json.dumps(dict(zip(EXPORT_FIELDS, _row_values(row)))) + '\n'
+            for row in rows
+        )
+
+
+def gzip_chunks(chunks):
+    """Compress a stream of text chunks into gzip bytes incrementally"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_export(search=None, fmt='csv', compress=False, batch_size=1000,
+                  stats=None):
+    """Generate an export of the audit log as text (or gzip bytes)"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f'Unsupported export format: {fmt!r}')
+    render = render_csv if fmt == 'csv' else render_jsonl
+    chunks = render(iter_batches(search, batch_size=batch_size, stats=stats))
+    if compress:
+        chunks = gzip_chunks(chunks)
+    for chunk in chunks:
+        yield chunk
+    if stats is not None:
+        stats.finished = time.perf_counter()
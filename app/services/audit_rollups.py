@@ -0,0 +1,220 @@
+"""
+Audit Rollups
+Incremental compaction of audit log events into analytics rollups
+"""
+
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from app import db
+from app.models.analytics import (ROLLUP_METRICS, AuditRollup,
+                                  RollupWatermark)
+from app.models.user import AuditLog, User, unit_of_work
+
+WATERMARK_NAME = 'audit_rollups'
+
+# Columns identifying one rollup row
+ROLLUP_KEY = ('granularity', 'metric', 'dimension', 'dimension_value',
+              'bucket')
+
+# Rows per multi-row upsert statement
+UPSERT_CHUNK = 500
+
+
+def bucket_start(moment, granularity):
+    """Start of the hour or day containing ``moment``"""
+    if granularity == 'hour':
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class AuditRollups:
+    """Folds new audit log entries into ``audit_rollups``
+
+    ``compact()`` reads entries past a stored id watermark, counts them
+    per hour and day, overall, per user and per IP, and adds the counts
+    to the rollup rows. The counts and the new watermark are committed
+    together, so each entry is counted exactly once however often the
+    job runs. Entries younger than ``settle_seconds`` are left for the
+    next run, giving concurrent writers time to commit lower ids.
+    Dashboard reads only touch the rollups.
+    """
+
+    def __init__(self, app=None):
+        self.batch_size = 5000
+        self.settle_seconds = 5.0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configure compaction from app config"""
+        self.batch_size = int(app.config.get('AUDIT_ROLLUP_BATCH_SIZE',
+                                             5000))
+        self.settle_seconds = float(
+            app.config.get('AUDIT_ROLLUP_SETTLE_SECONDS', 5))
+        app.extensions['audit_rollups'] = self
+
+    def watermark(self):
+        """The watermark row, or None before the first compaction"""
+        return db.session.get(RollupWatermark, WATERMARK_NAME)
+
+    def compact(self, now=None):
+        """Fold all settled entries past the watermark into the rollups
+
+        Returns ``(entries counted, new watermark id)``.
+        """
+        cutoff = (now or datetime.utcnow()) - timedelta(
+            seconds=self.settle_seconds)
+        counted = 0
+        while True:
+            with unit_of_work() as session:
+                mark = self.watermark()
+                if mark is None:
+                    mark = RollupWatermark(name=WATERMARK_NAME, last_id=0)
+                    session.add(mark)
+                rows = session.execute(
+                    db.select(AuditLog.id, AuditLog.action, AuditLog.user_id,
+                              AuditLog.ip_address, AuditLog.timestamp)
+                    .where(AuditLog.id > mark.last_id,
+                           AuditLog.action.in_(list(ROLLUP_METRICS)))
+                    .order_by(AuditLog.id)
+                    .limit(self.batch_size)
+                ).all()
+                settled = []
+                for row in rows:
+                    if row.timestamp > cutoff:
+                        break
+                    settled.append(row)
+                if settled:
+                    self._merge(self._count(settled))
+                    mark.last_id = settled[-1].id
+                    counted += len(settled)
+                last_id = mark.last_id
+            if len(settled) < self.batch_size:
+                return counted, last_id
+
+    def series(self, granularity='day', since=None, until=None):
+        """Overall count per metric for each bucket in ``[since, until)``
+
+        Returns ``(buckets, {metric: [count per bucket]})`` with empty
+        buckets filled with zero.
+        """
+        step = timedelta(hours=1) if granularity == 'hour' else \
+            timedelta(days=1)
+        until = bucket_start(until or datetime.utcnow(), granularity) + step
+        since = bucket_start(since or until - 14 * step, granularity)
+
+        buckets = []
+        moment = since
+        while moment < until:
+            buckets.append(moment)
+            moment += step
+
+        series = {metric: [0] * len(buckets)
+                  for metric in ROLLUP_METRICS.values()}
+        positions = {bucket: index for index, bucket in enumerate(buckets)}
+        rows = db.session.execute(
+            db.select(AuditRollup.bucket, AuditRollup.metric,
+                      AuditRollup.count)
+            .where(AuditRollup.granularity == granularity,
+                   AuditRollup.dimension == 'all',
+                   AuditRollup.bucket >= since,
+                   AuditRollup.bucket < until)
+        ).all()
+        for bucket, metric, count in rows:
+            series[metric][positions[bucket]] = count
+        return buckets, series
+
+    def top(self, metric, dimension, since, limit=10):
+        """Highest ``dimension`` values for ``metric`` since a moment"""
+        total = func.sum(AuditRollup.count).label('total')
+        return db.session.execute(
+            db.select(AuditRollup.dimension_value, total)
+            .where(AuditRollup.granularity == 'hour',
+                   AuditRollup.dimension == dimension,
+                   AuditRollup.metric == metric,
+                   AuditRollup.bucket >= bucket_start(since, 'hour'))
+            .group_by(AuditRollup.dimension_value)
+            .order_by(total.desc(), AuditRollup.dimension_value)
+            .limit(limit)
+        ).all()
+
+    def dashboard(self, days=14, now=None):
+        """Charts and top lists for the admin dashboard"""
+        now = now or datetime.utcnow()
+        buckets, series = self.series('day', since=now - timedelta(
+            days=days - 1), until=now)
+        since = now - timedelta(hours=24)
+
+        failed_users = self.top('failed_logins', 'user', since)
+        usernames = dict(db.session.execute(
+            db.select(User.id, User.username).where(
+                User.id.in_([int(value) for value, _ in failed_users]))
+        ).all()) if failed_users else {}
+
+        mark = self.watermark()
+        return {
+            'days': [bucket.date().isoformat() for bucket in buckets],
+            'series': series,
+            'top_failed_ips': [
+                {'ip_address': value, 'count': count}
+                for value, count in self.top('failed_logins', 'ip', since)
+            ],
+            'top_failed_users': [
+                {'user_id': int(value),
+                 'username': usernames.get(int(value)), 'count': count}
+                for value, count in failed_users
+            ],
+            'last_audit_id': mark.last_id if mark else 0,
+            'updated_at': (mark.updated_at.isoformat()
+                           if mark and mark.updated_at else None),
+        }
+
+    def _count(self, rows):
+        counts = Counter()
+        for row in rows:
+            metric = ROLLUP_METRICS[row.action]
+            dimensions = [('all', ''), ('user', str(row.user_id))]
+            if row.ip_address:
+                dimensions.append(('ip', row.ip_address))
+            for granularity in ('hour', 'day'):
+                bucket = bucket_start(row.timestamp, granularity)
+                for dimension, value in dimensions:
+                    counts[(granularity, metric, dimension, value,
+                            bucket)] += 1
+        return counts
+
+    def _merge(self, counts):
+        rows = [dict(zip(ROLLUP_KEY, key), count=count)
+                for key, count in counts.items()]
+        dialect = db.session.get_bind().dialect.name
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        elif dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            self._merge_portable(rows)
+            return
+
+        table = AuditRollup.__table__
+        for start in range(0, len(rows), UPSERT_CHUNK):
+            statement = insert(table).values(rows[start:start + UPSERT_CHUNK])
+            db.session.execute(statement.on_conflict_do_update(
+                index_elements=list(ROLLUP_KEY),
+                set_={'count': table.c.count + statement.excluded.count}
+            ))
+
+    def _merge_portable(self, rows):
+        for row in rows:
+            count = row.pop('count')
+            rollup = AuditRollup.query.filter_by(**row).first()
+            if rollup is None:
+                db.session.add(AuditRollup(count=count, **row))
+            else:
+                rollup.count += count
+
+
+audit_rollups = AuditRollups()
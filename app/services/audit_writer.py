@@ -0,0 +1,212 @@
+"""
+Audit Writer
+Asynchronous, batched persistence of audit log entries for the Lab Portal
+"""
+
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy.exc import DataError, IntegrityError
+
+from app import db
+
+logger = logging.getLogger(__name__)
+
+# Queued by shutdown() to wake a flush thread blocked on an empty queue
+_WAKE = object()
+
+
+class AuditWriter:
+    """Buffer audit entries in memory and flush them with multi-row inserts
+
+    When enabled, ``submit()`` places an entry on a bounded queue that a
+    background thread drains every ``AUDIT_FLUSH_INTERVAL_MS`` or once
+    ``AUDIT_BATCH_SIZE`` rows are waiting, whichever comes first. When the
+    writer is disabled, not running, or the queue is full, ``submit()``
+    returns False and the caller writes the entry synchronously instead.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self.batch_size = 500
+        self.flush_interval = 0.2
+        self._queue = queue.Queue(maxsize=10000)
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.sync_fallbacks = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configure the writer from app config and start it if enabled"""
+        self.shutdown()
+
+        self.app = app
+        self.enabled = app.config.get('AUDIT_ASYNC_ENABLED', False)
+        self.batch_size = max(1, app.config.get('AUDIT_BATCH_SIZE', 500))
+        self.flush_interval = (
+            app.config.get('AUDIT_FLUSH_INTERVAL_MS', 200) / 1000.0
+        )
+        self._queue = queue.Queue(
+            maxsize=app.config.get('AUDIT_QUEUE_SIZE', 10000)
+        )
+        app.extensions['audit_writer'] = self
+
+        if self.enabled:
+            self.start()
+
+    @property
+    def running(self):
+        """Whether the background flush thread is alive"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start the background flush thread"""
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='audit-writer', daemon=True)
+        self._thread.start()
+
+    def shutdown(self, timeout=5.0):
+        """Stop the flush thread and write out anything still queued"""
+        if self._thread is not None:
+            self._stop.set()
+            try:
+                self._queue.put(_WAKE, timeout=timeout)
+            except queue.Full:
+                pass
+            self._thread.join(timeout)
+            self._thread = None
+        if self.app is not None and not self._queue.empty():
+            self.flush()
+
+    def submit(self, entry):
+        """Queue an AuditLog entry; return False if it was not accepted"""
+        if not self.enabled or not self.running:
+            return False
+
+        if entry.timestamp is None:
+            entry.timestamp = datetime.utcnow()
+        row = {
+            column.name: getattr(entry, column.name)
+            for column in entry.__table__.columns
+            if column.name != 'id'
+        }
+
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            with self._lock:
+                self.sync_fallbacks += 1
+            return False
+
+        with self._lock:
+            self.enqueued += 1
+        return True
+
+    def flush(self):
+        """Synchronously drain the queue on the calling thread"""
+        while not self._queue.empty():
+            batch = self._drain(timeout=0)
+            if batch:
+                self._write(batch)
+
+    def stats(self):
+        """Return writer counters for monitoring"""
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'running': self.running,
+                'queue_depth': self._queue.qsize(),
+                'queue_capacity': self._queue.maxsize,
+                'enqueued': self.enqueued,
+                'written': self.written,
+                'dropped': self.dropped,
+                'sync_fallbacks': self.sync_fallbacks,
+            }
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._drain(timeout=self.flush_interval)
+            if batch:
+                self._write(batch)
+        self.flush()
+
+    def _drain(self, timeout):
+        """Collect up to batch_size rows, waiting at most timeout seconds"""
+        batch = []
+        deadline = time.monotonic() + timeout
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    row = self._queue.get(timeout=remaining)
+                else:
+                    row = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if row is _WAKE:
+                break
+            batch.append(row)
+        return batch
+
+    def _write(self, batch):
+        settled = []
+        with self.app.app_context():
+            try:
+                self._insert(batch, settled)
+            except Exception:
+                # Not a problem with the rows; retrying them one by one
+                # would only repeat the failure
+                db.session.rollback()
+                lost = len(batch) - sum(settled)
+                with self._lock:
+                    self.dropped += lost
+                logger.exception('Failed to write %d audit log entries', lost)
+            finally:
+                db.session.remove()
+
+    def _insert(self, batch, settled):
+        """Insert ``batch``, splitting it in halves if rows are rejected
+
+        A row the database rejects (a constraint or data error) only
+        costs its own entry: the rest of the batch is retried half by
+        half, so dropping one bad row takes about ``log2(len(batch))``
+        extra inserts. Other errors propagate. The size of every part
+        written or dropped is appended to ``settled``.
+        """
+        from app.models.user import AuditLog
+
+        try:
+            db.session.execute(AuditLog.__table__.insert(), batch)
+            db.session.commit()
+        except (IntegrityError, DataError):
+            db.session.rollback()
+            if len(batch) > 1:
+                middle = len(batch) // 2
+                self._insert(batch[:middle], settled)
+                self._insert(batch[middle:], settled)
+                return
+            with self._lock:
+                self.dropped += 1
+            settled.append(1)
+            logger.exception('Failed to write audit log entry %r', batch[0])
+            return
+
+        with self._lock:
+            self.written += len(batch)
+        settled.append(len(batch))
+
+
+audit_writer = AuditWriter()
@@ -0,0 +1,175 @@
+"""
+Health Checks
+Cached, concurrent dependency checks for the readiness endpoint
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from flask import current_app
+
+from app import db, limiter
+
+logger = logging.getLogger(__name__)
+
+
+def check_database():
+    """Round-trip a trivial statement through the connection pool"""
+    engine = db.engine
+    with engine.connect() as connection:
+        connection.exec_driver_sql('SELECT 1')
+    return {'pool': engine.pool.status()}
+
+
+def check_pam():
+    """Whether PAM can be used and how its worker pool is doing"""
+    from app.services.pam_auth import pam_authenticator
+
+    if not pam_authenticator.enabled:
+        return {'skipped': 'PAM authentication is disabled'}
+    if not pam_authenticator.available:
+        raise RuntimeError('pam module is not installed')
+    stats = pam_authenticator.stats()
+    return {'timeouts': stats['timeouts'], 'errors': stats['errors']}
+
+
+def check_rate_limit_storage():
+    """Ping the rate limiter's storage backend"""
+    if not current_app.config.get('RATELIMIT_ENABLED', True) or \
+            not limiter.enabled:
+        return {'skipped': 'rate limiting is disabled'}
+    storage = limiter.storage
+    if not storage.check():
+        raise RuntimeError(f'{type(storage).__name__} check failed')
+    return {'backend': type(storage).__name__}
+
+
+class HealthChecks:
+    """Runs readiness checks concurrently and caches their results
+
+    Each check runs on a small thread pool and counts as failed once it
+    takes longer than ``HEALTH_CHECK_TIMEOUT`` seconds. Results, failed
+    or not, are reused for ``HEALTH_CACHE_TTL`` seconds, and a check
+    still running from an earlier probe is waited on rather than started
+    again, so frequent load balancer probes cost at most one run of each
+    check per TTL. Non-critical checks are reported but do not make the
+    worker unready (login falls back to database auth without PAM).
+    """
+
+    def __init__(self, app=None):
+        self.ttl = 5.0
+        self.timeout = 2.0
+        self._checks = {}
+        self._results = {}
+        self._pending = {}
+        self._executor = None
+        self._lock = threading.Lock()
+
+        self.register('database', check_database)
+        self.register('pam', check_pam, critical=False)
+        self.register('rate_limit_storage', check_rate_limit_storage)
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configure check caching and timeouts from app config"""
+        self.ttl = float(app.config.get('HEALTH_CACHE_TTL', 5))
+        self.timeout = float(app.config.get('HEALTH_CHECK_TIMEOUT', 2))
+        self.reset()
+        app.extensions['health_checks'] = self
+
+    def register(self, name, check, critical=True):
+        """Add a readiness check; it returns details or raises"""
+        self._checks[name] = (check, critical)
+
+    def run(self):
+        """Results of every check, running those without a fresh result
+
+        Returns ``(ready, {name: result})``.
+        """
+        app = current_app._get_current_object()
+        now = time.monotonic()
+        futures = {}
+        results = {}
+        with self._lock:
+            for name in self._checks:
+                cached = self._results.get(name)
+                if cached is not None and cached[0] > now:
+                    results[name] = dict(cached[1], cached=True)
+                    continue
+                future = self._pending.get(name)
+                if future is None:
+                    future = self._pending[name] = self._get_executor() \
+                        .submit(self._run_check, app, name)
+                futures[name] = future
+
+        if futures:
+            wait(futures.values(), timeout=self.timeout)
+        for name, future in futures.items():
+            if future.done():
+                results[name] = future.result()
+            else:
+                # Left running; later probes reuse the timed-out verdict
+                # until the TTL passes and then wait on it again
+                results[name] = self._store(name, {
+                    'status': 'fail',
+                    'critical': self._checks[name][1],
+                    'error': f'timed out after {self.timeout:g}s',
+                }, finished=False)
+
+        ready = all(result['status'] != 'fail' or not result['critical']
+                    for result in results.values())
+        return ready, results
+
+    def reset(self):
+        """Forget cached results"""
+        with self._lock:
+            self._results.clear()
+
+    def shutdown(self):
+        """Stop the check pool; it is recreated on next use"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self._pending.clear()
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=len(self._checks),
+                thread_name_prefix='health-check'
+            )
+        return self._executor
+
+    def _run_check(self, app, name):
+        check, critical = self._checks[name]
+        started = time.perf_counter()
+        try:
+            with app.app_context():
+                details = check() or {}
+            result = {'status': 'skipped' if 'skipped' in details else 'ok'}
+            result.update(details)
+        except Exception as e:
+            logger.warning('Health check %s failed: %s', name, e)
+            result = {'status': 'fail', 'error': str(e) or type(e).__name__}
+        result['critical'] = critical
+        result['latency_ms'] = round((time.perf_counter() - started) * 1000,
+                                     3)
+        return self._store(name, result, finished=True)
+
+    def _store(self, name, result, finished):
+        with self._lock:
+            if not finished and name not in self._pending:
+                # The check completed just after the wait gave up
+                return dict(self._results[name][1], cached=False)
+            self._results[name] = (time.monotonic() + self.ttl, result)
+            if finished:
+                self._pending.pop(name, None)
+        return dict(result, cached=False)
+
+
+health_checks = HealthChecks()
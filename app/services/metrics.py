@@ -0,0 +1,396 @@
+"""
+Metrics
+Request, database and authentication metrics in Prometheus text format
+"""
+
+import bisect
+import glob
+import json
+import logging
+import math
+import os
+import re
+import secrets
+import threading
+import time
+import weakref
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+from app import db
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not on POSIX
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Worker snapshots are named after the pid plus a per-process token, so
+# a reused pid never picks up a dead worker's file
+SNAPSHOT_NAME = re.compile(r'^metrics-(\d+)(?:-[0-9a-f]+)?\.json$')
+RETIRED_SNAPSHOT = 'metrics-retired.json'
+
+
+def _escape(value):
+    return (str(value).replace('\\', '\\\\').replace('\n', '\\n')
+            .replace('"', '\\"'))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"'
+                          for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """Counters and histograms kept in per-thread shards
+
+    Each thread updates only its own shard, so recording takes no lock;
+    shards are summed when metrics are rendered. Shards of threads that
+    have exited are folded into one set of retired totals, so servers
+    starting a thread per request do not accumulate them. With ``METRICS_DIR``
+    set, every worker process also writes its totals to a file of its
+    own in that directory and ``/metrics`` merges all of them, so one
+    scrape covers every worker. Files of workers that have exited are
+    folded into one retired snapshot, so restarts do not accumulate
+    them. The directory must be local to the host, since liveness is
+    checked by pid. Clear it when the server (not a single worker)
+    starts.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.directory = None
+        self.flush_interval = 5.0
+        self._families = {}
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._lock = threading.Lock()
+        self._engines = weakref.WeakSet()
+        self._flusher = None
+        self._stop = threading.Event()
+        self._snapshot_token = secrets.token_hex(4)
+
+        self.counter('labportal_requests_total',
+                     'HTTP requests handled')
+        self.histogram('labportal_request_duration_seconds',
+                       'HTTP request latency')
+        self.histogram('labportal_request_db_seconds',
+                       'Time spent in database statements per request')
+        self.histogram('labportal_pam_duration_seconds',
+                       'PAM authentication time')
+        self.histogram('labportal_password_hash_duration_seconds',
+                       'Password hashing and verification time')
+        self.counter('labportal_rate_limited_total',
+                     'Requests rejected by rate limits')
+
+        # Worker processes must not inherit the parent's counts
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset_after_fork)
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configure metrics and hook into the app and its engine"""
+        self.enabled = app.config.get('METRICS_ENABLED', True)
+        self.directory = app.config.get('METRICS_DIR') or None
+        self.flush_interval = float(app.config.get('METRICS_FLUSH_INTERVAL',
+                                                   5))
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+        if self.enabled:
+            with app.app_context():
+                engine = db.engine
+            if engine not in self._engines:
+                self._engines.add(engine)
+                event.listen(engine, 'before_cursor_execute',
+                             self._before_cursor_execute)
+                event.listen(engine, 'after_cursor_execute',
+                             self._after_cursor_execute)
+            app.before_request(self._start_request)
+            app.after_request(self._finish_request)
+        app.extensions['metrics'] = self
+
+    def counter(self, name, documentation):
+        """Declare a counter family"""
+        self._families[name] = ('counter', documentation, None)
+
+    def histogram(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        """Declare a histogram family"""
+        self._families[name] = ('histogram', documentation, tuple(buckets))
+
+    def inc(self, name, amount=1, **labels):
+        """Add to a counter"""
+        if not self.enabled:
+            return
+        shard = self._shard()
+        key = (name, tuple(sorted(labels.items())))
+        shard[key] = shard.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        """Record one observation in a histogram"""
+        if not self.enabled:
+            return
+        buckets = self._families[name][2]
+        shard = self._shard()
+        key = (name, tuple(sorted(labels.items())))
+        # Per-bucket counts (last is +Inf), then sum and count
+        series = shard.get(key)
+        if series is None:
+            series = shard[key] = [0] * (len(buckets) + 3)
+        series[bisect.bisect_left(buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def collect(self):
+        """Totals of this process across all thread shards"""
+        with self._lock:
+            self._retire_dead_shards()
+            shards = [shard for _, shard in self._shards]
+            totals = {}
+            for key, value in self._retired.items():
+                _merge(totals, key, value)
+        for shard in shards:
+            for key, value in list(shard.items()):
+                _merge(totals, key, value)
+        return totals
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        if self.directory:
+            self.write_snapshot()
+            totals = self._collect_directory()
+        else:
+            totals = self.collect()
+
+        lines = []
+        for name, (kind, documentation, buckets) in self._families.items():
+            lines.append(f'# HELP {name} {documentation}')
+            lines.append(f'# TYPE {name} {kind}')
+            for (series_name, labels), value in sorted(totals.items()):
+                if series_name != name:
+                    continue
+                if kind == 'counter':
+                    lines.append(f'{name}{_format_labels(labels)} '
+                                 f'{_format_value(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + (math.inf,), value):
+                    cumulative += count
+                    bucket_labels = labels + (('le', _format_value(bound)),)
+                    lines.append(f'{name}_bucket'
+                                 f'{_format_labels(bucket_labels)} '
+                                 f'{cumulative}')
+                lines.append(f'{name}_sum{_format_labels(labels)} '
+                             f'{_format_value(float(value[-2]))}')
+                lines.append(f'{name}_count{_format_labels(labels)} '
+                             f'{value[-1]}')
+        return '\n'.join(lines) + '\n'
+
+    def write_snapshot(self):
+        """Write this process's totals to its file in ``METRICS_DIR``"""
+        if not self.directory:
+            return
+        path = os.path.join(self.directory, f'metrics-{os.getpid()}-'
+                            f'{self._snapshot_token}.json')
+        _write_totals(path, self.collect())
+
+    def reset(self):
+        """Zero all series in this process"""
+        with self._lock:
+            for _, shard in self._shards:
+                shard.clear()
+            self._retired = {}
+
+    def shutdown(self):
+        """Stop the flush thread after writing a final snapshot"""
+        if self._flusher is not None:
+            self._stop.set()
+            self._flusher.join()
+            self._flusher = None
+        if self.directory:
+            self.write_snapshot()
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._retire_dead_shards()
+                self._shards.append((threading.current_thread(), shard))
+                if self.directory and self._flusher is None:
+                    self._start_flusher()
+            return shard
+
+    def _retire_dead_shards(self):
+        # Called with the lock held; a dead thread's shard no longer changes
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+                continue
+            for key, value in shard.items():
+                _merge(self._retired, key, value)
+        self._shards = live
+
+    def _start_flusher(self):
+        self._stop.clear()
+        self._flusher = threading.Thread(target=self._run_flusher,
+                                         name='metrics-flush', daemon=True)
+        self._flusher.start()
+
+    def _run_flusher(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.write_snapshot()
+            except OSError:
+                logger.exception('Failed to write metrics snapshot')
+
+    def _collect_directory(self):
+        self._fold_stale_snapshots()
+        totals = {}
+        pattern = os.path.join(self.directory, 'metrics-*.json')
+        for path in glob.glob(pattern):
+            snapshot = _read_totals(path)
+            if snapshot is None:
+                # Replaced, folded or half-written by another worker
+                continue
+            for key, value in snapshot.items():
+                _merge(totals, key, value)
+        return totals
+
+    def _fold_stale_snapshots(self):
+        """Merge the files of exited workers into the retired snapshot"""
+        stale = []
+        for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+            match = SNAPSHOT_NAME.match(os.path.basename(path))
+            if match and not _process_alive(int(match.group(1))):
+                stale.append(path)
+        if not stale or fcntl is None:
+            return
+
+        # Workers fold one at a time so no file is counted twice
+        with open(os.path.join(self.directory, 'metrics.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            retired_path = os.path.join(self.directory, RETIRED_SNAPSHOT)
+            retired = _read_totals(retired_path) or {}
+            folded = []
+            for path in stale:
+                snapshot = _read_totals(path)
+                if snapshot is None:
+                    continue
+                for key, value in snapshot.items():
+                    _merge(retired, key, value)
+                folded.append(path)
+            if not folded:
+                return
+            try:
+                _write_totals(retired_path, retired)
+                for path in folded:
+                    os.remove(path)
+            except OSError:
+                logger.exception('Failed to fold stale metrics snapshots')
+
+    def _reset_after_fork(self):
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._lock = threading.Lock()
+        self._flusher = None
+        self._stop = threading.Event()
+        self._snapshot_token = secrets.token_hex(4)
+
+    def _start_request(self):
+        g._metrics_started = time.perf_counter()
+        g._metrics_db_seconds = 0.0
+
+    def _finish_request(self, response):
+        endpoint = request.endpoint or 'unmatched'
+        self.inc('labportal_requests_total', endpoint=endpoint,
+                 method=request.method, status=str(response.status_code))
+        if response.status_code == 429:
+            self.inc('labportal_rate_limited_total', endpoint=endpoint)
+
+        # Requests rejected before this hook ran have no timings
+        started = g.pop('_metrics_started', None)
+        if started is not None:
+            self.observe('labportal_request_duration_seconds',
+                         time.perf_counter() - started, endpoint=endpoint)
+            self.observe('labportal_request_db_seconds',
+                         g.pop('_metrics_db_seconds', 0.0),
+                         endpoint=endpoint)
+        return response
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters,
+                               context, executemany):
+        if has_request_context() and '_metrics_db_seconds' in g:
+            conn.info.setdefault('metrics_start', []).append(
+                time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters,
+                              context, executemany):
+        starts = conn.info.get('metrics_start')
+        if starts and has_request_context() and '_metrics_db_seconds' in g:
+            g._metrics_db_seconds += time.perf_counter() - starts.pop()
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _read_totals(path):
+    try:
+        with open(path) as snapshot:
+            records = json.load(snapshot)
+    except (OSError, ValueError):
+        return None
+    return {(name, tuple(tuple(label) for label in labels)): value
+            for name, labels, value in records}
+
+
+def _write_totals(path, totals):
+    records = [[name, [list(label) for label in labels], value]
+               for (name, labels), value in totals.items()]
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w') as snapshot:
+        json.dump(records, snapshot)
+    os.replace(temp_path, path)
+
+
+def _merge(totals, key, value):
+    if isinstance(value, list):
+        current = totals.get(key)
+        if current is None:
+            totals[key] = list(value)
+        else:
+            for index, count in enumerate(value):
+                current[index] += count
+    else:
+        totals[key] = totals.get(key, 0) + value
+
+
+metrics = Metrics()
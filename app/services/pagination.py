@@ -0,0 +1,157 @@
+"""
+Keyset Pagination
+Cursor-based pagination helpers for large Lab Portal listings
+"""
+
+import base64
+import json
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+
+class KeysetPage:
+    """One page of a keyset-paginated query
+
+    ``next_cursor`` and ``prev_cursor`` are opaque tokens to pass back as
+    the ``cursor`` argument together with the matching direction.
+    """
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None,
+                 total=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def encode_cursor(values):
+    """Encode sort key values as an opaque, URL-safe token"""
+    payload = [
+        ['dt', value.isoformat()] if isinstance(value, datetime)
+        else ['v', value]
+        for value in values
+    ]
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Decode a cursor token, raising ValueError if it is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        payload = json.loads(raw)
+        return [
+            datetime.fromisoformat(value) if kind == 'dt' else value
+            for kind, value in payload
+        ]
+    except (TypeError, ValueError) as e:
+        raise ValueError(f'Invalid cursor: {token!r}') from e
+
+
+def keyset_scan(query, columns, values=None, descending=True, limit=None):
+    """Rows of ``query`` past ``values`` in ``columns`` order
+
+    Yields the rows strictly after the sort key ``values`` (or from the
+    start when it is None), scanning downwards when ``descending``.
+    """
+    if values is not None:
+        keys, bound = tuple_(*columns), tuple_(*values)
+        query = query.filter(keys < bound if descending else keys > bound)
+    query = query.order_by(*(column.desc() if descending
+                             else column.asc() for column in columns))
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+
+def keyset_paginate(query, columns, cursor=None, direction='next',
+                    per_page=50, descending=True, total=None):
+    """Fetch one page of ``query`` ordered by ``columns``
+
+    ``columns`` must form a unique sort key (end with the primary key)
+    and should be backed by a composite index in the same order. Pages
+    are found with a row-value comparison against the cursor, so the
+    cost of a page does not grow with its depth.
+    """
+    values = decode_cursor(cursor) if cursor else None
+    if values is not None and len(values) != len(columns):
+        raise ValueError(f'Cursor does not match the sort key: {cursor!r}')
+
+    backwards = direction == 'prev'
+    # Scan in listing order for next pages and against it for previous ones
+    rows = keyset_scan(query, columns, values,
+                       descending=descending != backwards,
+                       limit=per_page + 1)
+    return build_keyset_page(rows, columns, per_page, values, backwards,
+                             total=total)
+
+
+def build_keyset_page(rows, columns, per_page, values, backwards,
+                      total=None):
+    """Turn up to ``per_page + 1`` scanned rows into a KeysetPage
+
+    ``rows`` are in scan order as returned by ``keyset_scan``; ``values``
+    is the decoded cursor the scan started from.
+    """
+    has_more = len(rows) > per_page
+    rows = list(rows[:per_page])
+    if backwards:
+        rows.reverse()
+        has_next, has_prev = values is not None, has_more
+    else:
+        has_next, has_prev = has_more, values is not None
+
+    def cursor_for(row):
+        return encode_cursor([getattr(row, column.key)
+                              for column in columns])
+
+    next_cursor = cursor_for(rows[-1]) if rows and has_next else None
+    prev_cursor = cursor_for(rows[0]) if rows and has_prev else None
+
+    return KeysetPage(rows, per_page, next_cursor=next_cursor,
+                      prev_cursor=prev_cursor, total=total)
+
+
+class CountCache:
+    """Cache row counts so listings do not recount on every page"""
+
+    def __init__(self, ttl=60.0):
+        self.ttl = ttl
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, query):
+        """Return the cached count for ``key``, counting ``query`` if stale"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._counts.get(key)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+
+        count = query.order_by(None).count()
+        with self._lock:
+            self._counts[key] = (now + self.ttl, count)
+        return count
+
+    def invalidate(self, key=None):
+        """Drop one cached count, or all of them"""
+        with self._lock:
+            if key is None:
+                self._counts.clear()
+            else:
+                self._counts.pop(key, None)
+
+
+approximate_counts = CountCache()
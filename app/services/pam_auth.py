@@ -0,0 +1,286 @@
+"""
+PAM Authentication Service
+Bounded worker pool for blocking PAM authentication calls in the Lab Portal
+"""
+
+import hashlib
+import hmac
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from app.services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _percentile(samples, fraction):
+    """Nearest-rank percentile of a sequence of samples"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class PamCredentialCache:
+    """Short-lived verified-credential cache with failure backoff
+
+    Only successful verifications are cached, as a salted scrypt digest
+    of the password keyed by username; plaintext passwords are never
+    stored and the salt is regenerated per process. Independently,
+    ``failure_threshold`` consecutive failures for a username block
+    further PAM calls for that username for ``backoff`` seconds.
+    """
+
+    # scrypt work factor for cached digests (16 MiB per digest)
+    SCRYPT_N = 2 ** 14
+    SCRYPT_R = 8
+
+    def __init__(self, ttl=60, maxsize=1024, failure_threshold=5,
+                 backoff=30):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.failure_threshold = failure_threshold
+        self.backoff = backoff
+        self._salt = os.urandom(16)
+        self._verified = OrderedDict()
+        self._failures = {}
+        self._lock = threading.Lock()
+        self.cache_hits = 0
+        self.backoff_rejections = 0
+
+    def check(self, username, password):
+        """Return a cached verdict, or None if PAM must be consulted"""
+        now = time.monotonic()
+        with self._lock:
+            failure = self._failures.get(username)
+            if failure is not None and failure[1] > now:
+                self.backoff_rejections += 1
+                return False
+            entry = self._verified.get(username)
+            if entry is not None and entry[1] <= now:
+                del self._verified[username]
+                entry = None
+        if entry is None:
+            return None
+
+        if hmac.compare_digest(entry[0], self._digest(username, password)):
+            with self._lock:
+                self.cache_hits += 1
+            return True
+        return None
+
+    def record(self, username, password, result):
+        """Remember the outcome of a PAM verification"""
+        now = time.monotonic()
+        if result:
+            digest = self._digest(username, password)
+            with self._lock:
+                self._failures.pop(username, None)
+                self._verified[username] = (digest, now + self.ttl)
+                self._verified.move_to_end(username)
+                while len(self._verified) > self.maxsize:
+                    self._verified.popitem(last=False)
+            return
+
+        with self._lock:
+            # A failed check also revokes any cached success
+            self._verified.pop(username, None)
+            count = self._failures.get(username, (0, 0))[0] + 1
+            blocked_until = (now + self.backoff
+                             if count >= self.failure_threshold else 0)
+            self._failures[username] = (count, blocked_until)
+            if len(self._failures) > self.maxsize:
+                self._failures.pop(next(iter(self._failures)))
+
+    @property
+    def calls_avoided(self):
+        """Number of PAM calls answered from the cache or backoff table"""
+        return self.cache_hits + self.backoff_rejections
+
+    def _digest(self, username, password):
+        return hashlib.scrypt(password.encode(),
+                              salt=self._salt + username.encode(),
+                              n=self.SCRYPT_N, r=self.SCRYPT_R, p=1,
+                              dklen=32)
+
+
+class PamAuthenticator:
+    """Run PAM authentications on a dedicated, bounded thread pool
+
+    A slow PAM stack (LDAP or SSSD behind it) only ties up one of
+    ``PAM_MAX_CONCURRENCY`` pool threads instead of a request worker, and
+    callers give up after ``PAM_TIMEOUT`` seconds including queue wait.
+    PAM handles are kept per pool thread, since a handle is not safe to
+    share between concurrent conversations but can be reused serially.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.service = 'login'
+        self.max_workers = 4
+        self.timeout = 10.0
+        self.cache = None
+        self._executor = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=1024)
+        self._latencies = deque(maxlen=1024)
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.errors = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configure the authenticator from app config"""
+        self.shutdown()
+        self.enabled = app.config.get('ENABLE_PAM_AUTH', True)
+        self.service = app.config.get('PAM_SERVICE', 'login')
+        self.max_workers = max(1, app.config.get('PAM_MAX_CONCURRENCY', 4))
+        self.timeout = float(app.config.get('PAM_TIMEOUT', 10))
+        self.cache = None
+        if app.config.get('PAM_CACHE_ENABLED', False):
+            self.cache = PamCredentialCache(
+                ttl=app.config.get('PAM_CACHE_TTL', 60),
+                failure_threshold=app.config.get('PAM_FAILURE_THRESHOLD', 5),
+                backoff=app.config.get('PAM_FAILURE_BACKOFF', 30)
+            )
+        app.extensions['pam_authenticator'] = self
+
+    @property
+    def available(self):
+        """Whether PAM is enabled and the pam module can be imported"""
+        if not self.enabled:
+            return False
+        try:
+            import pam  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def authenticate(self, username, password):
+        """Authenticate against PAM
+
+        Returns True or False for a PAM verdict, or None when PAM is
+        disabled or not installed so the caller can fall back to
+        database authentication. Timeouts and PAM errors count as
+        failures.
+        """
+        if not self.available:
+            return None
+
+        started = time.perf_counter()
+        result, outcome = self._verdict(username, password)
+        metrics.observe('labportal_pam_duration_seconds',
+                        time.perf_counter() - started, outcome=outcome)
+        return result
+
+    def _verdict(self, username, password):
+        if self.cache is not None:
+            cached = self.cache.check(username, password)
+            if cached is not None:
+                return cached, 'cached'
+
+        future = self._get_executor().submit(
+            self._authenticate, username, password, time.monotonic()
+        )
+        try:
+            result = future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # The pool thread keeps running until PAM returns; the cap on
+            # workers bounds how many such calls can pile up.
+            future.cancel()
+            with self._lock:
+                self.timeouts += 1
+            logger.warning('PAM authentication for %s timed out after %.1fs',
+                           username, self.timeout)
+            return False, 'timeout'
+
+        if result is None:
+            # PAM errors are not credential verdicts; fail without caching
+            return False, 'error'
+        if self.cache is not None:
+            self.cache.record(username, password, result)
+        return result, 'success' if result else 'failure'
+
+    def shutdown(self, wait=False):
+        """Stop the worker pool; it is recreated on next use"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+    def stats(self):
+        """Return call counters and latency percentiles in milliseconds"""
+        with self._lock:
+            waits = list(self._waits)
+            latencies = list(self._latencies)
+            stats = {
+                'enabled': self.enabled,
+                'max_workers': self.max_workers,
+                'calls': self.calls,
+                'failures': self.failures,
+                'timeouts': self.timeouts,
+                'errors': self.errors,
+                'calls_avoided': (self.cache.calls_avoided
+                                  if self.cache is not None else 0),
+            }
+        for name, samples in (('queue_wait', waits),
+                              ('auth_latency', latencies)):
+            for label, fraction in (('p50', 0.5), ('p95', 0.95),
+                                    ('p99', 0.99)):
+                value = _percentile(samples, fraction)
+                stats[f'{name}_{label}_ms'] = (
+                    round(value * 1000, 3) if value is not None else None
+                )
+        return stats
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix='pam-auth'
+                )
+            return self._executor
+
+    def _handle(self):
+        handle = getattr(self._local, 'handle', None)
+        if handle is None:
+            import pam
+            handle = self._local.handle = pam.pam()
+        return handle
+
+    def _authenticate(self, username, password, submitted):
+        started = time.monotonic()
+        try:
+            result = bool(self._handle().authenticate(
+                username, password, service=self.service
+            ))
+        except Exception:
+            # Drop a handle left in an unknown state by the failure
+            self._local.handle = None
+            with self._lock:
+                self.errors += 1
+            logger.exception('PAM authentication error for %s', username)
+            result = None
+        finished = time.monotonic()
+
+        with self._lock:
+            self.calls += 1
+            if not result:
+                self.failures += 1
+            self._waits.append(started - submitted)
+            self._latencies.append(finished - started)
+        return result
+
+
+pam_authenticator = PamAuthenticator()
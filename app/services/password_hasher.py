@@ -0,0 +1,159 @@
+"""
+Password Hasher
+Process pool for CPU-bound password hashing in the Lab Portal
+"""
+
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import has_request_context
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from app.services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _hash(password, method):
+    return generate_password_hash(password, method=method)
+
+
+def _verify(pwhash, password):
+    return check_password_hash(pwhash, password)
+
+
+def _worker_context():
+    """Start method for the worker processes
+
+    Neither choice inherits the server's threads or open database
+    connections. A fork server preloaded with only this module forks
+    each worker from a small, clean process; spawn is the fallback where
+    fork servers are unavailable.
+    """
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload([__name__])
+    return context
+
+
+class PasswordHasher:
+    """Run password hashing and verification in worker processes
+
+    Key derivation holds the GIL for its whole duration, so inside a
+    threaded server one expensive login stalls every other request.
+    During requests this hasher ships the work to a process pool of
+    ``PASSWORD_HASH_WORKERS`` processes (started on first use) and the
+    request thread waits without holding the GIL. Outside requests, or
+    with zero workers, hashing runs synchronously in the caller.
+    """
+
+    def __init__(self, app=None, request_only=True):
+        self.workers = 0
+        self.request_only = request_only
+        self._executor = None
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configure the hasher from app config"""
+        self.shutdown()
+        workers = app.config.get('PASSWORD_HASH_WORKERS')
+        if workers is None:
+            workers = os.cpu_count() or 1
+        self.workers = workers
+        app.extensions['password_hasher'] = self
+
+    @property
+    def pooled(self):
+        """Whether calls in the current context go to the process pool"""
+        return self.workers > 0 and (not self.request_only or
+                                     has_request_context())
+
+    def hash(self, password, method):
+        """Return a Werkzeug password hash for the given method"""
+        started = time.perf_counter()
+        if not self.pooled:
+            pwhash = _hash(password, method)
+        else:
+            pwhash = self._submit(_hash, password, method)
+        metrics.observe('labportal_password_hash_duration_seconds',
+                        time.perf_counter() - started, operation='hash')
+        return pwhash
+
+    def verify(self, pwhash, password):
+        """Check a password against a Werkzeug password hash"""
+        started = time.perf_counter()
+        if not self.pooled:
+            result = _verify(pwhash, password)
+        else:
+            result = self._submit(_verify, pwhash, password)
+        metrics.observe('labportal_password_hash_duration_seconds',
+                        time.perf_counter() - started, operation='verify')
+        return result
+
+    def hash_many(self, passwords, method, parallel=True):
+        """Hash an iterable of passwords, preserving order
+
+        Used for bulk provisioning, so the pool is used whenever workers
+        are configured, even outside a request.
+        """
+        if not parallel or self.workers <= 0:
+            return [_hash(password, method) for password in passwords]
+        passwords = list(passwords)
+        chunksize = max(1, len(passwords) // (self.workers * 4))
+        executor = self._get_executor()
+        try:
+            return list(executor.map(
+                _hash, passwords, [method] * len(passwords),
+                chunksize=chunksize
+            ))
+        except BrokenProcessPool:
+            self._discard(executor)
+            return [_hash(password, method) for password in passwords]
+
+    def shutdown(self, wait=True):
+        """Stop the worker processes; they restart on next use"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _submit(self, fn, *args):
+        """Run ``fn`` on the pool, or in this thread if the pool is broken
+
+        A worker that dies (killed by the OOM killer, say) breaks the
+        whole executor, so it is discarded and replaced on the next call.
+        """
+        executor = self._get_executor()
+        try:
+            return executor.submit(fn, *args).result()
+        except BrokenProcessPool:
+            self._discard(executor)
+            return fn(*args)
+
+    def _discard(self, executor):
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+        logger.warning('Password hashing pool broke; starting a new one')
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=_worker_context()
+                )
+            return self._executor
+
+
+password_hasher = PasswordHasher()
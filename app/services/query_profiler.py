@@ -0,0 +1,235 @@
+"""
+Query Profiler
+Sampled SQL statement profiling for the Lab Portal
+"""
+
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import weakref
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+from app import db
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PARAMETER_LIST = re.compile(
+    r'\(\s*(?:\?|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%\(\w+\)s|:\w+))+\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_statement(statement):
+    """Collapse literals, parameter lists and whitespace in a statement
+
+    Statements differing only in their values normalize to the same
+    text, so they are aggregated together.
+    """
+    statement = _STRING_LITERAL.sub('?', statement)
+    statement = _NUMBER_LITERAL.sub('?', statement)
+    statement = _PARAMETER_LIST.sub('(?)', statement)
+    return _WHITESPACE.sub(' ', statement).strip()
+
+
+def _call_site():
+    """First project frame outside the profiler and library code"""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if (filename.startswith(PROJECT_ROOT) and filename != __file__ and
+                f'{os.sep}site-packages{os.sep}' not in filename):
+            return (f'{os.path.relpath(filename, PROJECT_ROOT)}:'
+                    f'{frame.f_lineno} in {frame.f_code.co_name}')
+        frame = frame.f_back
+    return '<unknown>'
+
+
+class StatementStats:
+    """Aggregated timings of one normalized statement"""
+
+    __slots__ = ('statement', 'count', 'total_ms', 'max_ms', 'call_site')
+
+    def __init__(self, statement):
+        self.statement = statement
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.call_site = None
+
+    def to_dict(self):
+        return {
+            'statement': self.statement,
+            'count': self.count,
+            'total_ms': round(self.total_ms, 3),
+            'avg_ms': round(self.total_ms / self.count, 3)
+            if self.count else 0.0,
+            'max_ms': round(self.max_ms, 3),
+            'call_site': self.call_site,
+        }
+
+
+class QueryProfiler:
+    """Samples SQL statements and aggregates their timings
+
+    A fraction ``QUERY_PROFILER_SAMPLE_RATE`` of requests is profiled as
+    a whole, so per-endpoint figures cover every statement a sampled
+    request ran; statements outside requests are sampled individually.
+    With the rate at 0 each statement costs one attribute check.
+    Sampled statements slower than ``QUERY_PROFILER_SLOW_MS`` are logged
+    with their call site. Aggregates are kept per process, bounded to
+    ``QUERY_PROFILER_MAX_STATEMENTS`` distinct normalized statements.
+    """
+
+    def __init__(self, app=None):
+        self.sample_rate = 0.0
+        self.slow_ms = 200.0
+        self.max_statements = 500
+        self._statements = {}
+        self._endpoints = {}
+        self._lock = threading.Lock()
+        self._engines = weakref.WeakSet()
+        self.sampled = 0
+        self.untracked = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configure sampling and hook into the app and its engine"""
+        self.sample_rate = float(app.config.get('QUERY_PROFILER_SAMPLE_RATE',
+                                                0.0))
+        self.slow_ms = float(app.config.get('QUERY_PROFILER_SLOW_MS', 200))
+        self.max_statements = int(
+            app.config.get('QUERY_PROFILER_MAX_STATEMENTS', 500))
+
+        with app.app_context():
+            engine = db.engine
+        if engine not in self._engines:
+            self._engines.add(engine)
+            event.listen(engine, 'before_cursor_execute',
+                         self._before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute',
+                         self._after_cursor_execute)
+
+        app.before_request(self._start_request)
+        app.teardown_request(self._finish_request)
+        app.extensions['query_profiler'] = self
+
+    def top(self, limit=20, order_by='max_ms'):
+        """The ``limit`` worst statements by max, average or total time"""
+        with self._lock:
+            rows = [stats.to_dict() for stats in self._statements.values()]
+        rows.sort(key=lambda row: row[order_by], reverse=True)
+        return rows[:limit]
+
+    def endpoints(self):
+        """Per-endpoint statement counts and time for sampled requests"""
+        with self._lock:
+            rows = [
+                {'endpoint': endpoint, 'requests': requests,
+                 'queries': queries, 'total_ms': round(total_ms, 3),
+                 'avg_queries': round(queries / requests, 2),
+                 'avg_ms': round(total_ms / requests, 3)}
+                for endpoint, (requests, queries, total_ms)
+                in self._endpoints.items()
+            ]
+        rows.sort(key=lambda row: row['total_ms'], reverse=True)
+        return rows
+
+    def stats(self):
+        """Profiler counters for the admin page"""
+        with self._lock:
+            return {
+                'sample_rate': self.sample_rate,
+                'slow_ms': self.slow_ms,
+                'sampled': self.sampled,
+                'statements': len(self._statements),
+                'untracked': self.untracked,
+            }
+
+    def reset(self):
+        """Drop all aggregates"""
+        with self._lock:
+            self._statements.clear()
+            self._endpoints.clear()
+            self.sampled = 0
+            self.untracked = 0
+
+    def _start_request(self):
+        if self.sample_rate:
+            # A list collects the request's totals; False opts it out
+            g._query_profile = ([0, 0.0]
+                                if random.random() < self.sample_rate
+                                else False)
+
+    def _finish_request(self, exc=None):
+        profile = g.pop('_query_profile', None)
+        if not profile:
+            return
+        endpoint = request.endpoint or request.path
+        with self._lock:
+            requests, queries, total_ms = self._endpoints.get(
+                endpoint, (0, 0, 0.0))
+            self._endpoints[endpoint] = (requests + 1, queries + profile[0],
+                                         total_ms + profile[1])
+
+    def _is_sampled(self):
+        profile = g.get('_query_profile') if has_request_context() else None
+        if profile is None:
+            # Outside a profiled request cycle, sample statements singly
+            return random.random() < self.sample_rate
+        return profile is not False
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters,
+                               context, executemany):
+        if not self.sample_rate or not self._is_sampled():
+            return
+        conn.info.setdefault('query_profiler_start', []).append(
+            time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters,
+                              context, executemany):
+        starts = conn.info.get('query_profiler_start')
+        if not starts:
+            return
+        elapsed_ms = (time.perf_counter() - starts.pop()) * 1000
+        call_site = _call_site()
+
+        if elapsed_ms >= self.slow_ms:
+            logger.warning('Slow query (%.1f ms) at %s: %s', elapsed_ms,
+                           call_site, _WHITESPACE.sub(' ', statement))
+
+        if has_request_context():
+            profile = g.get('_query_profile')
+            if profile:
+                profile[0] += 1
+                profile[1] += elapsed_ms
+
+        normalized = normalize_statement(statement)
+        with self._lock:
+            self.sampled += 1
+            stats = self._statements.get(normalized)
+            if stats is None:
+                if len(self._statements) >= self.max_statements:
+                    self.untracked += 1
+                    return
+                stats = self._statements[normalized] = \
+                    StatementStats(normalized)
+            stats.count += 1
+            stats.total_ms += elapsed_ms
+            if elapsed_ms >= stats.max_ms:
+                stats.max_ms = elapsed_ms
+                stats.call_site = call_site
+
+
+query_profiler = QueryProfiler()
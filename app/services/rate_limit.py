@@ -0,0 +1,275 @@
+"""
+Rate Limit Storage
+Storage backends for Flask-Limiter used by the Lab Portal
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from limits.storage import Storage, storage_from_string
+
+logger = logging.getLogger(__name__)
+
+HYBRID_PREFIX = 'hybrid+'
+
+
+class SQLiteStorage(Storage):
+    """Fixed-window counters in a SQLite file
+
+    A shared backend for single-node deployments and tests that need
+    limits to hold across worker processes without running Redis. Use
+    ``sqlite:///relative/path.db``, ``sqlite:////absolute/path.db`` or
+    ``sqlite://`` for a private in-memory database.
+    """
+
+    STORAGE_SCHEME = ['sqlite']
+
+    # Expired rows are purged after this many increments
+    PURGE_EVERY = 1000
+
+    def __init__(self, uri='sqlite://', wrap_exceptions=False,
+                 timeout=5.0, **options):
+        path = uri.split('://', 1)[1]
+        path = path[1:] if path.startswith('/') else path
+        if path and path != ':memory:':
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        self.path = path or ':memory:'
+        self._lock = threading.Lock()
+        self._increments = 0
+        self._connection = sqlite3.connect(self.path, timeout=timeout,
+                                           isolation_level=None,
+                                           check_same_thread=False)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS rate_limits ('
+            'key TEXT PRIMARY KEY, count INTEGER NOT NULL, '
+            'expires REAL NOT NULL)'
+        )
+        self._connection.execute(
+            'CREATE INDEX IF NOT EXISTS ix_rate_limits_expires '
+            'ON rate_limits (expires)'
+        )
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def incr(self, key, expiry, amount=1):
+        now = time.time()
+        with self._lock:
+            self._increments += 1
+            cursor = self._connection.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                if self._increments % self.PURGE_EVERY == 0:
+                    cursor.execute('DELETE FROM rate_limits '
+                                   'WHERE expires <= ?', (now,))
+                else:
+                    cursor.execute('DELETE FROM rate_limits '
+                                   'WHERE key = ? AND expires <= ?',
+                                   (key, now))
+                cursor.execute(
+                    'INSERT INTO rate_limits (key, count, expires) '
+                    'VALUES (?, ?, ?) ON CONFLICT(key) '
+                    'DO UPDATE SET count = count + excluded.count',
+                    (key, amount, now + expiry)
+                )
+                count = cursor.execute(
+                    'SELECT count FROM rate_limits WHERE key = ?', (key,)
+                ).fetchone()[0]
+                cursor.execute('COMMIT')
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+        return count
+
+    def get(self, key):
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT count FROM rate_limits '
+                'WHERE key = ? AND expires > ?', (key, time.time())
+            ).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key):
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT expires FROM rate_limits WHERE key = ?', (key,)
+            ).fetchone()
+        return row[0] if row else time.time()
+
+    def check(self):
+        try:
+            with self._lock:
+                self._connection.execute('SELECT 1').fetchone()
+        except sqlite3.Error:
+            return False
+        return True
+
+    def reset(self):
+        with self._lock:
+            return self._connection.execute(
+                'DELETE FROM rate_limits').rowcount
+
+    def clear(self, key):
+        with self._lock:
+            self._connection.execute('DELETE FROM rate_limits WHERE key = ?',
+                                     (key,))
+
+
+class HybridStorage(Storage):
+    """Local counters in front of a shared rate limit backend
+
+    Configure with ``hybrid+<backend uri>``, e.g. ``hybrid+redis://host``.
+    Hits are counted in process memory and answered without a network
+    round trip; a background thread pushes the accumulated deltas to the
+    shared backend every ``sync_interval`` seconds and pulls back the
+    global counts. Across processes a client can therefore exceed a
+    limit by at most the hits it lands on other workers within one sync
+    interval, which is the price of keeping the backend off the request
+    path.
+    """
+
+    STORAGE_SCHEME = ['hybrid+memory', 'hybrid+redis', 'hybrid+rediss',
+                      'hybrid+redis+unix', 'hybrid+memcached',
+                      'hybrid+sqlite']
+
+    def __init__(self, uri, wrap_exceptions=False, sync_interval=1.0,
+                 **options):
+        self.backend = storage_from_string(uri[len(HYBRID_PREFIX):],
+                                           **options)
+        self.sync_interval = float(sync_interval)
+        # key -> [global count at last sync, unsynced hits, expiry, window]
+        self._counters = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.local_hits = 0
+        self.syncs = 0
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+
+    @property
+    def base_exceptions(self):
+        return self.backend.base_exceptions
+
+    def incr(self, key, expiry, amount=1):
+        now = time.time()
+        with self._lock:
+            counter = self._counters.get(key)
+            if counter is None or counter[2] <= now:
+                counter = self._counters[key] = [0, 0, now + expiry, expiry]
+            counter[1] += amount
+            self.local_hits += 1
+            count = counter[0] + counter[1]
+        self._ensure_sync_thread()
+        return count
+
+    def get(self, key):
+        with self._lock:
+            counter = self._counters.get(key)
+            if counter is None or counter[2] <= time.time():
+                return 0
+            return counter[0] + counter[1]
+
+    def get_expiry(self, key):
+        with self._lock:
+            counter = self._counters.get(key)
+            return counter[2] if counter is not None else time.time()
+
+    def check(self):
+        return self.backend.check()
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+        return self.backend.reset()
+
+    def clear(self, key):
+        with self._lock:
+            self._counters.pop(key, None)
+        self.backend.clear(key)
+
+    def sync(self):
+        """Push unsynced hits to the backend and refresh global counts"""
+        now = time.time()
+        with self._lock:
+            live = []
+            for key, counter in list(self._counters.items()):
+                if counter[2] <= now:
+                    del self._counters[key]
+                    continue
+                live.append((key, counter[1], counter[3]))
+                counter[1] = 0
+
+        for key, amount, expiry in live:
+            try:
+                if amount:
+                    total = self.backend.incr(key, expiry, amount=amount)
+                else:
+                    total = self.backend.get(key)
+                expires = self.backend.get_expiry(key)
+            except Exception:
+                logger.exception('Failed to sync rate limit key %s', key)
+                with self._lock:
+                    counter = self._counters.get(key)
+                    if counter is not None:
+                        counter[1] += amount
+                continue
+            with self._lock:
+                counter = self._counters.get(key)
+                if counter is not None:
+                    counter[0] = total
+                    if amount:
+                        counter[2] = expires
+        with self._lock:
+            self.syncs += 1
+
+    def stop(self):
+        """Stop the sync thread after a final sync"""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.sync()
+
+    def _ensure_sync_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run,
+                                            name='rate-limit-sync',
+                                            daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.sync_interval):
+            self.sync()
+
+
+def configure_rate_limiting(app):
+    """Point Flask-Limiter at the configured storage backend
+
+    Flask-Limiter reads ``RATELIMIT_STORAGE_URI``; derive it from
+    ``RATELIMIT_STORAGE_URL`` unless set explicitly, wrapping the backend
+    in the local prefilter when ``RATELIMIT_LOCAL_PREFILTER`` is on.
+    """
+    if app.config.get('RATELIMIT_STORAGE_URI'):
+        return
+    uri = app.config.get('RATELIMIT_STORAGE_URL', 'memory://')
+    if (app.config.get('RATELIMIT_LOCAL_PREFILTER', False) and
+            not uri.startswith(HYBRID_PREFIX) and
+            not uri.startswith('memory://')):
+        uri = HYBRID_PREFIX + uri
+        options = dict(app.config.get('RATELIMIT_STORAGE_OPTIONS') or {})
+        options.setdefault('sync_interval',
+                           app.config.get('RATELIMIT_SYNC_INTERVAL', 1.0))
+        app.config['RATELIMIT_STORAGE_OPTIONS'] = options
+    app.config['RATELIMIT_STORAGE_URI'] = uri
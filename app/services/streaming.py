@@ -0,0 +1,51 @@
+"""
+Streaming Output
+Chunked text encoders and the stdout writer shared by the user
+listing and the command-line scripts
+"""
+
+import csv
+import io
+import json
+import os
+import sys
+
+
+def csv_chunks(fields, batches, row_values):
+    """Encode row batches as CSV text chunks, one chunk per batch
+
+    ``row_values`` turns one row into the list of values written under
+    the ``fields`` header.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for rows in batches:
+        writer.writerows(row_values(row) for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def jsonl_chunks(batches, row_dict):
+    """Encode row batches as JSON Lines text chunks, one chunk per batch"""
+    for rows in batches:
+        yield ''.join(json.dumps(row_dict(row)) + '\n' for row in rows)
+
+
+def write_stream(chunks):
+    """Write text chunks to stdout, stopping quietly if the reader exits
+
+    Lets command-line output be piped into ``head`` and similar tools.
+    """
+    try:
+        for chunk in chunks:
+            sys.stdout.write(chunk)
+        sys.stdout.flush()
+    except BrokenPipeError:
+        # Keep the interpreter from failing to flush at exit
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        sys.exit(1)
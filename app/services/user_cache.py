@@ -0,0 +1,152 @@
+"""
+User Cache
+Per-process LRU cache of user snapshots for the Flask-Login user loader
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from flask_login import UserMixin
+
+from app import db
+
+
+class CachedUser(UserMixin):
+    """Session-detached snapshot of the User fields request handlers read"""
+
+    # Columns loaded for a snapshot; everything else needs the full model
+    columns = ('id', 'username', 'first_name', 'last_name', 'is_admin',
+               'active', 'updated_at')
+
+    def __init__(self, id, username, first_name, last_name, is_admin,
+                 active, updated_at=None):
+        self.id = id
+        self.username = username
+        self.first_name = first_name
+        self.last_name = last_name
+        self.is_admin = is_admin
+        self.active = active
+        self.updated_at = updated_at
+
+    @property
+    def full_name(self):
+        """Return user's full name"""
+        return f"{self.first_name} {self.last_name}"
+
+    @property
+    def is_active(self):
+        """Required by Flask-Login - return if user account is active"""
+        return self.active
+
+    def get_id(self):
+        """Required by Flask-Login"""
+        return str(self.id)
+
+    def __repr__(self):
+        return f'<CachedUser {self.username}>'
+
+
+class UserCache:
+    """Bounded LRU cache with TTL eviction in front of the user loader
+
+    Entries are ``CachedUser`` snapshots, so cached requests never touch
+    the database session. Call ``invalidate()`` whenever a user's cached
+    fields change; the TTL bounds staleness for changes made by other
+    processes such as the CLI.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.maxsize = 1024
+        self.ttl = 60.0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configure the cache from app config"""
+        self.enabled = app.config.get('USER_CACHE_ENABLED', True)
+        self.maxsize = max(1, app.config.get('USER_CACHE_SIZE', 1024))
+        self.ttl = float(app.config.get('USER_CACHE_TTL', 60))
+        self.clear()
+        app.extensions['user_cache'] = self
+
+    def load(self, user_id):
+        """Return the user for a Flask-Login session, or None"""
+        from app.models.user import User
+
+        if not self.enabled:
+            return db.session.get(User, user_id)
+
+        snapshot = self.get(user_id)
+        if snapshot is not None:
+            return snapshot
+
+        row = db.session.execute(
+            db.select(*(getattr(User, name) for name in CachedUser.columns))
+            .where(User.id == user_id)
+        ).first()
+        if row is None:
+            return None
+
+        snapshot = CachedUser(*row)
+        self.put(snapshot)
+        return snapshot
+
+    def get(self, user_id):
+        """Return a fresh cached snapshot, counting the hit or miss"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[user_id]
+            self.misses += 1
+            return None
+
+    def put(self, snapshot):
+        """Store a snapshot, evicting the least recently used entry"""
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            self._entries[snapshot.id] = (expires, snapshot)
+            self._entries.move_to_end(snapshot.id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *user_ids):
+        """Drop cached snapshots for the given user ids"""
+        with self._lock:
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+    def clear(self):
+        """Drop all cached snapshots and reset counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """Return cache counters for monitoring"""
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+user_cache = UserCache()
@@ -0,0 +1,323 @@
+"""
+User Search Index
+Typeahead lookups over user names and emails for the admin panel
+"""
+
+import bisect
+import logging
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import event, func, or_
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models.user import User
+
+logger = logging.getLogger(__name__)
+
+# Fields matched by typeahead queries, case-insensitively by prefix
+SEARCH_FIELDS = ('username', 'email', 'first_name', 'last_name')
+
+# Values kept per user to answer lookups without touching the database
+RECORD_FIELDS = SEARCH_FIELDS + ('active',)
+
+# Session key collecting user changes until the transaction ends
+PENDING_KEY = 'user_index_changes'
+
+# Characters sorting after any real text, closing a prefix range
+_HIGHEST = '\U0010ffff'
+
+# Seconds before a failed background rebuild is retried
+REBUILD_RETRY_SECONDS = 30
+
+
+def _tokens(record):
+    return {str(value).lower() for value in record[:len(SEARCH_FIELDS)]
+            if value}
+
+
+def _record_to_dict(user_id, record):
+    username, email, first_name, last_name, active = record
+    return {
+        'id': user_id,
+        'username': username,
+        'email': email,
+        'full_name': f'{first_name} {last_name}',
+        'active': active,
+    }
+
+
+class UserIndex:
+    """In-process prefix index over user names and emails
+
+    Every searchable field value, lowercased, is kept with its user id
+    in one sorted list, so a prefix lookup is a binary search followed
+    by a short scan. The list is built from a projection query on the
+    first lookup and kept current by ORM events: user changes are
+    collected per session and applied once the transaction commits.
+    Bulk statements bypass those events, so code issuing them must call
+    ``invalidate()``, which rebuilds the index on the next lookup.
+    ``USER_SEARCH_INDEX_TTL`` bounds how long changes made by other
+    worker processes go unseen; once it passes, the index is rebuilt on
+    a background thread while lookups keep using the current one.
+
+    On PostgreSQL with the ``pg_trgm`` extension installed, lookups are
+    answered by trigram indexes in the database instead, which every
+    worker shares. ``init-db`` creates those indexes.
+    """
+
+    def __init__(self, app=None):
+        self.mode = 'auto'
+        self.ttl = 300.0
+        self.backend = None
+        self._keys = []
+        self._records = {}
+        self._expires = 0.0
+        self._loaded = False
+        self._building = False
+        self._replay = None
+        self._rebuilder = None
+        self._lock = threading.RLock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configure the index from app config"""
+        self.mode = app.config.get('USER_SEARCH_BACKEND', 'auto')
+        self.ttl = float(app.config.get('USER_SEARCH_INDEX_TTL', 300))
+        with self._lock:
+            self.backend = None
+            self._keys = []
+            self._records = {}
+            self._expires = 0.0
+            self._loaded = False
+        app.extensions['user_index'] = self
+
+    def search(self, query, limit=10):
+        """Users with a field starting with every term of ``query``
+
+        Returns at most ``limit`` dicts ordered by the matched value.
+        """
+        terms = query.lower().split()
+        if not terms or limit < 1:
+            return []
+        if self._resolve_backend() == 'pg_trgm':
+            return self._search_database(terms, limit)
+
+        self._ensure_fresh()
+        # Scan the longest term's range and check the others per user
+        terms.sort(key=len, reverse=True)
+        first, others = terms[0], terms[1:]
+        results = []
+        seen = set()
+        with self._lock:
+            keys, records = self._keys, self._records
+            position = bisect.bisect_left(keys, (first,))
+            upper = (first + _HIGHEST,)
+            while position < len(keys) and keys[position] < upper:
+                user_id = keys[position][1]
+                position += 1
+                if user_id in seen:
+                    continue
+                seen.add(user_id)
+                record = records[user_id]
+                if others:
+                    tokens = _tokens(record)
+                    if not all(any(token.startswith(term) for token in tokens)
+                               for term in others):
+                        continue
+                results.append(_record_to_dict(user_id, record))
+                if len(results) >= limit:
+                    break
+        return results
+
+    def build(self):
+        """Load every user into a fresh index and swap it in"""
+        if self._resolve_backend() == 'pg_trgm':
+            return
+
+        with self._lock:
+            self._building = True
+            self._replay = {}
+        try:
+            rows = db.session.execute(
+                db.select(User.id, *(getattr(User, name)
+                                     for name in RECORD_FIELDS))
+            ).all()
+        except Exception:
+            with self._lock:
+                self._building = False
+                self._replay = None
+            raise
+
+        records = {row[0]: tuple(row[1:]) for row in rows}
+        keys = sorted((token, user_id) for user_id, record in records.items()
+                      for token in _tokens(record))
+        with self._lock:
+            self._keys, self._records = keys, records
+            # Changes committed while the rows were being read
+            for user_id, record in self._replay.items():
+                self._apply(user_id, record)
+            self._building = False
+            self._replay = None
+            self._loaded = True
+            self._expires = time.monotonic() + self.ttl
+        logger.info('User search index built with %d users', len(records))
+
+    def invalidate(self):
+        """Rebuild the index on its next lookup"""
+        with self._lock:
+            self._loaded = False
+            self._expires = 0.0
+
+    def apply_changes(self, changes):
+        """Apply committed ``{user_id: record or None}`` changes"""
+        with self._lock:
+            for user_id, record in changes.items():
+                self._apply(user_id, record)
+                if self._replay is not None:
+                    self._replay[user_id] = record
+
+    def stats(self):
+        """Index size for diagnostics"""
+        with self._lock:
+            return {
+                'backend': self.backend or self.mode,
+                'users': len(self._records),
+                'keys': len(self._keys),
+            }
+
+    def _ensure_fresh(self):
+        with self._lock:
+            if self._building or self._expires > time.monotonic():
+                return
+            # Serve the current index to other threads while rebuilding
+            self._building = True
+            background = self._loaded
+        if background:
+            self._rebuilder = threading.Thread(
+                target=self._rebuild, args=(current_app._get_current_object(),),
+                name='user-index-rebuild', daemon=True)
+            self._rebuilder.start()
+            return
+        try:
+            self.build()
+        finally:
+            with self._lock:
+                self._building = False
+
+    def _rebuild(self, app):
+        with app.app_context():
+            try:
+                self.build()
+            except Exception:
+                logger.exception('Failed to rebuild the user search index')
+                with self._lock:
+                    self._expires = time.monotonic() + REBUILD_RETRY_SECONDS
+            finally:
+                with self._lock:
+                    self._building = False
+                db.session.remove()
+
+    def _apply(self, user_id, record):
+        old = self._records.pop(user_id, None)
+        if old is not None:
+            for token in _tokens(old):
+                position = bisect.bisect_left(self._keys, (token, user_id))
+                if (position < len(self._keys) and
+                        self._keys[position] == (token, user_id)):
+                    del self._keys[position]
+        if record is not None:
+            self._records[user_id] = record
+            for token in _tokens(record):
+                bisect.insort(self._keys, (token, user_id))
+
+    def _resolve_backend(self):
+        if self.backend is None:
+            backend = 'memory'
+            if self.mode != 'memory' and \
+                    db.session.get_bind().dialect.name == 'postgresql':
+                installed = db.session.execute(db.text(
+                    "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'"
+                )).first() is not None
+                if installed:
+                    backend = 'pg_trgm'
+            if self.mode == 'pg_trgm' and backend != 'pg_trgm':
+                logger.warning('pg_trgm is not available; using the '
+                               'in-process user search index')
+            self.backend = backend
+        return self.backend
+
+    def _search_database(self, terms, limit):
+        conditions = []
+        for term in terms:
+            pattern = term.replace('\\', '\\\\').replace('%', '\\%') \
+                .replace('_', '\\_') + '%'
+            conditions.append(or_(*(
+                func.lower(getattr(User, name)).like(pattern, escape='\\')
+                for name in SEARCH_FIELDS)))
+        rows = db.session.execute(
+            db.select(User.id, *(getattr(User, name)
+                                 for name in RECORD_FIELDS))
+            .where(*conditions)
+            .order_by(func.lower(User.username))
+            .limit(limit)
+        ).all()
+        return [_record_to_dict(row[0], tuple(row[1:])) for row in rows]
+
+
+def ensure_trigram_indexes():
+    """Create the GIN trigram indexes used by PostgreSQL lookups
+
+    Does nothing unless ``pg_trgm`` is available. Returns whether the
+    indexes exist; a failure is logged rather than raised, since lookups
+    still work (more slowly) without them.
+    """
+    if user_index._resolve_backend() != 'pg_trgm':
+        return False
+    try:
+        for name in SEARCH_FIELDS:
+            db.session.execute(db.text(
+                f'CREATE INDEX IF NOT EXISTS ix_users_{name}_trgm ON users '
+                f'USING gin (lower({name}) gin_trgm_ops)'
+            ))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        logger.exception('Failed to create the user search trigram indexes')
+        return False
+    return True
+
+
+user_index = UserIndex()
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+def _record_user_change(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault(PENDING_KEY, {})[target.id] = tuple(
+            getattr(target, name) for name in RECORD_FIELDS)
+
+
+@event.listens_for(User, 'after_delete')
+def _record_user_delete(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault(PENDING_KEY, {})[target.id] = None
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_committed_changes(session):
+    changes = session.info.pop(PENDING_KEY, None)
+    if changes:
+        user_index.apply_changes(changes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_rolled_back_changes(session):
+    session.info.pop(PENDING_KEY, None)
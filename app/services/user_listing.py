@@ -0,0 +1,93 @@
+"""
+User Listing
+Streaming, column-projected user listings for command-line tools
+"""
+
+import json
+
+from app import db
+from app.models.user import User
+from app.services.streaming import csv_chunks, jsonl_chunks
+from app.services.user_search import LIST_COLUMNS, list_row_to_dict
+
+LISTING_FORMATS = ('table', 'csv', 'json', 'jsonl')
+
+LISTING_FIELDS = tuple(column.key for column in LIST_COLUMNS)
+
+TABLE_HEADER = (f'{"ID":<6} {"Username":<20} {"Email":<30} '
+                f'{"Name":<20} {"Admin":<6} {"Active":<6}')
+
+
+def iter_user_batches(search=None, limit=None, batch_size=1000):
+    """Yield lists of projected user rows in id order
+
+    Rows are streamed with ``yield_per`` (a server-side cursor where
+    the driver supports one), so memory is bounded by ``batch_size``
+    however many users match.
+    """
+    statement = db.select(*LIST_COLUMNS).order_by(User.id)
+    if search is not None:
+        statement = search.apply(statement)
+    if limit is not None:
+        statement = statement.limit(limit)
+    result = db.session.execute(
+        statement.execution_options(yield_per=batch_size))
+    try:
+        for rows in result.partitions():
+            yield rows
+    finally:
+        result.close()
+
+
+def _csv_values(row):
+    return [value.isoformat() if hasattr(value, 'isoformat') else value
+            for value in row]
+
+
+def render_table(batches):
+    """Format row batches as a fixed-width table with a total line"""
+    rule = '-' * len(TABLE_HEADER)
+    yield f'{rule}\n{TABLE_HEADER}\n{rule}\n'
+    total = 0
+    for rows in batches:
+        total += len(rows)
+        yield ''.join(
+            f'{row.id:<6} {row.username:<20} {row.email:<30} '
+            f'{row.first_name + " " + row.last_name:<20} '
+            f'{"Yes" if row.is_admin else "No":<6} '
+            f'{"Yes" if row.active else "No":<6}\n'
+            for row in rows
+        )
+    yield f'\nTotal users: {total}\n'
+
+
+def render_csv(batches):
+    """Encode row batches as CSV text chunks, one chunk per batch"""
+    return csv_chunks(LISTING_FIELDS, batches, _csv_values)
+
+
+def render_json(batches):
+    """Encode row batches as one JSON array, written incrementally"""
+    separator = '[\n'
+    for rows in batches:
+        chunk = []
+        for row in rows:
+            chunk.append(separator + json.dumps(list_row_to_dict(row)))
+            separator = ',\n'
+        yield ''.join(chunk)
+    yield '[]\n' if separator == '[\n' else '\n]\n'
+
+
+def render_jsonl(batches):
+    """Encode row batches as JSON Lines text chunks, one chunk per batch"""
+    return jsonl_chunks(batches, list_row_to_dict)
+
+
+def stream_users(search=None, fmt='table', limit=None, batch_size=1000):
+    """Generate a user listing as text chunks in the given format"""
+    if fmt not in LISTING_FORMATS:
+        raise ValueError(f'Unsupported listing format: {fmt!r}')
+    render = {'table': render_table, 'csv': render_csv,
+              'json': render_json, 'jsonl': render_jsonl}[fmt]
+    return render(iter_user_batches(search, limit=limit,
+                                    batch_size=batch_size))
@@ -0,0 +1,139 @@
+"""
+User Search
+Filter parsing and query building for the admin user listing
+"""
+
+from sqlalchemy import and_, func, or_
+
+from app.models.user import User
+
+# Columns shown in the user table; rows are fetched as tuples, not entities
+LIST_COLUMNS = (User.id, User.username, User.email, User.first_name,
+                User.last_name, User.active, User.is_admin,
+                User.use_pam_auth, User.created_at, User.last_login)
+
+# Sort choices and their unique keyset sort keys, each backed by an index
+SORT_KEYS = {
+    'created_at': (User.created_at, User.id),
+    'username': (User.username, User.id),
+}
+
+# Tri-state flag filters
+FLAG_FILTERS = ('active', 'is_admin', 'use_pam_auth')
+
+_TRUE = ('1', 'true', 'yes', 'on')
+_FALSE = ('0', 'false', 'no', 'off')
+
+
+def prefix_range(column, prefix):
+    """Condition matching values of ``column`` that start with ``prefix``
+
+    Case-insensitive, like the ILIKE search it replaced. Written as a
+    half-open range over ``lower(column)`` rather than LIKE, so it is a
+    range scan of the matching ``lower()`` index on every backend.
+    """
+    prefix = prefix.lower()
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    key = func.lower(column)
+    return and_(key >= prefix, key < upper)
+
+
+def list_row_to_dict(row):
+    """A projected user row in the same shape as ``User.to_dict``"""
+    return {
+        'id': row.id,
+        'username': row.username,
+        'email': row.email,
+        'first_name': row.first_name,
+        'last_name': row.last_name,
+        'full_name': f'{row.first_name} {row.last_name}',
+        'active': row.active,
+        'is_admin': row.is_admin,
+        'use_pam_auth': row.use_pam_auth,
+        'created_at': row.created_at.isoformat() if row.created_at else None,
+        'last_login': row.last_login.isoformat() if row.last_login else None,
+    }
+
+
+class UserSearch:
+    """User listing filters and sort order parsed from request arguments
+
+    ``q`` matches a username or email prefix. Pages are keyset pages
+    over the chosen sort key; the flag filters are checked per row
+    while walking its index.
+    """
+
+    def __init__(self, q=None, active=None, is_admin=None,
+                 use_pam_auth=None, sort='created_at', order='desc'):
+        self.q = q
+        self.active = active
+        self.is_admin = is_admin
+        self.use_pam_auth = use_pam_auth
+        self.sort = sort
+        self.order = order
+
+    @classmethod
+    def from_args(cls, args):
+        """Build filters from a query string, raising ValueError if invalid"""
+        def text(name):
+            value = str(args.get(name) or '').strip()
+            return value or None
+
+        def flag(name):
+            value = text(name)
+            if value is None:
+                return None
+            if value.lower() in _TRUE:
+                return True
+            if value.lower() in _FALSE:
+                return False
+            raise ValueError(f'Invalid {name} filter: {value!r}')
+
+        sort = text('sort') or 'created_at'
+        if sort not in SORT_KEYS:
+            raise ValueError(f'Invalid sort column: {sort!r}')
+        order = text('order') or ('asc' if sort == 'username' else 'desc')
+        if order not in ('asc', 'desc'):
+            raise ValueError(f'Invalid sort order: {order!r}')
+
+        return cls(q=text('q'), active=flag('active'),
+                   is_admin=flag('is_admin'),
+                   use_pam_auth=flag('use_pam_auth'), sort=sort, order=order)
+
+    @property
+    def filtered(self):
+        """Whether any filter (not just a sort order) is set"""
+        return self.q is not None or any(getattr(self, name) is not None
+                                         for name in FLAG_FILTERS)
+
+    @property
+    def columns(self):
+        """The keyset sort key for the chosen sort"""
+        return SORT_KEYS[self.sort]
+
+    @property
+    def descending(self):
+        return self.order == 'desc'
+
+    def apply(self, query):
+        """Restrict a user query to the matching users"""
+        if self.q is not None:
+            query = query.filter(or_(prefix_range(User.username, self.q),
+                                     prefix_range(User.email, self.q)))
+        for name in FLAG_FILTERS:
+            value = getattr(self, name)
+            if value is not None:
+                query = query.filter(getattr(User, name) == value)
+        return query
+
+    def to_args(self):
+        """Filters and sort as query string arguments for page links"""
+        args = {'q': self.q}
+        for name in FLAG_FILTERS:
+            value = getattr(self, name)
+            args[name] = None if value is None else str(value).lower()
+        if self.sort != 'created_at' or self.order != 'desc':
+            args['sort'] = self.sort
+            args['order'] = self.order
+        return {name: value for name, value in args.items()
+                if value is not None}
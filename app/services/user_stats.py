@@ -0,0 +1,127 @@
+"""
+User Statistics
+Cached user counters for the Lab Portal admin panel
+"""
+
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import case, event, func, inspect
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models.user import User
+
+# Columns whose changes alter the counters
+COUNTED_COLUMNS = ('active', 'is_admin', 'use_pam_auth')
+
+# Session key marking a transaction that changed the counters
+PENDING_KEY = 'user_stats_changed'
+
+
+class UserStats:
+    """User counters computed in one aggregate query and cached
+
+    The snapshot is dropped once a transaction that inserted or deleted
+    a user, or changed a counted column through the ORM, commits. Bulk
+    statements bypass ORM events, so code issuing them must call
+    ``invalidate()``; the TTL bounds staleness for changes made by other
+    processes. A snapshot computed while an invalidation happened is
+    returned but not cached.
+    """
+
+    def __init__(self, app=None):
+        self.ttl = 300.0
+        self._snapshot = None
+        self._expires = 0.0
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configure the stats cache from app config"""
+        self.ttl = float(app.config.get('USER_STATS_TTL', 300))
+        self.invalidate()
+        app.extensions['user_stats'] = self
+
+    def snapshot(self):
+        """Return the cached counters, recomputing them if stale"""
+        with self._lock:
+            if self._snapshot is not None and self._expires > time.monotonic():
+                self.hits += 1
+                return self._snapshot
+            generation = self._generation
+
+        snapshot = self.compute()
+        with self._lock:
+            self.misses += 1
+            if self._generation == generation:
+                self._snapshot = snapshot
+                self._expires = time.monotonic() + self.ttl
+        return snapshot
+
+    def compute(self):
+        """Compute all counters with a single aggregate query"""
+        def count_where(condition):
+            return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+        row = db.session.execute(
+            db.select(
+                func.count(User.id),
+                count_where(User.active.is_(True)),
+                count_where(User.is_admin.is_(True)),
+                count_where(User.use_pam_auth.is_(True)),
+            )
+        ).one()
+        return {
+            'total_users': row[0],
+            'active_users': row[1],
+            'admin_users': row[2],
+            'pam_users': row[3],
+            'computed_at': datetime.utcnow().isoformat(),
+        }
+
+    def invalidate(self):
+        """Drop the cached snapshot"""
+        with self._lock:
+            self._generation += 1
+            self._snapshot = None
+
+
+user_stats = UserStats()
+
+
+def _record_change(target):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info[PENDING_KEY] = True
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_delete')
+def _record_membership_change(mapper, connection, target):
+    _record_change(target)
+
+
+@event.listens_for(User, 'after_update')
+def _record_counted_change(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[name].history.has_changes()
+           for name in COUNTED_COLUMNS):
+        _record_change(target)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_on_commit(session):
+    if session.info.pop(PENDING_KEY, False):
+        user_stats.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_rolled_back_changes(session):
+    session.info.pop(PENDING_KEY, None)
@@ -4,10 +4,32 @@ Lab Portal CLI Commands
 Command-line utilities for Lab Portal management
 """
 
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import click
-from flask.cli import with_appcontext
+from flask.cli import ScriptInfo, with_appcontext
+from werkzeug.security import generate_password_hash
 from app import create_app, db
-from app.models.user import User, AuditLog
+from app.models import create_indexes
+from app.models.user import (MIN_SCRYPT_LOG_ROUNDS, User, AuditLog,
+                             password_hash_method, unit_of_work)
+from app.services.audit_archive import audit_archive
+from app.services.audit_export import (EXPORT_FORMATS, ExportStats,
+                                       stream_export)
+from app.services.audit_rollups import audit_rollups
+from app.services.audit_search import AuditSearch
+from app.services.password_hasher import PasswordHasher
+from app.services.streaming import write_stream
+from app.services.user_bulk import (BULK_ACTIONS, apply_bulk_action,
+                                    select_targets)
+from app.services.user_cache import user_cache
+from app.services.user_index import ensure_trigram_indexes
+from app.services.user_import import (IMPORT_FORMATS, ImportStats,
+                                      import_users as run_import, read_rows)
+from app.services.user_listing import LISTING_FORMATS, stream_users
+from app.services.user_search import UserSearch
 
 
 @click.command()
@@ -39,47 +61,93 @@ def create_admin(username, email, first_name, last_name, password):
         is_admin=True
     )
     
-    db.session.add(user)
-    db.session.commit()
-    
-    # Log the admin creation
-    AuditLog.log_action(
-        user_id=user.id,
-        action='admin_created',
-        resource_type='user',
-        details=f'Admin user created via CLI: {username}',
-        ip_address='127.0.0.1',
-        user_agent='CLI'
-    )
+    # Create the admin and its audit entry in one commit
+    with unit_of_work():
+        db.session.add(user)
+        db.session.flush()  # Assign user.id for the audit entry
+        AuditLog.log_action(
+            user_id=user.id,
+            action='admin_created',
+            resource_type='user',
+            details=f'Admin user created via CLI: {username}',
+            ip_address='127.0.0.1',
+            user_agent='CLI',
+            commit=False
+        )
     
     click.echo(f'Admin user {username} created successfully!')
 
 
 @click.command()
+@click.option('--format', 'fmt', type=click.Choice(LISTING_FORMATS),
+              default='table', show_default=True, help='Output format')
+@click.option('--prefix', help='Users whose username or email starts '
+                               'with this')
+@click.option('--active/--inactive', default=None,
+              help='Only active or inactive users')
+@click.option('--admin/--no-admin', 'is_admin', default=None,
+              help='Only admins or non-admins')
+@click.option('--pam/--no-pam', 'use_pam_auth', default=None,
+              help='Only PAM or database-authenticated users')
+@click.option('--limit', type=click.IntRange(min=0), default=None,
+              help='Stop after this many users')
+@click.option('--batch-size', default=1000, show_default=True,
+              help='Rows fetched from the database at a time')
 @with_appcontext
-def list_users():
-    """List all users"""
-    users = User.query.all()
-    
-    if not users:
-        click.echo('No users found.')
+def list_users(fmt, prefix, active, is_admin, use_pam_auth, limit,
+               batch_size):
+    """List users, streaming rows in constant memory"""
+    search = UserSearch(q=prefix, active=active, is_admin=is_admin,
+                        use_pam_auth=use_pam_auth)
+    write_stream(stream_users(search, fmt, limit=limit,
+                              batch_size=batch_size))
+
+
+@click.command()
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'fmt', type=click.Choice(IMPORT_FORMATS),
+              default=None, help='Input format [default: from extension]')
+@click.option('--batch-size', default=500, show_default=True,
+              help='Users validated, hashed and inserted per batch')
+@click.option('--dry-run', is_flag=True,
+              help='Validate and check uniqueness without inserting')
+@click.option('--actor', default=None,
+              help='Admin username the import is audited under '
+                   '[default: the first admin]')
+@with_appcontext
+def import_users(source, fmt, batch_size, dry_run, actor):
+    """Create users in bulk from a CSV or JSONL file (- for stdin)
+
+    Fields: username, email, first_name, last_name, password, is_admin,
+    use_pam_auth. PAM users need no password.
+    """
+    query = User.query.filter_by(is_admin=True)
+    if actor is not None:
+        query = query.filter_by(username=actor)
+    admin = query.order_by(User.id).first()
+    if not admin:
+        click.echo(f'Error: Admin {actor} not found!' if actor
+                   else 'Error: Create an admin before importing users.')
         return
     
-    click.echo('\nUsers:')
-    click.echo('-' * 80)
-    click.echo(f'{"ID":<4} {"Username":<20} {"Email":<30} '
-               f'{"Name":<20} {"Admin":<6} {"Active":<6}')
-    click.echo('-' * 80)
+    if fmt is None:
+        fmt = 'jsonl' if source.name.endswith(('.jsonl', '.ndjson')) \
+            else 'csv'
+    stats = ImportStats()
+    run_import(read_rows(source, fmt), admin.id, batch_size=batch_size,
+               dry_run=dry_run, stats=stats, source=f'CLI ({source.name})')
     
-    for user in users:
-        admin_status = 'Yes' if user.is_admin else 'No'
-        active_status = 'Yes' if user.active else 'No'
-        
-        click.echo(f'{user.id:<4} {user.username:<20} {user.email:<30} '
-                   f'{user.full_name:<20} {admin_status:<6} '
-                   f'{active_status:<6}')
+    for line, message in stats.errors:
+        click.echo(f'Line {line}: {message}', err=True)
+    unreported = stats.skipped + stats.invalid - len(stats.errors)
+    if unreported:
+        click.echo(f'... and {unreported} more', err=True)
     
-    click.echo(f'\nTotal users: {len(users)}')
+    verb = 'Would create' if dry_run else 'Created'
+    click.echo(f'{verb} {stats.created} users from {stats.rows} rows '
+               f'({stats.skipped} existing, {stats.invalid} invalid) '
+               f'in {stats.batches} batches in {stats.elapsed:.2f}s '
+               f'({stats.rows_per_second:.0f} rows/s)')
 
 
 @click.command()
@@ -97,39 +165,284 @@ def deactivate_user(username):
         click.echo(f'User {username} is already deactivated.')
         return
     
-    user.active = False
-    db.session.commit()
-    
-    # Log the deactivation
-    AuditLog.log_action(
-        user_id=user.id,
-        action='user_deactivated',
-        resource_type='user',
-        details=f'User deactivated via CLI: {username}',
-        ip_address='127.0.0.1',
-        user_agent='CLI'
-    )
+    # Deactivate and log in one commit
+    with unit_of_work():
+        user.active = False
+        AuditLog.log_action(
+            user_id=user.id,
+            action='user_deactivated',
+            resource_type='user',
+            details=f'User deactivated via CLI: {username}',
+            ip_address='127.0.0.1',
+            user_agent='CLI',
+            commit=False
+        )
+    user_cache.invalidate(user.id)
     
     click.echo(f'User {username} has been deactivated.')
 
 
+@click.command()
+@click.argument('action', type=click.Choice(list(BULK_ACTIONS)))
+@click.option('--username', 'usernames', multiple=True,
+              help='User to change (repeatable)')
+@click.option('--prefix', help='Users whose username or email starts '
+                               'with this')
+@click.option('--active/--inactive', default=None,
+              help='Only active or inactive users')
+@click.option('--admin/--no-admin', 'is_admin', default=None,
+              help='Only admins or non-admins')
+@click.option('--pam/--no-pam', 'use_pam_auth', default=None,
+              help='Only PAM or database-authenticated users')
+@click.option('--dry-run', is_flag=True, help='Only list affected users')
+@with_appcontext
+def bulk_update_users(action, usernames, prefix, active, is_admin,
+                      use_pam_auth, dry_run):
+    """Activate, deactivate or switch auth mode for many users at once"""
+    search = UserSearch(q=prefix, active=active, is_admin=is_admin,
+                        use_pam_auth=use_pam_auth)
+    user_ids = []
+    if usernames:
+        found = dict(db.session.execute(
+            db.select(User.username, User.id)
+            .where(User.username.in_(usernames))
+        ).all())
+        for username in sorted(set(usernames) - set(found)):
+            click.echo(f'Warning: User {username} not found.', err=True)
+        if not found:
+            return
+        user_ids = list(found.values())
+    
+    try:
+        targets = select_targets(action, user_ids=user_ids, search=search)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    
+    if not targets:
+        click.echo('No users need changing.')
+        return
+    if dry_run:
+        for target in targets:
+            click.echo(f'{target.id:<6} {target.username}')
+        click.echo(f'\nWould {action.replace("_", " ")} {len(targets)} '
+                   f'users.')
+        return
+    
+    started = time.perf_counter()
+    changed = apply_bulk_action(action, targets, ip_address='127.0.0.1',
+                                user_agent='CLI')
+    click.echo(f'{BULK_ACTIONS[action][3].capitalize()} {changed} users '
+               f'in {time.perf_counter() - started:.2f}s')
+
+
+@click.command()
+@click.option('--min-rounds', default=10, show_default=True,
+              help='Smallest log2 work factor to measure')
+@click.option('--max-rounds', default=17, show_default=True,
+              help='Largest log2 work factor to measure')
+@click.option('--method', default=None,
+              help='Benchmark one explicit Werkzeug method instead')
+@click.option('--samples', default=20, show_default=True,
+              help='Hashes to time per setting')
+@click.option('--target-ms', default=250.0, show_default=True,
+              help='Target p99 hashing time per login')
+def benchmark_hashing(min_rounds, max_rounds, method, samples, target_ms):
+    """Measure password hashing cost to pick BCRYPT_LOG_ROUNDS"""
+    if method:
+        settings = [(None, method)]
+    else:
+        min_rounds = max(min_rounds, MIN_SCRYPT_LOG_ROUNDS)
+        settings = [(rounds, f'scrypt:{2 ** rounds}:8:1')
+                    for rounds in range(min_rounds, max_rounds + 1)]
+    
+    click.echo(f'{"Rounds":<7} {"Method":<24} {"Hashes/s/core":>14} '
+               f'{"p50 ms":>9} {"p99 ms":>9}')
+    click.echo('-' * 67)
+    
+    recommended = None
+    for rounds, hash_method in settings:
+        timings = []
+        for _ in range(samples):
+            started = time.perf_counter()
+            generate_password_hash('benchmark-password', method=hash_method)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        p50 = timings[len(timings) // 2]
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        rate = 1000 * len(timings) / sum(timings)
+        
+        click.echo(f'{rounds if rounds is not None else "-":<7} '
+                   f'{hash_method:<24} {rate:>14.1f} {p50:>9.1f} '
+                   f'{p99:>9.1f}')
+        if rounds is not None and p99 <= target_ms:
+            recommended = rounds
+    
+    if recommended is not None:
+        click.echo(f'\nHighest cost within {target_ms:.0f} ms p99: '
+                   f'BCRYPT_LOG_ROUNDS={recommended}')
+    elif not method:
+        click.echo(f'\nNo measured cost meets {target_ms:.0f} ms p99.')
+
+
+@click.command()
+@click.option('--logins', default=200, show_default=True,
+              help='Password verifications per run')
+@click.option('--concurrency', default=None,
+              help='Comma-separated client thread counts '
+                   '[default: 1,2,4,... up to the core count]')
+@with_appcontext
+def loadtest_hashing(logins, concurrency):
+    """Compare login verification throughput in-thread and pooled"""
+    if concurrency:
+        levels = [int(level) for level in concurrency.split(',')]
+    else:
+        cores = os.cpu_count() or 1
+        levels = [1]
+        while levels[-1] * 2 <= cores:
+            levels.append(levels[-1] * 2)
+    
+    pwhash = generate_password_hash('loadtest-password',
+                                    method=password_hash_method())
+    modes = {
+        'thread': PasswordHasher(request_only=False),
+        'process': PasswordHasher(request_only=False),
+    }
+    modes['process'].workers = max(levels)
+    # Start the worker processes before timing
+    modes['process'].hash_many(['warmup'] * max(levels),
+                               password_hash_method())
+    
+    click.echo(f'Method: {password_hash_method()}')
+    click.echo(f'{"Mode":<8} {"Clients":>8} {"Logins/s":>10} '
+               f'{"Speedup":>8}')
+    click.echo('-' * 37)
+    
+    try:
+        for mode, hasher in modes.items():
+            baseline = None
+            for level in levels:
+                with ThreadPoolExecutor(max_workers=level) as clients:
+                    started = time.perf_counter()
+                    results = list(clients.map(
+                        lambda _: hasher.verify(pwhash, 'loadtest-password'),
+                        range(logins)
+                    ))
+                    elapsed = time.perf_counter() - started
+                assert all(results)
+                
+                rate = logins / elapsed
+                baseline = baseline or rate
+                click.echo(f'{mode:<8} {level:>8} {rate:>10.1f} '
+                           f'{rate / baseline:>7.2f}x')
+    finally:
+        modes['process'].shutdown()
+
+
+@click.command()
+@click.option('--retention-days', default=None, type=int,
+              help='Keep this many days live [default: AUDIT_RETENTION_DAYS]')
+@click.option('--batch-size', default=1000, show_default=True,
+              help='Entries read and deleted per statement')
+@click.option('--dry-run', is_flag=True,
+              help='Only report what would be archived')
+@with_appcontext
+def archive_audit_logs(retention_days, batch_size, dry_run):
+    """Move audit log months past the retention horizon to archive files"""
+    if retention_days is not None:
+        audit_archive.retention_days = retention_days
+    horizon = audit_archive.horizon()
+    if horizon is None:
+        click.echo('Audit log retention is disabled.')
+        return
+    
+    click.echo(f'Archiving audit logs before {horizon:%Y-%m-%d} '
+               f'to {audit_archive.directory}')
+    if not dry_run:
+        # Count entries into the rollups before they leave the table
+        audit_rollups.compact()
+    started = time.perf_counter()
+    results = audit_archive.archive(batch_size=batch_size, dry_run=dry_run)
+    elapsed = time.perf_counter() - started
+    
+    if not results:
+        click.echo('Nothing to archive.')
+        return
+    
+    for start, count in results:
+        verb = 'would archive' if dry_run else 'archived'
+        click.echo(f'{start:%Y-%m}: {verb} {count} entries')
+    total = sum(count for _, count in results)
+    if not dry_run:
+        click.echo(f'\nArchived {total} entries in {elapsed:.1f}s '
+                   f'({total / max(elapsed, 1e-9):.0f} rows/s)')
+
+
+@click.command()
+@click.option('--format', 'fmt', type=click.Choice(EXPORT_FORMATS),
+              default='csv', show_default=True, help='Output format')
+@click.option('--gzip', 'compress', is_flag=True, help='Gzip the output')
+@click.option('--output', '-o', default='-', show_default=True,
+              help='File to write, or - for stdout')
+@click.option('--batch-size', default=1000, show_default=True,
+              help='Rows fetched per query')
+@click.option('--user-id', type=int, help='Only entries by this user id')
+@click.option('--action', help='Only entries with this action')
+@click.option('--resource-type', help='Only entries for this resource type')
+@click.option('--ip-address', help='Only entries from this IP address')
+@click.option('--since', type=click.DateTime(), help='Earliest timestamp')
+@click.option('--until', type=click.DateTime(), help='Latest timestamp')
+@with_appcontext
+def export_audit_logs(fmt, compress, output, batch_size, user_id, action,
+                      resource_type, ip_address, since, until):
+    """Stream audit logs to CSV or JSONL with constant memory"""
+    search = AuditSearch(user_id=user_id, action=action,
+                         resource_type=resource_type, ip_address=ip_address,
+                         since=since, until=until)
+    stats = ExportStats()
+    chunks = stream_export(search, fmt, compress=compress,
+                           batch_size=batch_size, stats=stats)
+    
+    mode = 'wb' if compress else 'w'
+    with click.open_file(output, mode, encoding=None if compress
+                         else 'utf-8') as out:
+        for chunk in chunks:
+            out.write(chunk)
+    
+    click.echo(f'Exported {stats.rows} entries in {stats.batches} batches '
+               f'in {stats.elapsed:.2f}s '
+               f'({stats.rows_per_second:.0f} rows/s)', err=True)
+
+
+@click.command()
+@with_appcontext
+def compact_rollups():
+    """Fold new audit log entries into the analytics rollups"""
+    started = time.perf_counter()
+    counted, last_id = audit_rollups.compact()
+    elapsed = time.perf_counter() - started
+    
+    click.echo(f'Counted {counted} entries up to audit id {last_id} '
+               f'in {elapsed:.2f}s')
+
+
 @click.command()
 @with_appcontext
 def init_db():
     """Initialize the database with tables"""
     db.create_all()
     click.echo('Database tables created successfully!')
+    for name in create_indexes():
+        click.echo(f'Created missing index {name}')
+    if ensure_trigram_indexes():
+        click.echo('User search trigram indexes are in place')
+
+
+# Registered on every app by app.register_commands
+COMMANDS = (create_admin, list_users, import_users, deactivate_user,
+            bulk_update_users, benchmark_hashing, loadtest_hashing,
+            archive_audit_logs, export_audit_logs, compact_rollups, init_db)
 
 
 if __name__ == '__main__':
     app = create_app()
-    
-    # Register CLI commands
-    app.cli.add_command(create_admin)
-    app.cli.add_command(list_users)
-    app.cli.add_command(deactivate_user)
-    app.cli.add_command(init_db)
-    
-    with app.app_context():
-        # You can call commands directly here if needed
-        pass
+    app.cli.main(obj=ScriptInfo(create_app=lambda: app))
@@ -4,28 +4,38 @@ User Management CLI
 Direct database user management for Lab Portal
 """
 
+import argparse
 import sys
 import os
 sys.path.append('.')
 
 from app import create_app, db
 from app.models.user import User
+from app.services.streaming import write_stream
+from app.services.user_listing import (LISTING_FORMATS, iter_user_batches,
+                                       stream_users)
+from app.services.user_search import UserSearch
 
 
-def list_users():
-    """List all users in the database"""
-    users = User.query.all()
-    print(f"\n📋 Total Users: {len(users)}")
-    print("=" * 50)
+def list_users(fmt='table', search=None, limit=None):
+    """List users, streaming projected rows instead of ORM objects"""
+    if fmt != 'table':
+        write_stream(stream_users(search, fmt, limit=limit))
+        return None
     
-    for user in users:
-        auth_method = "PAM (System)" if user.is_admin else "Database"
-        status = "Admin" if user.is_admin else "Regular"
-        print(f"• {user.username:15} | {status:7} | {auth_method}")
-        if user.email:
-            print(f"  Email: {user.email}")
-        print()
-    return users
+    print("=" * 50)
+    total = 0
+    for rows in iter_user_batches(search, limit=limit):
+        for user in rows:
+            auth_method = "PAM (System)" if user.use_pam_auth else "Database"
+            status = "Admin" if user.is_admin else "Regular"
+            print(f"• {user.username:15} | {status:7} | {auth_method}")
+            if user.email:
+                print(f"  Email: {user.email}")
+            print()
+        total += len(rows)
+    print(f"📋 Total Users: {total}")
+    return total
 
 
 def delete_user(username):
@@ -42,15 +52,35 @@ def delete_user(username):
         return False
 
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--format', dest='fmt', choices=LISTING_FORMATS,
+                        default='table', help='Output format')
+    parser.add_argument('--prefix',
+                        help='Only users whose username or email starts '
+                             'with this')
+    parser.add_argument('--limit', type=int, help='Stop after this many users')
+    parser.add_argument('--list-only', action='store_true',
+                        help='Only list users; change nothing')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    search = UserSearch(q=args.prefix)
     app = create_app()
     
     with app.app_context():
+        if args.list_only or args.fmt != 'table':
+            # Machine-readable output stays free of decoration
+            list_users(args.fmt, search, args.limit)
+            return True
+        
         print("🚀 Lab Portal User Management")
         print("=" * 40)
         
         # List current users
-        users = list_users()
+        list_users(search=search, limit=args.limit)
         
         # Delete tonny user if exists
         tonny_user = User.query.filter_by(username='tonny').first()
@@ -59,7 +89,7 @@ def main():
             delete_user('tonny')
             
             print("\n📋 Updated user list:")
-            list_users()
+            list_users(search=search, limit=args.limit)
         else:
             print("\n✅ No 'tonny' user found in database")
         
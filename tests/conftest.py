@@ -4,6 +4,7 @@ Pytest configuration and shared fixtures for Lab Portal tests
 """
 
 import pytest
+
 from app import create_app, db
 from app.models.user import User, AuditLog
 
@@ -220,4 +221,4 @@ def create_test_user(username, email, password, is_admin=False,
     db.session.add(user)
     db.session.commit()
     
-    return user
\ No newline at end of file
+    return user
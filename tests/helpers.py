@@ -0,0 +1,31 @@
+"""
+Test Helpers
+Assertions shared by Lab Portal tests
+"""
+
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from app import db
+
+
+@contextmanager
+def assert_max_queries(limit):
+    """Helper context manager failing if more than ``limit`` statements run.
+
+    Yields the list of executed SQL statements for finer assertions.
+    """
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    assert len(statements) <= limit, (
+        f'{len(statements)} queries executed, expected at most {limit}:\n' +
+        '\n'.join(statements))
@@ -0,0 +1,702 @@
+"""
+Admin Tests
+Tests for the administrative interface and its services
+"""
+
+import csv
+import io
+import json
+import threading
+from datetime import datetime
+
+import pytest
+
+from app import db
+from app.models.analytics import AuditRollup, RollupWatermark
+from app.models.user import AuditLog, User
+from app.services.audit_rollups import AuditRollups
+from app.services.user_bulk import apply_bulk_action, select_targets
+from app.services.user_index import UserIndex, user_index
+from app.services.user_listing import iter_user_batches, stream_users
+from app.services.user_search import UserSearch
+from app.services.user_stats import user_stats
+from tests.helpers import assert_max_queries
+
+
+@pytest.fixture
+def fresh_stats(app_context):
+    """The global user stats cache with any stale snapshot dropped."""
+    user_stats.invalidate()
+    yield user_stats
+    user_stats.invalidate()
+
+
+@pytest.mark.admin
+class TestUserStats:
+    """Test cases for the cached admin statistics."""
+
+    def test_counts_in_one_query(self, fresh_stats, admin_user):
+        """Test all counters come from a single statement."""
+        with assert_max_queries(1) as statements:
+            stats = fresh_stats.snapshot()
+            fresh_stats.snapshot()
+
+        assert len(statements) == 1
+        assert stats['total_users'] == 1
+        assert stats['active_users'] == 1
+        assert stats['admin_users'] == 1
+        assert stats['pam_users'] == 0
+
+    def test_invalidated_by_user_changes(self, fresh_stats, admin_user):
+        """Test ORM inserts and toggles drop the snapshot."""
+        assert fresh_stats.snapshot()['total_users'] == 1
+
+        user = User(username='statsuser', email='stats@example.com',
+                    first_name='Stats', last_name='User',
+                    password='testpassword123')
+        db.session.add(user)
+        db.session.commit()
+        assert fresh_stats.snapshot()['total_users'] == 2
+
+        user.active = False
+        db.session.commit()
+        assert fresh_stats.snapshot()['active_users'] == 1
+
+    def test_unrelated_update_keeps_snapshot(self, fresh_stats, admin_user):
+        """Test last-login updates do not invalidate the snapshot."""
+        fresh_stats.snapshot()
+        misses = fresh_stats.misses
+
+        admin_user.update_last_login()
+        fresh_stats.snapshot()
+        assert fresh_stats.misses == misses
+
+    def test_invalidated_at_commit(self, fresh_stats, admin_user):
+        """Test a flushed but uncommitted change keeps the snapshot."""
+        fresh_stats.snapshot()
+        misses = fresh_stats.misses
+
+        admin_user.active = False
+        db.session.flush()
+        fresh_stats.snapshot()
+        assert fresh_stats.misses == misses
+
+        db.session.rollback()
+        fresh_stats.snapshot()
+        assert fresh_stats.misses == misses
+        assert admin_user.active
+
+    def test_racing_invalidation_is_not_cached(self, fresh_stats,
+                                               admin_user, monkeypatch):
+        """Test a snapshot computed across an invalidation is not kept."""
+        compute = fresh_stats.compute
+
+        def invalidated_compute():
+            snapshot = compute()
+            fresh_stats.invalidate()
+            return snapshot
+
+        monkeypatch.setattr(fresh_stats, 'compute', invalidated_compute)
+        fresh_stats.snapshot()
+        monkeypatch.undo()
+        misses = fresh_stats.misses
+
+        fresh_stats.snapshot()
+        assert fresh_stats.misses == misses + 1
+
+    def test_stats_api(self, logged_in_admin, fresh_stats):
+        """Test the JSON statistics endpoint."""
+        response = logged_in_admin.get('/admin/api/stats')
+
+        assert response.status_code == 200
+        assert response.get_json()['admin_users'] == 1
+
+    def test_stats_api_requires_admin(self, logged_in_user):
+        """Test regular users cannot read statistics."""
+        response = logged_in_user.get('/admin/api/stats')
+        assert response.status_code == 302
+
+
+@pytest.fixture
+def rollups(app_context):
+    """A rollup compactor over empty rollup tables."""
+    AuditRollup.query.delete()
+    RollupWatermark.query.delete()
+    db.session.commit()
+    compactor = AuditRollups()
+    compactor.settle_seconds = 0
+    yield compactor
+    AuditRollup.query.delete()
+    RollupWatermark.query.delete()
+    db.session.commit()
+
+
+@pytest.fixture
+def rollup_user(app_context, admin_user):
+    """A second account next to ``admin_user``.
+
+    The ``regular_user`` fixture cannot be combined with ``admin_user``:
+    it deletes every existing user first.
+    """
+    user = User(username='rollupuser', email='rollupuser@example.com',
+                first_name='Rollup', last_name='User',
+                password='testpassword123')
+    db.session.add(user)
+    db.session.commit()
+    yield user
+    AuditLog.query.filter_by(user_id=user.id).delete()
+    db.session.delete(user)
+    db.session.commit()
+
+
+@pytest.fixture
+def login_events(app_context, admin_user, rollup_user):
+    """Logins, failures and a registration over two days."""
+    events = [
+        (admin_user, 'login', '10.0.0.1', datetime(2026, 3, 1, 9, 15)),
+        (admin_user, 'login', '10.0.0.1', datetime(2026, 3, 1, 9, 45)),
+        (rollup_user, 'register', '10.0.0.2', datetime(2026, 3, 1, 10, 5)),
+        (rollup_user, 'login_failed', '10.0.0.9',
+         datetime(2026, 3, 2, 8, 0)),
+        (rollup_user, 'login_failed', '10.0.0.9',
+         datetime(2026, 3, 2, 8, 1)),
+        (admin_user, 'logout', '10.0.0.1', datetime(2026, 3, 2, 8, 30)),
+    ]
+    for user, action, ip_address, moment in events:
+        log = AuditLog(user_id=user.id, action=action,
+                       resource_type='authentication', ip_address=ip_address)
+        log.timestamp = moment
+        db.session.add(log)
+    db.session.commit()
+    return events
+
+
+def rollup_count(metric, granularity, dimension, value, bucket):
+    """Helper returning one rollup row's count, or 0."""
+    rollup = AuditRollup.query.filter_by(
+        metric=metric, granularity=granularity, dimension=dimension,
+        dimension_value=value, bucket=bucket).first()
+    return rollup.count if rollup else 0
+
+
+@pytest.mark.admin
+class TestAuditRollups:
+    """Test cases for the login analytics rollups."""
+
+    def test_compaction_counts_by_dimension(self, rollups, login_events,
+                                            admin_user):
+        """Test entries are counted per bucket, user and IP."""
+        counted, _ = rollups.compact(now=datetime(2026, 3, 3))
+
+        assert counted == 5
+        assert rollup_count('logins', 'day', 'all', '',
+                            datetime(2026, 3, 1)) == 2
+        assert rollup_count('logins', 'hour', 'all', '',
+                            datetime(2026, 3, 1, 9)) == 2
+        assert rollup_count('logins', 'day', 'user', str(admin_user.id),
+                            datetime(2026, 3, 1)) == 2
+        assert rollup_count('failed_logins', 'hour', 'ip', '10.0.0.9',
+                            datetime(2026, 3, 2, 8)) == 2
+        assert rollup_count('registrations', 'day', 'all', '',
+                            datetime(2026, 3, 1)) == 1
+
+    def test_compaction_is_incremental(self, rollups, login_events,
+                                       admin_user):
+        """Test re-running only folds in entries past the watermark."""
+        rollups.compact(now=datetime(2026, 3, 3))
+        assert rollups.compact(now=datetime(2026, 3, 3))[0] == 0
+
+        log = AuditLog(user_id=admin_user.id, action='login',
+                       resource_type='authentication', ip_address='10.0.0.1')
+        log.timestamp = datetime(2026, 3, 1, 11, 0)
+        db.session.add(log)
+        db.session.commit()
+
+        counted, last_id = rollups.compact(now=datetime(2026, 3, 3))
+        assert counted == 1
+        assert last_id == log.id
+        assert rollup_count('logins', 'day', 'all', '',
+                            datetime(2026, 3, 1)) == 3
+
+    def test_unsettled_entries_wait(self, rollups, login_events):
+        """Test entries newer than the settle window are left for later."""
+        rollups.settle_seconds = 3600
+        counted, _ = rollups.compact(now=datetime(2026, 3, 2, 8, 30))
+
+        assert counted == 3
+        assert rollup_count('failed_logins', 'day', 'all', '',
+                            datetime(2026, 3, 2)) == 0
+
+    def test_small_batches(self, rollups, login_events):
+        """Test compaction walks the table in bounded batches."""
+        rollups.batch_size = 2
+        assert rollups.compact(now=datetime(2026, 3, 3))[0] == 5
+
+    def test_dashboard_reads_only_rollups(self, rollups, login_events,
+                                          rollup_user):
+        """Test dashboard analytics never query the audit table."""
+        rollups.compact(now=datetime(2026, 3, 3))
+
+        with assert_max_queries(5) as statements:
+            data = rollups.dashboard(days=3, now=datetime(2026, 3, 2, 12))
+
+        assert not any('audit_logs' in statement
+                       for statement in statements)
+        assert data['days'] == ['2026-02-28', '2026-03-01', '2026-03-02']
+        assert data['series']['logins'] == [0, 2, 0]
+        assert data['series']['failed_logins'] == [0, 0, 2]
+        assert data['top_failed_ips'] == [{'ip_address': '10.0.0.9',
+                                           'count': 2}]
+        assert data['top_failed_users'][0]['username'] == \
+            rollup_user.username
+
+    def test_analytics_api(self, logged_in_admin, rollups):
+        """Test the JSON analytics endpoint."""
+        response = logged_in_admin.get('/admin/api/analytics?days=7')
+
+        assert response.status_code == 200
+        data = response.get_json()
+        assert len(data['days']) == 7
+        assert set(data['series']) == {'logins', 'failed_logins',
+                                       'registrations'}
+
+    def test_compact_command(self, runner, rollups, login_events):
+        """Test the CLI command reports what it counted."""
+        from cli import compact_rollups
+
+        result = runner.invoke(compact_rollups)
+
+        assert result.exit_code == 0, result.output
+        assert 'Counted 5 entries' in result.output
+
+
+    def test_compact_command_is_registered(self, runner, rollups,
+                                           login_events):
+        """Test ``flask compact-rollups`` reaches the command."""
+        result = runner.invoke(args=['compact-rollups'])
+
+        assert result.exit_code == 0, result.output
+        assert 'Counted 5 entries' in result.output
+
+@pytest.fixture
+def lab_users(app_context, admin_user):
+    """Thirty accounts with distinct creation times and mixed flags."""
+    users = []
+    for i in range(30):
+        user = User(username=f'lab{i:02d}', email=f'lab{i:02d}@example.com',
+                    first_name='Lab', last_name=f'User{i}',
+                    use_pam_auth=True)
+        user.use_pam_auth = i % 3 == 0
+        user.active = i % 5 != 0
+        user.created_at = datetime(2026, 1, 1, 12, i)
+        users.append(user)
+    db.session.add_all(users)
+    db.session.commit()
+    usernames = [user.username for user in users]
+    user_stats.invalidate()
+    yield usernames
+    User.query.filter(User.username.in_(usernames)).delete()
+    db.session.commit()
+    user_stats.invalidate()
+
+
+def fetch_users(client, **args):
+    """Helper returning the JSON user listing for ``args``."""
+    response = client.get('/admin/api/users', query_string=args)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+@pytest.mark.admin
+class TestUserListing:
+    """Test cases for the paginated admin user listing."""
+
+    def test_pages_cover_all_users_once(self, logged_in_admin, lab_users):
+        """Test walking next cursors visits every user exactly once."""
+        seen = []
+        page = fetch_users(logged_in_admin, per_page=7)
+        assert page['total'] == 31
+        while True:
+            seen.extend(item['username'] for item in page['items'])
+            if not page['next_cursor']:
+                break
+            page = fetch_users(logged_in_admin, per_page=7,
+                               cursor=page['next_cursor'])
+
+        assert len(seen) == 31
+        assert set(seen) == set(lab_users) | {'testadmin'}
+        # Newest first by default
+        assert seen[:2] == ['testadmin', 'lab29']
+
+    def test_previous_page(self, logged_in_admin, lab_users):
+        """Test the previous cursor returns the earlier page."""
+        first = fetch_users(logged_in_admin, per_page=5)
+        second = fetch_users(logged_in_admin, per_page=5,
+                             cursor=first['next_cursor'])
+        back = fetch_users(logged_in_admin, per_page=5,
+                           cursor=second['prev_cursor'], direction='prev')
+
+        assert back['items'] == first['items']
+
+    def test_sort_by_username(self, logged_in_admin, lab_users):
+        """Test sorting by username ascends by default."""
+        page = fetch_users(logged_in_admin, sort='username', per_page=3)
+        assert [item['username'] for item in page['items']] == \
+            ['lab00', 'lab01', 'lab02']
+        assert page['filters'] == {'sort': 'username', 'order': 'asc'}
+
+    def test_prefix_filter(self, logged_in_admin, lab_users):
+        """Test q matches username or email prefixes."""
+        page = fetch_users(logged_in_admin, q='lab1')
+        assert sorted(item['username'] for item in page['items']) == \
+            [f'lab1{i}' for i in range(10)]
+        assert page['total'] is None
+
+        page = fetch_users(logged_in_admin, q='testadmin@')
+        assert [item['username'] for item in page['items']] == ['testadmin']
+
+    def test_prefix_filter_ignores_case(self, logged_in_admin, lab_users):
+        """Test q matches prefixes regardless of case, as ILIKE did."""
+        page = fetch_users(logged_in_admin, q='LAB0')
+        assert sorted(item['username'] for item in page['items']) == \
+            [f'lab0{i}' for i in range(10)]
+
+        page = fetch_users(logged_in_admin, q='TestAdmin@Example')
+        assert [item['username'] for item in page['items']] == ['testadmin']
+
+    def test_prefix_filter_uses_lower_index(self, app_context):
+        """Test the prefix range is read from the lower() indexes."""
+        from app.services.user_search import UserSearch
+
+        query = UserSearch(q='Ali').apply(User.query)
+        compiled = query.statement.compile(
+            db.engine, compile_kwargs={'literal_binds': True})
+        plan = ' '.join(row[3] for row in db.session.connection()
+                        .exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}'))
+
+        assert 'ix_users_username_lower' in plan
+        assert 'ix_users_email_lower' in plan
+
+    def test_flag_filters(self, logged_in_admin, lab_users):
+        """Test active, admin and PAM filters combine."""
+        page = fetch_users(logged_in_admin, active='false',
+                           use_pam_auth='true')
+        assert sorted(item['username'] for item in page['items']) == \
+            ['lab00', 'lab15']
+
+        page = fetch_users(logged_in_admin, is_admin='yes')
+        assert [item['username'] for item in page['items']] == ['testadmin']
+
+    def test_invalid_filter(self, logged_in_admin, lab_users):
+        """Test bad filter values are rejected."""
+        response = logged_in_admin.get('/admin/api/users?active=maybe')
+        assert response.status_code == 400
+        response = logged_in_admin.get('/admin/api/users?sort=password')
+        assert response.status_code == 400
+
+    def test_projects_listed_columns(self, logged_in_admin, lab_users):
+        """Test the listing selects only the displayed columns."""
+        with assert_max_queries(3) as statements:
+            fetch_users(logged_in_admin, per_page=10)
+
+        listing = [statement for statement in statements
+                   if 'ORDER BY' in statement]
+        assert len(listing) == 1
+        assert 'password_hash' not in listing[0]
+
+    def test_page_renders_filters(self, logged_in_admin, lab_users):
+        """Test the HTML page paginates and keeps filters in links."""
+        response = logged_in_admin.get('/admin/users?q=lab&use_pam_auth=true')
+
+        assert response.status_code == 200
+        assert b'lab03' in response.data
+        assert b'lab04' not in response.data
+        assert b'Matching Users' in response.data
+
+
+@pytest.fixture
+def search_index(lab_users):
+    """The global user search index rebuilt over the lab users."""
+    user_index.build()
+    yield user_index
+    user_index.invalidate()
+
+
+def usernames(results):
+    """Helper listing the usernames of search results."""
+    return [result['username'] for result in results]
+
+
+@pytest.mark.admin
+class TestUserSearchIndex:
+    """Test cases for the typeahead user search index."""
+
+    def test_prefix_lookup(self, search_index):
+        """Test every field matches by case-insensitive prefix."""
+        assert usernames(search_index.search('LAB0', limit=3)) == \
+            ['lab00', 'lab01', 'lab02']
+        assert usernames(search_index.search('lab17@')) == ['lab17']
+        assert usernames(search_index.search('user29')) == ['lab29']
+        assert usernames(search_index.search('test')) == ['testadmin']
+        assert search_index.search('nobody') == []
+
+    def test_all_terms_must_match(self, search_index):
+        """Test multi-word queries match users satisfying every term."""
+        assert usernames(search_index.search('lab user2', limit=20)) == \
+            ['lab02'] + [f'lab2{i}' for i in range(10)]
+
+    def test_lookup_without_queries(self, search_index):
+        """Test a built index answers from memory."""
+        with assert_max_queries(0):
+            search_index.search('lab')
+
+    def test_committed_changes_are_applied(self, search_index):
+        """Test inserts, renames and deletes show up after commit."""
+        user = User.query.filter_by(username='lab05').first()
+        user.username = 'renamed05'
+        db.session.commit()
+        assert usernames(search_index.search('renamed')) == ['renamed05']
+        assert 'lab05' not in usernames(search_index.search('lab', 50))
+
+        db.session.delete(user)
+        db.session.commit()
+        assert search_index.search('renamed') == []
+
+    def test_rolled_back_changes_are_discarded(self, search_index):
+        """Test uncommitted changes never reach the index."""
+        user = User.query.filter_by(username='lab06').first()
+        user.username = 'ghost06'
+        db.session.flush()
+        db.session.rollback()
+
+        assert search_index.search('ghost') == []
+        assert usernames(search_index.search('lab06')) == ['lab06']
+
+    def test_invalidate_rebuilds(self, search_index):
+        """Test bulk changes are picked up after invalidation."""
+        User.query.filter_by(username='lab07').update(
+            {'first_name': 'Bulk'})
+        db.session.commit()
+        assert search_index.search('bulk') == []
+
+        search_index.invalidate()
+        assert usernames(search_index.search('bulk')) == ['lab07']
+
+    def test_expired_index_rebuilds_in_background(self, search_index,
+                                                  monkeypatch):
+        """Test an expired index keeps answering while it is rebuilt."""
+        User.query.filter_by(username='lab08').update(
+            {'first_name': 'Background'})
+        db.session.commit()
+        release = threading.Event()
+        build = search_index.build
+
+        def held_build():
+            release.wait(5)
+            build()
+
+        monkeypatch.setattr(search_index, 'build', held_build)
+        search_index._expires = 0.0
+
+        assert search_index.search('background') == []
+        assert usernames(search_index.search('lab08')) == ['lab08']
+        release.set()
+        search_index._rebuilder.join(timeout=5)
+        assert usernames(search_index.search('background')) == ['lab08']
+
+    def test_independent_index(self, lab_users):
+        """Test a new index builds itself on first lookup."""
+        index = UserIndex()
+        assert usernames(index.search('lab1', limit=2)) == ['lab10', 'lab11']
+        assert index.stats()['users'] == 31
+
+    def test_search_endpoint(self, logged_in_admin, search_index):
+        """Test the typeahead endpoint returns matching users."""
+        response = logged_in_admin.get('/admin/api/users/search?q=Lab2&limit=3')
+
+        assert response.status_code == 200
+        data = response.get_json()
+        assert usernames(data['items']) == ['lab20', 'lab21', 'lab22']
+        assert data['items'][0]['full_name'] == 'Lab User20'
+
+    def test_search_endpoint_requires_admin(self, logged_in_user):
+        """Test regular users cannot search accounts."""
+        response = logged_in_user.get('/admin/api/users/search?q=a')
+        assert response.status_code == 302
+
+
+def bulk_audit_entries(action):
+    """Helper returning the audit entries of a bulk change."""
+    return AuditLog.query.filter(AuditLog.action == action,
+                                 AuditLog.details.contains('(bulk')).all()
+
+
+@pytest.mark.admin
+class TestBulkUserOperations:
+    """Test cases for set-based bulk user changes."""
+
+    def test_selected_users(self, lab_users, admin_user):
+        """Test selected users change with a fixed statement budget."""
+        ids = [user.id for user in User.query.filter(
+            User.username.in_(['lab01', 'lab02', 'lab03', 'lab05'])).all()]
+        admin_user.username  # Load the acting user before counting
+
+        with assert_max_queries(3) as statements:
+            targets = select_targets('deactivate', user_ids=ids)
+            changed = apply_bulk_action('deactivate', targets,
+                                        actor=admin_user)
+
+        # lab05 was already inactive and is left alone
+        assert changed == 3
+        assert sum(statement.startswith('UPDATE')
+                   for statement in statements) == 1
+        db.session.expire_all()
+        assert User.query.filter(User.username.in_(
+            ['lab01', 'lab02', 'lab03'])).filter_by(active=False).count() \
+            == 3
+        entries = bulk_audit_entries('user_deactivated')
+        assert sorted(entry.resource_id for entry in entries) == \
+            sorted(str(target.id) for target in targets)
+        assert {entry.user_id for entry in entries} == {admin_user.id}
+
+    def test_filtered_users(self, lab_users):
+        """Test a filter selects every matching user."""
+        targets = select_targets('enable_pam',
+                                 search=UserSearch(q='lab1'))
+        before = datetime.utcnow()
+        changed = apply_bulk_action('enable_pam', targets)
+
+        # lab12 and lab15 (multiples of three) already use PAM
+        assert changed == 7
+        db.session.expire_all()
+        user = User.query.filter_by(username='lab11').first()
+        assert user.use_pam_auth is True
+        assert user.updated_at >= before
+        # CLI changes are attributed to the changed users themselves
+        entry = bulk_audit_entries('pam_enabled')[0]
+        assert entry.user_id == int(entry.resource_id)
+
+    def test_requires_selection(self, lab_users):
+        """Test bulk actions refuse to touch every user implicitly."""
+        with pytest.raises(ValueError, match='Select users'):
+            select_targets('deactivate')
+        with pytest.raises(ValueError, match='Select users'):
+            select_targets('deactivate', search=UserSearch(sort='username'))
+        with pytest.raises(ValueError, match='Unknown bulk action'):
+            select_targets('delete', user_ids=[1])
+
+    def test_caches_are_invalidated(self, lab_users, monkeypatch):
+        """Test affected users are dropped from the user caches."""
+        from app.services import user_bulk
+
+        invalidated = []
+        monkeypatch.setattr(user_bulk.user_cache, 'invalidate',
+                            lambda *ids: invalidated.extend(ids))
+        user_stats.snapshot()
+        targets = select_targets('activate',
+                                 search=UserSearch(active=False))
+        apply_bulk_action('activate', targets)
+
+        assert sorted(invalidated) == sorted(target.id for target in targets)
+        assert user_stats.snapshot()['active_users'] == 31
+
+    def test_bulk_form(self, logged_in_admin, lab_users, admin_user):
+        """Test the user page form applies to all matching users."""
+        response = logged_in_admin.post('/admin/users/bulk', data={
+            'action': 'deactivate', 'scope': 'filter', 'is_admin': 'true'})
+
+        assert response.status_code == 302
+        # The only admin is the one acting, who cannot be deactivated
+        db.session.expire_all()
+        assert db.session.get(User, admin_user.id).active is True
+
+    def test_bulk_form_selected(self, logged_in_admin, lab_users):
+        """Test the user page form applies to checked users."""
+        ids = [user.id for user in User.query.filter(
+            User.username.in_(['lab00', 'lab05'])).all()]
+        response = logged_in_admin.post('/admin/users/bulk', data={
+            'action': 'activate', 'scope': 'selected',
+            'user_ids': [str(user_id) for user_id in ids]},
+            follow_redirects=True)
+
+        assert b'Activated 2 users.' in response.data
+
+    def test_bulk_api(self, logged_in_admin, lab_users):
+        """Test the JSON endpoint accepts filters."""
+        response = logged_in_admin.post('/admin/api/users/bulk', json={
+            'action': 'deactivate', 'filters': {'q': 'lab2'}})
+
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data['updated'] == 8  # lab20 and lab25 already inactive
+        assert len(data['user_ids']) == 8
+
+    def test_bulk_api_rejects_bad_input(self, logged_in_admin, lab_users):
+        """Test invalid bulk requests are rejected."""
+        response = logged_in_admin.post('/admin/api/users/bulk', json={
+            'action': 'deactivate'})
+        assert response.status_code == 400
+        response = logged_in_admin.post('/admin/api/users/bulk', json={
+            'action': 'activate', 'user_ids': ['x']})
+        assert response.status_code == 400
+
+    def test_bulk_requires_admin(self, logged_in_user):
+        """Test regular users cannot run bulk changes."""
+        response = logged_in_user.post('/admin/api/users/bulk', json={
+            'action': 'activate', 'user_ids': [1]})
+        assert response.status_code == 302
+
+
+@pytest.mark.admin
+class TestUserListingStream:
+    """Test cases for the streaming command-line user listing."""
+
+    def test_batches_are_bounded(self, lab_users):
+        """Test rows arrive in batches of at most ``batch_size``."""
+        batches = list(iter_user_batches(batch_size=10))
+
+        assert [len(rows) for rows in batches] == [10, 10, 10, 1]
+        assert 'password_hash' not in batches[0][0]._fields
+
+    def test_csv(self, lab_users):
+        """Test CSV output with filters and a limit."""
+        output = ''.join(stream_users(UserSearch(q='lab', active=False),
+                                      'csv', limit=2))
+        rows = list(csv.DictReader(io.StringIO(output)))
+
+        assert [row['username'] for row in rows] == ['lab00', 'lab05']
+        assert rows[0]['active'] == 'False'
+
+    def test_json_is_one_valid_document(self, lab_users):
+        """Test JSON output parses as a single array."""
+        items = json.loads(''.join(stream_users(fmt='json')))
+        assert len(items) == 31
+        assert items[1]['full_name'] == 'Lab User0'
+
+        assert json.loads(''.join(stream_users(UserSearch(q='zzz'),
+                                               'json'))) == []
+
+    def test_jsonl(self, lab_users):
+        """Test JSON Lines output has one object per user."""
+        lines = ''.join(stream_users(UserSearch(is_admin=True),
+                                     'jsonl')).splitlines()
+        assert [json.loads(line)['username'] for line in lines] == \
+            ['testadmin']
+
+    def test_table(self, lab_users):
+        """Test the table lists users and their total."""
+        output = ''.join(stream_users(UserSearch(q='lab2'), 'table'))
+        assert 'lab29' in output
+        assert output.rstrip().endswith('Total users: 10')
+
+    def test_cli(self, runner, lab_users):
+        """Test the list_users command streams the chosen format."""
+        from cli import list_users
+
+        result = runner.invoke(list_users, ['--format', 'jsonl', '--pam',
+                                            '--limit', '3'])
+
+        assert result.exit_code == 0
+        assert [json.loads(line)['username']
+                for line in result.output.splitlines()] == \
+            ['lab00', 'lab03', 'lab06']
@@ -0,0 +1,646 @@
+"""
+Audit Logging Tests
+Tests for audit log persistence and the audit services
+"""
+
+import csv
+import gzip
+import io
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import tuple_
+
+from app import db
+from app.models.user import AuditLog, User
+from app.services.audit_archive import AuditArchive, audit_archive
+from app.services.audit_export import (EXPORT_FIELDS, ExportStats,
+                                       stream_export)
+from app.services.audit_search import AuditSearch
+from app.services.audit_writer import AuditWriter
+from app.services.pagination import (approximate_counts, decode_cursor,
+                                     encode_cursor, keyset_paginate)
+from tests.helpers import assert_max_queries
+
+
+@pytest.fixture
+def many_logs(app_context, admin_user):
+    """Twelve audit entries, several sharing a timestamp."""
+    base = datetime(2026, 1, 1, 12, 0, 0)
+    logs = []
+    for i in range(12):
+        log = AuditLog(user_id=admin_user.id, action=f'action_{i}',
+                       resource_type='test_resource',
+                       ip_address=f'10.0.0.{i % 3}')
+        # Pairs of entries share a timestamp to exercise the id tiebreak
+        log.timestamp = base + timedelta(minutes=i // 2)
+        logs.append(log)
+    db.session.add_all(logs)
+    db.session.commit()
+    approximate_counts.invalidate()
+    return logs
+
+
+@pytest.fixture
+def logs_by_many_users(app_context, admin_user):
+    """One audit entry from each of eight distinct users."""
+    users = [User(username=f'audituser{i}', email=f'audit{i}@example.com',
+                  first_name='Audit', last_name=f'User{i}',
+                  password='testpassword123')
+             for i in range(8)]
+    db.session.add_all(users)
+    db.session.flush()
+    db.session.add_all([AuditLog(user_id=user.id, action='login',
+                                 resource_type='auth')
+                        for user in users])
+    db.session.commit()
+    approximate_counts.invalidate()
+    user_ids = [user.id for user in users]
+    yield [user.username for user in users]
+    AuditLog.query.filter(AuditLog.user_id.in_(user_ids)).delete()
+    User.query.filter(User.id.in_(user_ids)).delete()
+    db.session.commit()
+
+
+class TestAuditWriter:
+    """Test cases for the asynchronous audit writer."""
+
+    def test_disabled_writer_rejects_entries(self, app_context, admin_user):
+        """Test disabled writer leaves entries to the synchronous path."""
+        writer = AuditWriter()
+        entry = AuditLog(user_id=admin_user.id, action='test_action',
+                         resource_type='test_resource')
+
+        assert not writer.submit(entry)
+        assert writer.stats()['enqueued'] == 0
+
+    def test_batched_write_on_shutdown(self, app, app_context, admin_user):
+        """Test queued entries are written with one batch on shutdown."""
+        app.config['AUDIT_ASYNC_ENABLED'] = True
+        app.config['AUDIT_FLUSH_INTERVAL_MS'] = 60000
+        try:
+            writer = AuditWriter(app)
+            for i in range(3):
+                entry = AuditLog(user_id=admin_user.id,
+                                 action=f'batched_{i}',
+                                 resource_type='test_resource')
+                assert writer.submit(entry)
+
+            assert writer.stats()['enqueued'] == 3
+            writer.shutdown()
+        finally:
+            app.config['AUDIT_ASYNC_ENABLED'] = False
+            app.config['AUDIT_FLUSH_INTERVAL_MS'] = 200
+
+        stats = writer.stats()
+        assert stats['written'] == 3
+        assert stats['queue_depth'] == 0
+        assert stats['dropped'] == 0
+        actions = {log.action for log in AuditLog.query.all()}
+        assert {'batched_0', 'batched_1', 'batched_2'} <= actions
+
+    def test_failed_batch_drops_only_bad_rows(self, app, app_context,
+                                              admin_user):
+        """Test one invalid row does not drop the rest of its batch."""
+        writer = AuditWriter(app)
+        batch = [{'user_id': admin_user.id, 'action': f'retried_{i}',
+                  'resource_type': 'test_resource',
+                  'timestamp': datetime.utcnow()}
+                 for i in range(5)]
+        batch[3]['action'] = None
+
+        writer._write(batch)
+
+        stats = writer.stats()
+        assert stats['written'] == 4
+        assert stats['dropped'] == 1
+        actions = {log.action for log in AuditLog.query.filter(
+            AuditLog.action.like('retried_%'))}
+        assert actions == {'retried_0', 'retried_1', 'retried_2',
+                           'retried_4'}
+
+    def test_operational_error_drops_batch_once(self, app, app_context,
+                                                admin_user, monkeypatch):
+        """Test a database outage is not retried row by row."""
+        from sqlalchemy.exc import OperationalError
+
+        writer = AuditWriter(app)
+        calls = []
+
+        def unavailable(*args, **kwargs):
+            calls.append(args)
+            raise OperationalError('INSERT', {}, Exception('locked'))
+
+        monkeypatch.setattr(db.session, 'execute', unavailable)
+        writer._write([{'user_id': admin_user.id, 'action': f'lost_{i}',
+                        'resource_type': 'test_resource',
+                        'timestamp': datetime.utcnow()}
+                       for i in range(8)])
+
+        assert len(calls) == 1
+        assert writer.stats()['dropped'] == 8
+        assert writer.stats()['written'] == 0
+
+    def test_full_queue_falls_back_to_sync(self, app, app_context,
+                                           admin_user):
+        """Test a full queue hands entries back for synchronous writes."""
+        app.config['AUDIT_ASYNC_ENABLED'] = True
+        app.config['AUDIT_QUEUE_SIZE'] = 1
+        app.config['AUDIT_FLUSH_INTERVAL_MS'] = 60000
+        try:
+            writer = AuditWriter(app)
+            first = AuditLog(user_id=admin_user.id, action='first',
+                             resource_type='test_resource')
+            second = AuditLog(user_id=admin_user.id, action='second',
+                              resource_type='test_resource')
+
+            # The flush thread may already hold the first row, so fill
+            # the queue until it refuses an entry.
+            accepted = [writer.submit(first), writer.submit(second)]
+            while all(accepted):
+                accepted.append(writer.submit(
+                    AuditLog(user_id=admin_user.id, action='extra',
+                             resource_type='test_resource')))
+            writer.shutdown()
+        finally:
+            app.config['AUDIT_ASYNC_ENABLED'] = False
+            app.config['AUDIT_QUEUE_SIZE'] = 10000
+            app.config['AUDIT_FLUSH_INTERVAL_MS'] = 200
+
+        assert writer.stats()['sync_fallbacks'] >= 1
+
+
+class TestKeysetPagination:
+    """Test cases for cursor-based audit log pagination."""
+
+    def test_cursor_round_trip(self):
+        """Test cursors preserve datetimes and ids."""
+        values = [datetime(2026, 1, 1, 12, 30, 15, 123), 42]
+        assert decode_cursor(encode_cursor(values)) == values
+
+    def test_invalid_cursor(self):
+        """Test malformed cursors raise ValueError."""
+        with pytest.raises(ValueError):
+            decode_cursor('not-a-cursor')
+
+    def test_walk_forward_and_back(self, many_logs):
+        """Test paging through every entry in both directions."""
+        columns = (AuditLog.timestamp, AuditLog.id)
+        expected = sorted(many_logs, key=lambda log: (log.timestamp, log.id),
+                          reverse=True)
+
+        pages = [keyset_paginate(AuditLog.query, columns, per_page=5)]
+        while pages[-1].has_next:
+            pages.append(keyset_paginate(AuditLog.query, columns,
+                                         cursor=pages[-1].next_cursor,
+                                         per_page=5))
+
+        assert [len(page.items) for page in pages] == [5, 5, 2]
+        assert [log.id for page in pages for log in page.items] == \
+            [log.id for log in expected]
+        assert not pages[0].has_prev
+
+        back = keyset_paginate(AuditLog.query, columns,
+                               cursor=pages[2].prev_cursor,
+                               direction='prev', per_page=5)
+        assert [log.id for log in back.items] == \
+            [log.id for log in pages[1].items]
+        assert back.has_next and back.has_prev
+
+    def test_logs_view(self, logged_in_admin, many_logs):
+        """Test the audit log viewer pages with cursors."""
+        response = logged_in_admin.get('/admin/logs')
+        assert response.status_code == 200
+        assert b'Action_11' in response.data
+        assert b'About 12 entries' in response.data
+
+    def test_logs_view_ignores_bad_cursor(self, logged_in_admin, many_logs):
+        """Test a malformed cursor falls back to the newest entries."""
+        response = logged_in_admin.get('/admin/logs?cursor=garbage')
+        assert response.status_code == 200
+        assert b'Action_11' in response.data
+
+    def test_composite_index(self, app_context):
+        """Test the keyset index is declared on the audit table."""
+        indexes = {index.name: [column.name for column in index.columns]
+                   for index in AuditLog.__table__.indexes}
+        assert indexes['ix_audit_logs_timestamp_id'] == ['timestamp', 'id']
+
+
+class TestAuditLogQueries:
+    """Test audit listings load their users without extra queries."""
+
+    def test_listing_loads_users_eagerly(self, logs_by_many_users):
+        """Test serialising a page touches no lazy user relationship."""
+        db.session.expire_all()
+        with assert_max_queries(1):
+            page = keyset_paginate(AuditLog.query_with_users(),
+                                   (AuditLog.timestamp, AuditLog.id))
+            usernames = {log.to_dict()['username'] for log in page.items}
+
+        assert set(logs_by_many_users) <= usernames
+
+    def test_logs_view_query_budget(self, logged_in_admin,
+                                    logs_by_many_users):
+        """Test the log viewer's query count does not grow per user."""
+        approximate_counts.get('audit_logs', AuditLog.query)
+        db.session.expire_all()
+        with assert_max_queries(3):
+            response = logged_in_admin.get('/admin/logs')
+
+        assert response.status_code == 200
+        assert b'audituser7' in response.data
+
+    def test_dashboard_query_budget(self, logged_in_admin,
+                                    logs_by_many_users):
+        """Test the admin dashboard's recent activity is one query."""
+        logged_in_admin.get('/admin/')
+        db.session.expire_all()
+        # User loader, recent activity and four rollup reads
+        with assert_max_queries(6):
+            response = logged_in_admin.get('/admin/')
+
+        assert response.status_code == 200
+        assert b'audituser7' in response.data
+
+
+def query_plan(query):
+    """SQLite's plan for ``query`` as a list of detail strings."""
+    compiled = query.statement.compile(
+        db.engine, compile_kwargs={'literal_binds': True})
+    rows = db.session.connection().exec_driver_sql(
+        f'EXPLAIN QUERY PLAN {compiled}')
+    return [row[3] for row in rows]
+
+
+class TestAuditSearch:
+    """Test cases for filtered audit log searches."""
+
+    def test_parse_filters(self):
+        """Test query arguments are parsed and round-tripped."""
+        search = AuditSearch.from_args({
+            'user_id': '7', 'action': 'login_failed', 'ip_address': '',
+            'since': '2026-01-01T00:00', 'until': '2026-01-02T00:00',
+        })
+
+        assert search.user_id == 7
+        assert search.ip_address is None
+        assert search.since == datetime(2026, 1, 1)
+        assert search.active
+        assert AuditSearch.from_args(search.to_args()).to_args() == \
+            search.to_args()
+        assert not AuditSearch.from_args({}).active
+
+    @pytest.mark.parametrize('args', [
+        {'user_id': 'abc'},
+        {'since': 'yesterday'},
+        {'since': '2026-02-01', 'until': '2026-01-01'},
+    ])
+    def test_invalid_filters(self, args):
+        """Test malformed filters raise ValueError."""
+        with pytest.raises(ValueError):
+            AuditSearch.from_args(args)
+
+    def test_filter_by_ip_and_time(self, many_logs):
+        """Test equality and time range filters combine."""
+        search = AuditSearch(ip_address='10.0.0.1',
+                             since=datetime(2026, 1, 1, 12, 1),
+                             until=datetime(2026, 1, 1, 12, 5))
+        page = keyset_paginate(search.apply(AuditLog.query),
+                               (AuditLog.timestamp, AuditLog.id))
+
+        assert [log.action for log in page.items] == \
+            ['action_7', 'action_4']
+
+    @pytest.mark.parametrize('filters, index', [
+        ({'user_id': 1}, 'ix_audit_logs_user_id_timestamp'),
+        ({'action': 'login'}, 'ix_audit_logs_action_timestamp'),
+        ({'resource_type': 'user'}, 'ix_audit_logs_resource_type_timestamp'),
+        ({'ip_address': '10.0.0.1'}, 'ix_audit_logs_ip_address_timestamp'),
+        ({'since': datetime(2026, 1, 1)}, 'ix_audit_logs_timestamp_id'),
+    ])
+    def test_query_plan_uses_index(self, app_context, filters, index):
+        """Test each filtered page is an index range scan without a sort."""
+        columns = (AuditLog.timestamp, AuditLog.id)
+        query = AuditSearch(**filters).apply(AuditLog.query_with_users())
+        query = query.filter(tuple_(*columns) < (datetime(2026, 1, 5), 10))
+        query = query.order_by(*(column.desc() for column in columns))
+        plan = query_plan(query.limit(51))
+
+        assert any(f'USING INDEX {index}' in step or
+                   f'USING COVERING INDEX {index}' in step for step in plan)
+        assert not any('TEMP B-TREE' in step for step in plan)
+
+    def test_search_api(self, logged_in_admin, many_logs):
+        """Test the JSON search endpoint filters and pages."""
+        response = logged_in_admin.get(
+            '/admin/api/logs?ip_address=10.0.0.2&per_page=2')
+        data = response.get_json()
+
+        assert response.status_code == 200
+        assert [item['action'] for item in data['items']] == \
+            ['action_11', 'action_8']
+        assert data['filters'] == {'ip_address': '10.0.0.2'}
+
+        response = logged_in_admin.get(
+            '/admin/api/logs?ip_address=10.0.0.2&per_page=2'
+            f'&cursor={data["next_cursor"]}')
+        assert [item['action'] for item in response.get_json()['items']] \
+            == ['action_5', 'action_2']
+
+    def test_search_api_rejects_bad_filters(self, logged_in_admin):
+        """Test invalid filters are reported as a 400."""
+        response = logged_in_admin.get('/admin/api/logs?user_id=abc')
+
+        assert response.status_code == 400
+        assert 'user_id' in response.get_json()['error']
+
+    def test_search_view(self, logged_in_admin, many_logs):
+        """Test the viewer applies filters and drops the unfiltered total."""
+        response = logged_in_admin.get('/admin/logs?action=action_3')
+
+        assert response.status_code == 200
+        assert b'Action_3' in response.data
+        assert b'Action_11' not in response.data
+        assert b'About 12 entries' not in response.data
+
+    def test_search_requires_admin(self, logged_in_user):
+        """Test regular users cannot search audit logs."""
+        response = logged_in_user.get('/admin/api/logs')
+        assert response.status_code == 302
+
+
+@pytest.fixture
+def archive(app_context, tmp_path, monkeypatch):
+    """The global audit archive writing to a temporary directory."""
+    monkeypatch.setattr(audit_archive, 'directory', str(tmp_path))
+    monkeypatch.setattr(audit_archive, 'retention_days', 30)
+    return audit_archive
+
+
+@pytest.fixture
+def aged_logs(app_context, admin_user):
+    """Three entries in each of two old months and three recent ones."""
+    moments = [datetime(2025, 11, day, 9, 0) for day in (3, 10, 17)]
+    moments += [datetime(2025, 12, day, 9, 0) for day in (3, 10, 17)]
+    moments += [datetime.utcnow() - timedelta(minutes=3 - i)
+                for i in range(3)]
+    logs = []
+    for i, moment in enumerate(moments):
+        log = AuditLog(user_id=admin_user.id, action=f'aged_{i}',
+                       resource_type='test_resource',
+                       ip_address=f'10.0.1.{i % 2}')
+        log.timestamp = moment
+        logs.append(log)
+    db.session.add_all(logs)
+    db.session.commit()
+    approximate_counts.invalidate()
+    return [log.action for log in logs]
+
+
+class TestAuditArchive:
+    """Test cases for audit log retention and archives."""
+
+    def test_horizon(self):
+        """Test the horizon is the start of the retention month."""
+        archive = AuditArchive()
+        assert archive.horizon() is None
+
+        archive.retention_days = 30
+        assert archive.horizon(datetime(2026, 3, 15, 8, 30)) == \
+            datetime(2026, 2, 1)
+
+    def test_archive_old_months(self, archive, aged_logs, tmp_path):
+        """Test whole months past the horizon move to archive files."""
+        results = archive.archive(batch_size=2)
+
+        assert [(start.month, count) for start, count in results] == \
+            [(11, 3), (12, 3)]
+        assert sorted(path.name for path in tmp_path.glob('*.gz')) == \
+            ['audit_logs-2025-11.jsonl.gz', 'audit_logs-2025-12.jsonl.gz']
+        assert {log.action for log in AuditLog.query.all()} == \
+            set(aged_logs[6:])
+
+        archived = list(archive.read_month(2025, 11))
+        assert [entry.action for entry in archived] == aged_logs[:3]
+        assert archived[0].user.username == 'testadmin'
+        assert archived[0].to_dict()['archived']
+        assert archive.boundary() == datetime(2026, 1, 1)
+
+    def test_index_records_rows_and_blocks(self, archive, aged_logs,
+                                           tmp_path):
+        """Test each archive file gets an index of its rows and blocks."""
+        archive.archive(batch_size=2)
+
+        with open(tmp_path / 'audit_logs-2025-11.jsonl.gz.index.json') as f:
+            index = json.load(f)
+        assert index['rows'] == 3
+        assert len(index['blocks']) == 2
+        assert archive.count() == 6
+
+    def test_page_reads_only_needed_blocks(self, archive, aged_logs,
+                                           monkeypatch):
+        """Test a page stops reading once it has enough entries."""
+        archive.archive(batch_size=1)
+        reads = []
+        read_block = archive._read_block
+        monkeypatch.setattr(archive, '_read_block', lambda *args: (
+            reads.append(args) or read_block(*args)))
+
+        rows = archive.scan(AuditSearch(), None, descending=True, limit=2)
+
+        assert [entry.action for entry in rows] == ['aged_5', 'aged_4']
+        assert len(reads) == 2
+
+    def test_reads_archive_without_index(self, archive, aged_logs, tmp_path):
+        """Test files written before indexes existed are indexed on read."""
+        archive.archive()
+        for index_path in tmp_path.glob('*.index.json'):
+            index_path.unlink()
+        archive._indexes.clear()
+
+        assert archive.count() == 6
+        assert [entry.action for entry in archive.read_month(2025, 12)] == \
+            aged_logs[3:6]
+
+    def test_dry_run_keeps_entries(self, archive, aged_logs, tmp_path):
+        """Test a dry run only counts the entries to archive."""
+        results = archive.archive(dry_run=True)
+
+        assert [count for _, count in results] == [3, 3]
+        assert AuditLog.query.count() == 9
+        assert not list(tmp_path.iterdir())
+
+    def test_paging_continues_into_archive(self, archive, aged_logs):
+        """Test one keyset ordering spans live and archived entries."""
+        archive.archive()
+        search = AuditSearch()
+        query = AuditLog.query_with_users()
+
+        pages = [archive.paginate(query, search, per_page=4)]
+        while pages[-1].has_next:
+            pages.append(archive.paginate(query, search,
+                                          cursor=pages[-1].next_cursor,
+                                          per_page=4))
+
+        assert [log.action for page in pages for log in page.items] == \
+            list(reversed(aged_logs))
+
+        back = archive.paginate(query, search, cursor=pages[2].prev_cursor,
+                                direction='prev', per_page=4)
+        assert [log.action for log in back.items] == \
+            [log.action for log in pages[1].items]
+
+    def test_search_reads_only_matching_archive(self, archive, aged_logs):
+        """Test archived entries are filtered like live ones."""
+        archive.archive()
+        search = AuditSearch(ip_address='10.0.1.1',
+                             since=datetime(2025, 12, 1),
+                             until=datetime(2026, 1, 1))
+
+        page = archive.paginate(search.apply(AuditLog.query_with_users()),
+                                search)
+        assert [log.action for log in page.items] == ['aged_5', 'aged_3']
+
+    def test_logs_api_includes_archive(self, logged_in_admin, archive,
+                                       aged_logs):
+        """Test the search API transparently returns archived entries."""
+        archive.archive()
+        response = logged_in_admin.get('/admin/api/logs?since=2025-11-01'
+                                       '&until=2025-12-01')
+        items = response.get_json()['items']
+
+        assert [item['action'] for item in items] == \
+            ['aged_2', 'aged_1', 'aged_0']
+        assert all(item['archived'] for item in items)
+
+    def test_total_includes_archive(self, logged_in_admin, archive,
+                                    aged_logs):
+        """Test the unfiltered total counts archived entries too."""
+        archive.archive()
+        approximate_counts.invalidate()
+        live = AuditLog.query.count()
+
+        assert archive.count() == 6
+        response = logged_in_admin.get('/admin/logs')
+        assert f'About {live + 6} entries' in response.get_data(as_text=True)
+
+    def test_archive_command(self, runner, archive, aged_logs):
+        """Test the CLI command archives and reports throughput."""
+        from cli import archive_audit_logs
+
+        result = runner.invoke(archive_audit_logs, ['--batch-size', '2'])
+
+        assert result.exit_code == 0, result.output
+        assert '2025-11: archived 3 entries' in result.output
+        assert 'rows/s' in result.output
+        assert AuditLog.query.count() == 3
+
+
+class TestAuditExport:
+    """Test cases for streaming audit log exports."""
+
+    def test_csv_export_in_batches(self, many_logs):
+        """Test CSV rows stream in chronological keyset batches."""
+        stats = ExportStats()
+        with assert_max_queries(3):
+            chunks = list(stream_export(fmt='csv', batch_size=5,
+                                        stats=stats))
+
+        rows = list(csv.reader(io.StringIO(''.join(chunks))))
+        assert rows[0] == list(EXPORT_FIELDS)
+        assert [row[4] for row in rows[1:]] == \
+            [f'action_{i}' for i in range(12)]
+        assert rows[1][3] == 'testadmin'
+        assert stats.rows == 12 and stats.batches == 3
+        assert stats.rows_per_second > 0
+
+    def test_gzip_jsonl_export(self, many_logs):
+        """Test gzipped JSON Lines output decompresses to every entry."""
+        search = AuditSearch(ip_address='10.0.0.0')
+        data = b''.join(stream_export(search, fmt='jsonl', compress=True,
+                                      batch_size=2))
+
+        records = [json.loads(line)
+                   for line in gzip.decompress(data).decode().splitlines()]
+        assert [record['action'] for record in records] == \
+            ['action_0', 'action_3', 'action_6', 'action_9']
+        assert records[0]['timestamp'] == '2026-01-01T12:00:00'
+
+    def test_export_includes_archive(self, archive, aged_logs):
+        """Test archived months are exported before the live entries."""
+        archive.archive()
+        stats = ExportStats()
+        search = AuditSearch(since=datetime(2025, 11, 1))
+        data = ''.join(stream_export(search, fmt='jsonl', batch_size=2,
+                                     stats=stats))
+
+        records = [json.loads(line) for line in data.splitlines()]
+        assert [record['action'] for record in records] == aged_logs
+        assert records[0]['username'] == 'testadmin'
+        assert records[0]['timestamp'] == '2025-11-03T09:00:00'
+        assert stats.rows == 9 and stats.batches == 5
+
+    def test_export_streams_archive_blocks(self, archive, aged_logs,
+                                           monkeypatch):
+        """Test archived entries are exported without loading a month."""
+        archive.archive(batch_size=1)
+        reads = []
+        read_block = archive._read_block
+        monkeypatch.setattr(archive, '_read_block', lambda *args: (
+            reads.append(args) or read_block(*args)))
+
+        chunks = stream_export(AuditSearch(since=datetime(2025, 11, 1)),
+                               fmt='jsonl', batch_size=1)
+        first = next(chunks)
+
+        assert json.loads(first)['action'] == 'aged_0'
+        assert len(reads) == 1
+
+    def test_empty_csv_export_has_header(self, app_context, admin_user):
+        """Test an export with no matches still has a header row."""
+        search = AuditSearch(action='missing')
+        assert ''.join(stream_export(search)) == \
+            ','.join(EXPORT_FIELDS) + '\r\n'
+
+    def test_unknown_format(self, app_context):
+        """Test unsupported formats raise ValueError."""
+        with pytest.raises(ValueError):
+            list(stream_export(fmt='xml'))
+
+    def test_export_endpoint(self, logged_in_admin, many_logs):
+        """Test the admin download streams filtered, gzipped JSONL."""
+        response = logged_in_admin.get(
+            '/admin/logs/export?format=jsonl&gzip=1&action=action_3')
+
+        assert response.status_code == 200
+        assert response.mimetype == 'application/gzip'
+        assert '.jsonl.gz' in response.headers['Content-Disposition']
+        lines = gzip.decompress(response.data).decode().splitlines()
+        assert [json.loads(line)['action'] for line in lines] == \
+            ['action_3']
+        assert AuditLog.query.filter_by(action='audit_exported').count() == 1
+
+    def test_export_endpoint_rejects_format(self, logged_in_admin):
+        """Test unsupported formats redirect back to the viewer."""
+        response = logged_in_admin.get('/admin/logs/export?format=xml')
+        assert response.status_code == 302
+
+    def test_export_requires_admin(self, logged_in_user):
+        """Test regular users cannot export audit logs."""
+        response = logged_in_user.get('/admin/logs/export')
+        assert response.status_code == 302
+
+    def test_export_command(self, runner, many_logs, tmp_path):
+        """Test the CLI command writes a file and reports throughput."""
+        from cli import export_audit_logs
+
+        output = tmp_path / 'audit.csv'
+        result = runner.invoke(export_audit_logs,
+                               ['--output', str(output), '--batch-size', '4',
+                                '--resource-type', 'test_resource'])
+
+        assert result.exit_code == 0, result.output
+        assert 'Exported 12 entries in 3 batches' in result.output
+        assert len(output.read_text().splitlines()) == 13
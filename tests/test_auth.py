@@ -183,3 +183,48 @@ class TestAuthenticationRequired:
         response = logged_in_admin.get('/admin/')
         assert response.status_code == 200
         assert b'Admin Panel' in response.data or b'Dashboard' in response.data
+
+
+@pytest.mark.api
+class TestAuthStatusAPI:
+    """Test the auth status polling endpoint."""
+    
+    def test_anonymous_status(self, client):
+        """Test anonymous status carries an ETag and private caching."""
+        response = client.get('/auth/api/auth/status')
+        assert response.status_code == 200
+        assert response.get_json() == {'authenticated': False}
+        assert response.headers['ETag']
+        assert 'private' in response.headers['Cache-Control']
+    
+    def test_authenticated_status(self, logged_in_user, regular_user):
+        """Test authenticated status returns the user payload."""
+        response = logged_in_user.get('/auth/api/auth/status')
+        data = response.get_json()
+        assert data['authenticated'] is True
+        assert data['user']['username'] == regular_user.username
+    
+    def test_conditional_request_returns_304(self, logged_in_user):
+        """Test a matching If-None-Match is answered with 304."""
+        first = logged_in_user.get('/auth/api/auth/status')
+        etag = first.headers['ETag']
+        
+        second = logged_in_user.get('/auth/api/auth/status',
+                                    headers={'If-None-Match': etag})
+        assert second.status_code == 304
+        assert second.data == b''
+        assert second.headers['ETag'] == etag
+    
+    def test_etag_changes_with_user(self, logged_in_user, regular_user):
+        """Test updating the user invalidates the ETag."""
+        from datetime import datetime, timedelta
+        
+        etag = logged_in_user.get('/auth/api/auth/status').headers['ETag']
+        regular_user.first_name = 'Renamed'
+        regular_user.updated_at = datetime.utcnow() + timedelta(seconds=1)
+        db.session.commit()
+        
+        response = logged_in_user.get('/auth/api/auth/status',
+                                      headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
@@ -3,7 +3,11 @@ Unit Tests for User Model
 Tests for user creation, authentication, and model methods
 """
 
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
+from sqlalchemy import text
+
 from app.models.user import User, AuditLog
 from app import db
 
@@ -162,3 +166,211 @@ class TestAuditLog:
         
         expected = f'<AuditLog test_action by User {admin_user.id}>'
         assert repr(log) == expected
+
+
+class TestUnitOfWork:
+    """Test cases for the single-commit unit of work."""
+    
+    def test_stages_changes_in_one_commit(self, app_context, admin_user):
+        """Test last login and audit entries share one commit."""
+        from sqlalchemy import event
+        from app.models.user import unit_of_work
+        
+        commits = []
+        session = db.session()
+        listener = lambda s: commits.append(s)  # noqa: E731
+        event.listen(session, 'after_commit', listener)
+        try:
+            with unit_of_work():
+                admin_user.update_last_login(commit=False)
+                for action in ('first', 'second'):
+                    AuditLog.log_action(
+                        user_id=admin_user.id,
+                        action=action,
+                        resource_type='test_resource',
+                        commit=False
+                    )
+        finally:
+            event.remove(session, 'after_commit', listener)
+        
+        assert len(commits) == 1
+        assert admin_user.last_login is not None
+        assert AuditLog.query.filter(
+            AuditLog.action.in_(['first', 'second'])).count() == 2
+    
+    def test_rolls_back_on_error(self, app_context, admin_user):
+        """Test staged changes are discarded when the block raises."""
+        from app.models.user import unit_of_work
+        
+        with pytest.raises(RuntimeError):
+            with unit_of_work():
+                AuditLog.log_action(
+                    user_id=admin_user.id,
+                    action='rolled_back',
+                    resource_type='test_resource',
+                    commit=False
+                )
+                raise RuntimeError('boom')
+        
+        assert AuditLog.query.filter_by(action='rolled_back').count() == 0
+
+
+class TestPasswordHashCost:
+    """Test cases for configurable password hashing cost."""
+    
+    def test_hash_uses_configured_cost(self, app, app_context):
+        """Test new hashes record the configured method."""
+        from app.models.user import password_hash_method
+        
+        user = User(
+            username='costuser',
+            email='cost@example.com',
+            first_name='Cost',
+            last_name='User',
+            password='testpassword123'
+        )
+        
+        assert password_hash_method() == 'scrypt:128:8:1'
+        assert user.password_hash_params == 'scrypt:128:8:1'
+        assert not user.needs_rehash
+    
+    def test_rehash_on_successful_check(self, app, app_context):
+        """Test a hash with stale parameters is upgraded on login."""
+        user = User(
+            username='rehashuser',
+            email='rehash@example.com',
+            first_name='Rehash',
+            last_name='User',
+            password='testpassword123'
+        )
+        app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+        try:
+            assert user.needs_rehash
+            assert not user.check_password('wrongpassword')
+            assert user.password_hash_params == 'scrypt:128:8:1'
+            
+            assert user.check_password('testpassword123')
+            assert user.password_hash_params == 'pbkdf2:sha256:1000'
+            assert user.check_password('testpassword123')
+        finally:
+            app.config['PASSWORD_HASH_METHOD'] = None
+
+    
+    def test_shorthand_method_does_not_rehash(self, app, app_context):
+        """Test a shorthand method matches the full form Werkzeug stores."""
+        app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256'
+        try:
+            user = User(
+                username='shorthanduser',
+                email='shorthand@example.com',
+                first_name='Shorthand',
+                last_name='User',
+                password='testpassword123'
+            )
+            stored = user.password_hash
+            
+            assert user.password_hash_params.startswith('pbkdf2:sha256:')
+            assert not user.needs_rehash
+            assert user.check_password('testpassword123')
+            assert user.password_hash == stored
+        finally:
+            app.config['PASSWORD_HASH_METHOD'] = None
+
+@pytest.fixture
+def file_db_app(tmp_path, monkeypatch):
+    """An app instance backed by a SQLite file instead of memory."""
+    from app import create_app
+    from config.config import TestingConfig, config
+
+    class FileDatabaseConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{tmp_path / "portal.db"}'
+
+    monkeypatch.setitem(config, 'filedb', FileDatabaseConfig)
+    monkeypatch.setenv('FLASK_ENV', 'testing')
+    file_app = create_app('filedb')
+    with file_app.app_context():
+        yield file_app
+        db.session.remove()
+        db.engine.dispose()
+
+
+class TestDatabaseEngine:
+    """Test cases for engine options and the SQLite profile."""
+
+    def test_sqlite_pragmas(self, file_db_app):
+        """Test new SQLite connections get the configured profile."""
+        def pragma(name):
+            return db.session.execute(text(f'PRAGMA {name}')).scalar()
+
+        assert pragma('journal_mode') == 'wal'
+        assert pragma('synchronous') == 1  # NORMAL
+        assert pragma('busy_timeout') == 5000
+        assert pragma('mmap_size') == 256 * 1024 * 1024
+
+    def test_engine_options_for_server_databases(self):
+        """Test pool settings are passed to non-SQLite engines."""
+        from flask import Flask
+        from app import configure_engine_options
+        from config.config import ProductionConfig
+
+        server_app = Flask(__name__)
+        server_app.config.from_object(ProductionConfig)
+        server_app.config['SQLALCHEMY_DATABASE_URI'] = \
+            'postgresql://lab:secret@db/lab_portal'
+        configure_engine_options(server_app)
+
+        options = server_app.config['SQLALCHEMY_ENGINE_OPTIONS']
+        assert options['pool_size'] == ProductionConfig.DB_POOL_SIZE
+        assert options['pool_pre_ping'] is True
+        assert options['pool_recycle'] == 1800
+        assert options['connect_args']['options'] == \
+            '-c statement_timeout=30000'
+
+    def test_parallel_logins_do_not_lock(self, file_db_app):
+        """Test concurrent login writes wait for locks instead of failing."""
+        usernames = [f'parallel{i}' for i in range(8)]
+        db.session.add_all([
+            User(username=name, email=f'{name}@example.com',
+                 first_name='Parallel', last_name='User',
+                 password='testpassword123')
+            for name in usernames
+        ])
+        db.session.commit()
+
+        def login(username):
+            client = file_db_app.test_client()
+            statuses = []
+            for _ in range(3):
+                statuses.append(client.post('/auth/login', data={
+                    'username': username,
+                    'password': 'testpassword123'
+                }).status_code)
+                client.get('/auth/logout')
+            return statuses
+
+        with ThreadPoolExecutor(max_workers=len(usernames)) as pool:
+            results = list(pool.map(login, usernames))
+
+        assert all(status == 302 for statuses in results
+                   for status in statuses)
+        assert AuditLog.query.filter_by(action='login').count() == \
+            3 * len(usernames)
+
+    def test_missing_indexes_created(self, file_db_app):
+        """Test indexes added after a table was created are backfilled."""
+        from app.models import create_indexes
+
+        db.session.execute(text('DROP INDEX ix_users_created_at_id'))
+        db.session.execute(text('DROP INDEX ix_users_username_lower'))
+        db.session.execute(text('DROP INDEX ix_audit_logs_action_timestamp'))
+        db.session.commit()
+
+        assert create_indexes() == ['ix_users_created_at_id',
+                                    'ix_users_username_lower',
+                                    'ix_audit_logs_action_timestamp']
+        assert create_indexes() == []
+        indexes = set(db.session.execute(text(
+            "SELECT name FROM sqlite_master WHERE tbl_name = 'users'"))
+            .scalars())
+        assert {'ix_users_created_at_id', 'ix_users_username_lower'} <= \
+            indexes
@@ -0,0 +1,992 @@
+"""
+Service Tests
+Tests for the application services package
+"""
+
+import io
+import os
+import sys
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from app import db
+from app.models.user import AuditLog, User
+from app.services.health import health_checks
+from app.services.metrics import Metrics, metrics
+from app.services.pam_auth import PamAuthenticator, PamCredentialCache
+from app.services.password_hasher import PasswordHasher
+from app.services.query_profiler import normalize_statement, query_profiler
+from app.services.rate_limit import (HybridStorage, SQLiteStorage,
+                                     configure_rate_limiting)
+from app.services.user_cache import CachedUser, UserCache
+from app.services.user_import import import_users, read_rows, validate_row
+from app.services.user_index import user_index
+from app.services.user_stats import user_stats
+from tests.helpers import assert_max_queries
+
+
+@pytest.fixture
+def user_cache(app):
+    """An enabled user cache configured from the test app."""
+    app.config['USER_CACHE_ENABLED'] = True
+    try:
+        yield UserCache(app)
+    finally:
+        app.config['USER_CACHE_ENABLED'] = False
+
+
+class TestUserCache:
+    """Test cases for the cached Flask-Login user loader."""
+
+    def test_second_load_skips_database(self, user_cache, admin_user):
+        """Test a cached user is returned without issuing SQL."""
+        user_id = admin_user.id
+        with assert_max_queries(1) as statements:
+            first = user_cache.load(user_id)
+            second = user_cache.load(user_id)
+
+        assert isinstance(first, CachedUser)
+        assert second is first
+        assert len(statements) == 1
+        assert user_cache.stats()['hits'] == 1
+        assert user_cache.stats()['misses'] == 1
+
+    def test_snapshot_fields(self, user_cache, admin_user):
+        """Test the snapshot exposes the fields routes read."""
+        user = user_cache.load(admin_user.id)
+
+        assert user.username == admin_user.username
+        assert user.full_name == admin_user.full_name
+        assert user.is_admin
+        assert user.is_active
+        assert user.is_authenticated
+        assert user.get_id() == str(admin_user.id)
+
+    def test_invalidate_reloads_user(self, user_cache, admin_user):
+        """Test invalidation picks up changed fields."""
+        user_cache.load(admin_user.id)
+        admin_user.active = False
+        db.session.commit()
+
+        assert user_cache.load(admin_user.id).active
+        user_cache.invalidate(admin_user.id)
+        assert not user_cache.load(admin_user.id).active
+
+    def test_lru_eviction(self, user_cache):
+        """Test the least recently used snapshot is evicted."""
+        user_cache.maxsize = 2
+        for user_id in (1, 2, 3):
+            user_cache.put(CachedUser(user_id, f'user{user_id}', 'A', 'B',
+                                      False, True))
+
+        assert user_cache.get(1) is None
+        assert user_cache.get(3) is not None
+        assert user_cache.stats()['evictions'] == 1
+
+    def test_ttl_expiry(self, user_cache):
+        """Test expired snapshots count as misses."""
+        user_cache.ttl = 0
+        user_cache.put(CachedUser(1, 'user1', 'A', 'B', False, True))
+
+        assert user_cache.get(1) is None
+
+    def test_missing_user(self, user_cache, app_context):
+        """Test unknown ids load as None."""
+        assert user_cache.load(999999) is None
+
+
+class FakePam:
+    """Stand-in for python-pam's authenticator object."""
+
+    instances = []
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.release.set()
+        FakePam.instances.append(self)
+
+    def authenticate(self, username, password, service='login'):
+        self.release.wait()
+        return password == 'secret'
+
+
+@pytest.fixture
+def fake_pam(monkeypatch):
+    """Install a fake pam module for the duration of a test."""
+    FakePam.instances = []
+    module = types.SimpleNamespace(pam=FakePam)
+    monkeypatch.setitem(sys.modules, 'pam', module)
+    return module
+
+
+@pytest.fixture
+def pam_service(app, fake_pam):
+    """A PAM authenticator configured from the test app."""
+    service = PamAuthenticator(app)
+    yield service
+    service.shutdown()
+
+
+class TestPamAuthenticator:
+    """Test cases for the PAM worker pool."""
+
+    def test_unavailable_returns_none(self, app, monkeypatch):
+        """Test a missing pam module defers to database authentication."""
+        monkeypatch.setitem(sys.modules, 'pam', None)
+        service = PamAuthenticator(app)
+
+        assert not service.available
+        assert service.authenticate('user', 'secret') is None
+
+    def test_disabled_returns_none(self, app, fake_pam):
+        """Test ENABLE_PAM_AUTH=False skips PAM."""
+        service = PamAuthenticator()
+        service.init_app(app)
+        service.enabled = False
+
+        assert service.authenticate('user', 'secret') is None
+
+    def test_authenticate(self, pam_service):
+        """Test PAM verdicts are returned and counted."""
+        assert pam_service.authenticate('user', 'secret') is True
+        assert pam_service.authenticate('user', 'wrong') is False
+
+        stats = pam_service.stats()
+        assert stats['calls'] == 2
+        assert stats['failures'] == 1
+        assert stats['auth_latency_p50_ms'] is not None
+
+    def test_handles_are_reused_per_thread(self, pam_service):
+        """Test the pool reuses a PAM handle across calls."""
+        pam_service.max_workers = 1
+        for _ in range(3):
+            pam_service.authenticate('user', 'secret')
+
+        assert len(FakePam.instances) == 1
+
+    def test_timeout_counts_as_failure(self, pam_service):
+        """Test a hung PAM call is abandoned after the timeout."""
+        pam_service.timeout = 0.05
+        pam_service.max_workers = 1
+        pam_service.authenticate('user', 'secret')
+        FakePam.instances[0].release.clear()
+        try:
+            assert pam_service.authenticate('user', 'secret') is False
+        finally:
+            FakePam.instances[0].release.set()
+
+        assert pam_service.stats()['timeouts'] == 1
+
+    def test_credential_cache_avoids_pam_calls(self, pam_service):
+        """Test cached successes and backoff short-circuit PAM."""
+        pam_service.cache = PamCredentialCache(failure_threshold=2)
+
+        assert pam_service.authenticate('user', 'secret')
+        assert pam_service.authenticate('user', 'secret')
+        assert not pam_service.authenticate('other', 'wrong')
+        assert not pam_service.authenticate('other', 'wrong')
+        assert not pam_service.authenticate('other', 'secret')
+
+        stats = pam_service.stats()
+        assert stats['calls'] == 3
+        assert stats['calls_avoided'] == 2
+
+    def test_pam_user_falls_back_without_pam(self, pam_user, monkeypatch):
+        """Test PAM users without a password hash fail closed."""
+        monkeypatch.setitem(sys.modules, 'pam', None)
+
+        assert not pam_user.check_password('anypassword')
+
+
+class TestPamCredentialCache:
+    """Test cases for the PAM verified-credential cache."""
+
+    def test_only_matching_password_hits(self):
+        """Test a cached success only matches the same password."""
+        cache = PamCredentialCache()
+        cache.record('user', 'secret', True)
+
+        assert cache.check('user', 'secret') is True
+        assert cache.check('user', 'other') is None
+        assert cache.check('someone', 'secret') is None
+
+    def test_failure_revokes_success(self):
+        """Test a failed verification drops the cached success."""
+        cache = PamCredentialCache()
+        cache.record('user', 'secret', True)
+        cache.record('user', 'secret', False)
+
+        assert cache.check('user', 'secret') is None
+
+    def test_backoff_after_threshold(self):
+        """Test repeated failures block the username for a while."""
+        cache = PamCredentialCache(failure_threshold=2, backoff=60)
+        cache.record('user', 'bad', False)
+        assert cache.check('user', 'bad') is None
+
+        cache.record('user', 'bad', False)
+        assert cache.check('user', 'good') is False
+        assert cache.backoff_rejections == 1
+
+    def test_expired_success(self):
+        """Test cached successes expire after the TTL."""
+        cache = PamCredentialCache(ttl=0)
+        cache.record('user', 'secret', True)
+
+        assert cache.check('user', 'secret') is None
+
+
+class TestPasswordHasher:
+    """Test cases for the password hashing process pool."""
+
+    def test_synchronous_outside_requests(self, app):
+        """Test hashing stays in-process without a request context."""
+        hasher = PasswordHasher(app)
+        hasher.workers = 2
+        results = {}
+
+        # pytest-flask pushes a request context, so check from a thread
+        def worker():
+            results['pooled'] = hasher.pooled
+            pwhash = hasher.hash('secret', 'pbkdf2:sha256:1000')
+            results['verified'] = hasher.verify(pwhash, 'secret')
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+
+        assert results == {'pooled': False, 'verified': True}
+        assert hasher._executor is None
+
+    def test_zero_workers_never_pool(self, app):
+        """Test PASSWORD_HASH_WORKERS=0 keeps requests in-thread."""
+        hasher = PasswordHasher(app)
+
+        with app.test_request_context():
+            assert not hasher.pooled
+
+    @pytest.mark.slow
+    def test_pooled_hash_and_verify(self, app):
+        """Test hashes computed in worker processes verify correctly."""
+        hasher = PasswordHasher(app)
+        hasher.workers = 1
+        try:
+            with app.test_request_context():
+                assert hasher.pooled
+                pwhash = hasher.hash('secret', 'pbkdf2:sha256:1000')
+                assert hasher.verify(pwhash, 'secret')
+                assert not hasher.verify(pwhash, 'wrong')
+            hashes = hasher.hash_many(['a', 'b'], 'pbkdf2:sha256:1000')
+        finally:
+            hasher.shutdown()
+
+        assert hasher.verify(hashes[0], 'a')
+        assert hasher.verify(hashes[1], 'b')
+
+
+    @pytest.mark.slow
+    @pytest.mark.skipif((os.cpu_count() or 1) < 2,
+                        reason='parallel hashing needs two cores')
+    def test_concurrent_logins_run_in_parallel(self, app):
+        """Test concurrent request logins are not serialized."""
+        hasher = PasswordHasher(app)
+        hasher.workers = 2
+        pwhash = hasher.hash('secret', 'pbkdf2:sha256:400000')
+
+        def login(_=None):
+            with app.test_request_context():
+                return hasher.verify(pwhash, 'secret')
+
+        try:
+            login()  # start the workers
+            started = time.perf_counter()
+            login()
+            single = time.perf_counter() - started
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                results = list(pool.map(login, range(4)))
+            elapsed = time.perf_counter() - started
+        finally:
+            hasher.shutdown()
+
+        # Two workers take about two rounds; one at a time would take four
+        assert all(results)
+        assert elapsed < 3 * single
+
+    @pytest.mark.slow
+    def test_broken_pool_is_replaced(self, app):
+        """Test a dead worker does not break hashing for good."""
+        hasher = PasswordHasher(app, request_only=False)
+        hasher.workers = 1
+        try:
+            broken = hasher._get_executor()
+            with pytest.raises(BrokenProcessPool):
+                broken.submit(os._exit, 1).result()
+
+            pwhash = hasher.hash('secret', 'pbkdf2:sha256:1000')
+            assert hasher._executor is None
+            assert hasher.verify(pwhash, 'secret')
+            assert hasher._executor is not None
+            assert hasher._executor is not broken
+        finally:
+            hasher.shutdown()
+
+class TestRateLimitStorage:
+    """Test cases for the rate limit storage backends."""
+
+    def test_sqlite_counts_and_expiry(self):
+        """Test fixed-window counting in the SQLite backend."""
+        storage = SQLiteStorage('sqlite://')
+
+        assert storage.incr('key', 60) == 1
+        assert storage.incr('key', 60, amount=2) == 3
+        assert storage.get('key') == 3
+        assert storage.get_expiry('key') > 0
+        storage.clear('key')
+        assert storage.get('key') == 0
+        assert storage.check()
+
+    def test_sqlite_window_expires(self):
+        """Test an expired window starts counting from zero."""
+        storage = SQLiteStorage('sqlite://')
+        storage.incr('key', 0)
+
+        assert storage.get('key') == 0
+        assert storage.incr('key', 60) == 1
+
+    def test_sqlite_file_is_shared(self, tmp_path):
+        """Test separate instances share counts through the file."""
+        uri = f'sqlite:///{tmp_path}/limits.db'
+        first, second = SQLiteStorage(uri), SQLiteStorage(uri)
+        first.incr('key', 60)
+        second.incr('key', 60)
+
+        assert first.get('key') == 2
+
+    def test_hybrid_counts_locally_until_sync(self, tmp_path):
+        """Test hits stay local until the periodic sync."""
+        uri = f'hybrid+sqlite:///{tmp_path}/limits.db'
+        first = HybridStorage(uri, sync_interval=3600)
+        second = HybridStorage(uri, sync_interval=3600)
+
+        assert first.incr('key', 60) == 1
+        assert first.incr('key', 60) == 2
+        assert first.backend.get('key') == 0
+
+        second.incr('key', 60)
+        first.sync()
+        second.sync()
+        assert first.backend.get('key') == 3
+        assert second.get('key') == 3
+
+        first.sync()
+        assert first.get('key') == 3
+        assert first.local_hits == 2
+
+    def test_prefilter_wraps_shared_backends(self, app):
+        """Test the storage URI is derived from the legacy setting."""
+        config = {'RATELIMIT_STORAGE_URL': 'redis://localhost:6379',
+                  'RATELIMIT_LOCAL_PREFILTER': True,
+                  'RATELIMIT_SYNC_INTERVAL': 2.0}
+        fake_app = types.SimpleNamespace(config=config)
+        configure_rate_limiting(fake_app)
+
+        assert config['RATELIMIT_STORAGE_URI'] == \
+            'hybrid+redis://localhost:6379'
+        assert config['RATELIMIT_STORAGE_OPTIONS'] == {'sync_interval': 2.0}
+
+        config = {'RATELIMIT_STORAGE_URL': 'memory://',
+                  'RATELIMIT_LOCAL_PREFILTER': True}
+        configure_rate_limiting(types.SimpleNamespace(config=config))
+        assert config['RATELIMIT_STORAGE_URI'] == 'memory://'
+
+
+@pytest.fixture
+def limited_app(monkeypatch):
+    """An app instance with rate limiting enabled."""
+    from app import create_app, limiter
+    from config.config import TestingConfig, config
+
+    class RateLimitedConfig(TestingConfig):
+        RATELIMIT_ENABLED = True
+        RATELIMIT_STORAGE_URL = 'memory://'
+        LOGIN_USERNAME_RATE_LIMIT = '2 per minute'
+
+    monkeypatch.setitem(config, 'ratelimited', RateLimitedConfig)
+    monkeypatch.setenv('FLASK_ENV', 'testing')
+    limited = create_app('ratelimited')
+    try:
+        yield limited
+    finally:
+        # The limiter is global; leave it inert for the session app
+        limiter.reset()
+        limiter.enabled = False
+
+
+class TestLoginRateLimits:
+    """Test cases for login rate limiting."""
+
+    def test_per_username_limit(self, limited_app):
+        """Test repeated attempts on one account are throttled."""
+        client = limited_app.test_client()
+
+        def attempt(username):
+            return client.post('/auth/login', data={
+                'username': username,
+                'password': 'wrongpassword'
+            }).status_code
+
+        assert attempt('victim') == 200
+        assert attempt('Victim') == 200
+        assert attempt('victim') == 429
+        assert attempt('someoneelse') == 200
+
+
+@pytest.fixture
+def profiler(app, monkeypatch):
+    """The global query profiler sampling everything."""
+    query_profiler.reset()
+    monkeypatch.setattr(query_profiler, 'sample_rate', 1.0)
+    monkeypatch.setattr(query_profiler, 'slow_ms', 10000.0)
+    yield query_profiler
+    query_profiler.reset()
+
+
+class TestQueryProfiler:
+    """Test cases for sampled query profiling."""
+
+    def test_normalize_statement(self):
+        """Test statements differing only in values normalize together."""
+        first = normalize_statement(
+            "SELECT * FROM users WHERE id IN (?, ?, ?) AND name = 'bob'")
+        second = normalize_statement(
+            "SELECT *\n  FROM users WHERE id IN (?, ?) AND name = 'x'")
+
+        assert first == second == \
+            'SELECT * FROM users WHERE id IN (?) AND name = ?'
+        assert normalize_statement('SELECT users_1.id LIMIT 10') == \
+            'SELECT users_1.id LIMIT ?'
+
+    def test_sampling_off_records_nothing(self, app_context, admin_user):
+        """Test nothing is captured while the sample rate is zero."""
+        query_profiler.reset()
+        db.session.get(User, admin_user.id)
+        db.session.execute(db.select(User)).all()
+
+        assert query_profiler.stats()['sampled'] == 0
+
+    def test_sampled_statements_aggregate(self, profiler, app_context,
+                                          admin_user):
+        """Test sampled statements are aggregated with a call site."""
+        for _ in range(3):
+            db.session.execute(
+                db.select(User).where(User.id == admin_user.id)).all()
+
+        top = profiler.top(order_by='count')
+        assert top[0]['count'] >= 3
+        assert 'FROM users' in top[0]['statement']
+        assert top[0]['call_site'].startswith('tests')
+
+    def test_slow_query_log(self, profiler, app_context, caplog,
+                            monkeypatch):
+        """Test statements over the threshold are logged."""
+        monkeypatch.setattr(profiler, 'slow_ms', 0.0)
+        with caplog.at_level('WARNING', logger='app.services.query_profiler'):
+            db.session.execute(db.text('SELECT 1')).all()
+
+        assert any('Slow query' in record.message
+                   for record in caplog.records)
+
+    def test_statement_table_is_bounded(self, profiler, app_context,
+                                        monkeypatch):
+        """Test new statements are dropped once the table is full."""
+        monkeypatch.setattr(profiler, 'max_statements', 1)
+        db.session.execute(db.text('SELECT 1')).all()
+        db.session.execute(db.text('SELECT 1 + 1 AS two')).all()
+
+        assert profiler.stats()['statements'] == 1
+        assert profiler.stats()['untracked'] >= 1
+
+    def test_endpoint_aggregates(self, profiler, logged_in_admin):
+        """Test sampled requests are aggregated per endpoint."""
+        logged_in_admin.get('/admin/')
+        response = logged_in_admin.get('/admin/api/queries')
+
+        endpoints = {row['endpoint']: row
+                     for row in response.get_json()['endpoints']}
+        assert endpoints['admin.index']['requests'] == 1
+        assert endpoints['admin.index']['queries'] >= 1
+
+    def test_profiler_page(self, profiler, logged_in_admin):
+        """Test the admin page lists sampled statements."""
+        logged_in_admin.get('/admin/')
+        response = logged_in_admin.get('/admin/queries?order=total_ms')
+
+        assert response.status_code == 200
+        assert b'Slowest Statements' in response.data
+        assert b'FROM audit_logs' in response.data
+
+    def test_profiler_page_requires_admin(self, logged_in_user):
+        """Test regular users cannot view the profiler."""
+        response = logged_in_user.get('/admin/queries')
+        assert response.status_code == 302
+
+    def test_production_does_not_record_queries(self):
+        """Test production relies on sampling, not full recording."""
+        from config.config import ProductionConfig
+
+        assert ProductionConfig.SQLALCHEMY_RECORD_QUERIES is False
+        assert 0 < ProductionConfig.QUERY_PROFILER_SAMPLE_RATE < 1
+
+
+@pytest.fixture
+def fresh_metrics():
+    """A metrics registry independent of the global one."""
+    registry = Metrics()
+    yield registry
+    registry.shutdown()
+
+
+class TestMetrics:
+    """Test cases for request and service metrics."""
+
+    def test_counter_render(self, fresh_metrics):
+        """Test counters render one sample per label set."""
+        fresh_metrics.inc('labportal_requests_total', endpoint='main.index',
+                          method='GET', status='200')
+        fresh_metrics.inc('labportal_requests_total', endpoint='main.index',
+                          method='GET', status='200')
+
+        text = fresh_metrics.render()
+        assert '# TYPE labportal_requests_total counter' in text
+        assert ('labportal_requests_total{endpoint="main.index",'
+                'method="GET",status="200"} 2') in text
+
+    def test_histogram_buckets_are_cumulative(self, fresh_metrics):
+        """Test histograms render cumulative buckets, sum and count."""
+        for value in (0.003, 0.02, 0.02, 20.0):
+            fresh_metrics.observe('labportal_pam_duration_seconds', value,
+                                  outcome='success')
+
+        text = fresh_metrics.render()
+        prefix = 'labportal_pam_duration_seconds'
+        assert f'{prefix}_bucket{{outcome="success",le="0.005"}} 1' in text
+        assert f'{prefix}_bucket{{outcome="success",le="0.025"}} 3' in text
+        assert f'{prefix}_bucket{{outcome="success",le="10.0"}} 3' in text
+        assert f'{prefix}_bucket{{outcome="success",le="+Inf"}} 4' in text
+        assert f'{prefix}_count{{outcome="success"}} 4' in text
+        assert f'{prefix}_sum{{outcome="success"}} 20.043' in text
+
+    def test_label_values_are_escaped(self, fresh_metrics):
+        """Test quotes, backslashes and newlines in labels are escaped."""
+        fresh_metrics.inc('labportal_rate_limited_total',
+                          endpoint='a"b\\c\nd')
+        assert ('labportal_rate_limited_total{endpoint="a\\"b\\\\c\\nd"} 1'
+                in fresh_metrics.render())
+
+    def test_thread_shards_are_summed(self, fresh_metrics):
+        """Test counts recorded on several threads are all reported."""
+        def record():
+            for _ in range(500):
+                fresh_metrics.inc('labportal_rate_limited_total',
+                                  endpoint='auth.login')
+
+        threads = [threading.Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert fresh_metrics.collect()[
+            ('labportal_rate_limited_total',
+             (('endpoint', 'auth.login'),))] == 2000
+
+    def test_exited_thread_shards_are_retired(self, fresh_metrics):
+        """Test shards of finished threads are folded, not kept."""
+        key = ('labportal_rate_limited_total', (('endpoint', 'auth.login'),))
+
+        def record():
+            fresh_metrics.inc('labportal_rate_limited_total',
+                              endpoint='auth.login')
+
+        for _ in range(3):
+            for _ in range(10):
+                thread = threading.Thread(target=record)
+                thread.start()
+                thread.join()
+            fresh_metrics.collect()
+            assert len(fresh_metrics._shards) <= 1
+
+        assert fresh_metrics.collect()[key] == 30
+        fresh_metrics.reset()
+        assert fresh_metrics.collect() == {}
+
+    def test_disabled_metrics_record_nothing(self, fresh_metrics):
+        """Test nothing is recorded when metrics are disabled."""
+        fresh_metrics.enabled = False
+        fresh_metrics.inc('labportal_rate_limited_total', endpoint='x')
+        assert fresh_metrics.collect() == {}
+
+    def test_worker_snapshots_are_merged(self, tmp_path):
+        """Test a scrape includes the snapshots of other workers."""
+        other = tmp_path / 'metrics-99999.json'
+        other.write_text(
+            '[["labportal_rate_limited_total", [["endpoint", "auth.login"]],'
+            ' 3]]')
+        registry = Metrics()
+        registry.directory = str(tmp_path)
+        try:
+            registry.inc('labportal_rate_limited_total',
+                         endpoint='auth.login')
+            text = registry.render()
+        finally:
+            registry.shutdown()
+
+        assert ('labportal_rate_limited_total{endpoint="auth.login"} 4'
+                in text)
+        assert len(list(tmp_path.glob('metrics-*.json'))) == 2
+
+    def test_stale_snapshots_are_retired(self, tmp_path):
+        """Test files of exited workers fold into the retired snapshot."""
+        for name in ('metrics-99999-ab12.json', 'metrics-99998.json'):
+            (tmp_path / name).write_text(
+                '[["labportal_rate_limited_total",'
+                ' [["endpoint", "auth.login"]], 2]]')
+        registry = Metrics()
+        registry.directory = str(tmp_path)
+        try:
+            registry.inc('labportal_rate_limited_total',
+                         endpoint='auth.login')
+            registry.render()
+            text = registry.render()
+        finally:
+            registry.shutdown()
+
+        assert ('labportal_rate_limited_total{endpoint="auth.login"} 5'
+                in text)
+        names = sorted(path.name for path in tmp_path.glob('metrics-*.json'))
+        assert names[0].startswith(f'metrics-{os.getpid()}-')
+        assert names[1:] == ['metrics-retired.json']
+
+    def test_metrics_requires_token_or_admin(self, client, app,
+                                             monkeypatch):
+        """Test /metrics is closed to anonymous clients."""
+        assert client.get('/metrics').status_code == 401
+
+        monkeypatch.setitem(app.config, 'METRICS_TOKEN', 's3cret')
+        assert client.get('/metrics', headers={
+            'Authorization': 'Bearer wrong'}).status_code == 401
+        assert client.get('/metrics', headers={
+            'Authorization': 'Bearer s3cret'}).status_code == 200
+
+    def test_metrics_endpoint(self, logged_in_admin):
+        """Test /metrics exposes request counts and latencies."""
+        metrics.reset()
+        logged_in_admin.get('/health')
+        response = logged_in_admin.get('/metrics')
+
+        assert response.status_code == 200
+        assert response.content_type.startswith('text/plain')
+        text = response.get_data(as_text=True)
+        assert ('labportal_requests_total{endpoint="main.health",'
+                'method="GET",status="200"} 1') in text
+        assert ('labportal_request_duration_seconds_count'
+                '{endpoint="main.health"} 1') in text
+        assert 'labportal_request_db_seconds_sum{endpoint="main.health"}' \
+            in text
+
+    def test_password_hashing_is_timed(self, app_context):
+        """Test hash and verify durations are recorded."""
+        metrics.reset()
+        hasher = PasswordHasher()
+        hasher.verify(hasher.hash('secret123', 'pbkdf2:sha256:1000'),
+                      'secret123')
+
+        totals = metrics.collect()
+        name = 'labportal_password_hash_duration_seconds'
+        assert totals[(name, (('operation', 'hash'),))][-1] == 1
+        assert totals[(name, (('operation', 'verify'),))][-1] == 1
+
+    def test_pam_outcomes_are_timed(self, pam_service, fake_pam):
+        """Test PAM calls are recorded by outcome."""
+        metrics.reset()
+        pam_service.authenticate('pamuser', 'secret')
+        pam_service.authenticate('pamuser', 'wrong')
+
+        totals = metrics.collect()
+        name = 'labportal_pam_duration_seconds'
+        assert totals[(name, (('outcome', 'success'),))][-1] == 1
+        assert totals[(name, (('outcome', 'failure'),))][-1] == 1
+
+    def test_rate_limited_requests_are_counted(self, limited_app):
+        """Test 429 responses increment the rate limit counter."""
+        metrics.reset()
+        client = limited_app.test_client()
+        for _ in range(3):
+            client.post('/auth/login', data={'username': 'victim',
+                                             'password': 'wrongpassword'})
+
+        totals = metrics.collect()
+        assert totals[('labportal_rate_limited_total',
+                       (('endpoint', 'auth.login'),))] == 1
+        assert totals[('labportal_requests_total',
+                       (('endpoint', 'auth.login'), ('method', 'POST'),
+                        ('status', '429')))] == 1
+
+
+@pytest.fixture
+def health(app, monkeypatch):
+    """The global health checks with a private check table."""
+    monkeypatch.setattr(health_checks, '_checks', dict(health_checks._checks))
+    health_checks.shutdown()
+    health_checks.reset()
+    yield health_checks
+    health_checks.shutdown()
+    health_checks.reset()
+
+
+class TestHealthChecks:
+    """Test cases for the liveness and readiness endpoints."""
+
+    def test_liveness(self, client):
+        """Test liveness does not depend on anything."""
+        response = client.get('/health/live')
+        assert response.status_code == 200
+        assert response.get_json()['status'] == 'alive'
+
+    def test_readiness(self, client, health):
+        """Test readiness reports each dependency."""
+        response = client.get('/health/ready')
+
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data['status'] == 'ready'
+        assert data['checks']['database']['status'] == 'ok'
+        assert data['checks']['rate_limit_storage']['status'] == 'skipped'
+        assert data['checks']['pam']['critical'] is False
+
+    def test_results_are_cached(self, client, health):
+        """Test probes within the TTL reuse earlier results."""
+        calls = []
+        health.register('counted', lambda: calls.append(1))
+
+        client.get('/health/ready')
+        response = client.get('/health/ready')
+
+        assert len(calls) == 1
+        assert response.get_json()['checks']['counted']['cached'] is True
+
+    def test_expired_results_are_rechecked(self, client, health,
+                                           monkeypatch):
+        """Test results are refreshed once the TTL has passed."""
+        calls = []
+        health.register('counted', lambda: calls.append(1))
+        monkeypatch.setattr(health, 'ttl', 0)
+
+        client.get('/health/ready')
+        client.get('/health/ready')
+
+        assert len(calls) == 2
+
+    def test_failing_critical_check(self, client, health):
+        """Test a failing critical check makes the worker unready."""
+        def broken():
+            raise RuntimeError('pool exhausted')
+        health.register('broken', broken)
+
+        response = client.get('/health/ready')
+
+        assert response.status_code == 503
+        check = response.get_json()['checks']['broken']
+        assert check['status'] == 'fail'
+        assert check['error'] == 'pool exhausted'
+
+    def test_failing_optional_check(self, client, health):
+        """Test a failing non-critical check is only reported."""
+        def broken():
+            raise RuntimeError('unavailable')
+        health.register('optional', broken, critical=False)
+
+        response = client.get('/health/ready')
+
+        assert response.status_code == 200
+        assert response.get_json()['checks']['optional']['status'] == 'fail'
+
+    def test_hung_check_times_out(self, client, health, monkeypatch):
+        """Test a hung check fails fast and is not started again."""
+        release = threading.Event()
+        calls = []
+
+        def hung():
+            calls.append(1)
+            release.wait(5)
+        health.register('hung', hung)
+        monkeypatch.setattr(health, 'timeout', 0.1)
+        monkeypatch.setattr(health, 'ttl', 0)
+
+        try:
+            first = client.get('/health/ready')
+            second = client.get('/health/ready')
+        finally:
+            release.set()
+
+        assert first.status_code == 503
+        assert 'timed out' in first.get_json()['checks']['hung']['error']
+        assert second.status_code == 503
+        assert len(calls) == 1
+
+    def test_checks_run_concurrently(self, client, health):
+        """Test probe latency is bounded by the slowest check."""
+        for name in ('slow_a', 'slow_b', 'slow_c'):
+            health.register(name, lambda: time.sleep(0.2))
+        health.shutdown()
+
+        started = time.perf_counter()
+        response = client.get('/health/ready')
+
+        assert response.status_code == 200
+        assert time.perf_counter() - started < 0.5
+
+
+IMPORT_CSV = """username,email,first_name,last_name,password,is_admin,use_pam_auth
+student01,student01@example.com,Ada,One,secret123,,
+student02,student02@example.com,Bob,Two,secret456,no,no
+pamuser01,pamuser01@example.com,Pam,User,,false,yes
+testadmin,other@example.com,Dup,User,secret789,,
+student03,student01@example.com,Dup,Email,secret000,,
+student04,,No,Email,secret111,,
+student05,student05@example.com,Bad,Flag,secret222,maybe,
+"""
+
+
+@pytest.fixture
+def imported_usernames(app_context, admin_user):
+    """Remove users created by an import test afterwards."""
+    yield
+    User.query.filter(User.username != 'testadmin').delete()
+    AuditLog.query.filter_by(action='users_imported').delete()
+    db.session.commit()
+    user_stats.invalidate()
+    user_index.invalidate()
+
+
+class TestUserImport:
+    """Test cases for bulk user provisioning."""
+
+    def test_validate_row(self):
+        """Test rows are normalized and rejected with reasons."""
+        record = validate_row({'username': ' ada ', 'email': 'a@x.org',
+                               'first_name': 'Ada', 'last_name': 'L',
+                               'password': 'pw', 'is_admin': 'Yes'})
+        assert record['username'] == 'ada'
+        assert record['is_admin'] is True
+        assert record['use_pam_auth'] is False
+
+        with pytest.raises(ValueError, match='password is required'):
+            validate_row({'username': 'ada', 'email': 'a@x.org',
+                          'first_name': 'Ada', 'last_name': 'L'})
+        with pytest.raises(ValueError, match='longer than 80'):
+            validate_row({'username': 'a' * 81, 'email': 'a@x.org',
+                          'first_name': 'Ada', 'last_name': 'L',
+                          'password': 'pw'})
+
+    def test_csv_import(self, imported_usernames, admin_user):
+        """Test valid rows are created and the rest are reported."""
+        stats = import_users(read_rows(io.StringIO(IMPORT_CSV), 'csv'),
+                             admin_user.id)
+
+        assert (stats.rows, stats.created, stats.skipped, stats.invalid) \
+            == (7, 3, 2, 2)
+        assert sorted(line for line, _ in stats.errors) == [5, 6, 7, 8]
+
+        student = User.query.filter_by(username='student01').first()
+        assert student.check_password('secret123')
+        assert student.active is True
+        assert student.created_at is not None
+        pam = User.query.filter_by(username='pamuser01').first()
+        assert pam.use_pam_auth is True
+        assert pam.password_hash is None
+
+    def test_one_audit_entry_per_batch(self, imported_usernames, admin_user):
+        """Test each inserted batch is summarized by one audit entry."""
+        stats = import_users(read_rows(io.StringIO(IMPORT_CSV), 'csv'),
+                             admin_user.id, batch_size=2)
+
+        entries = AuditLog.query.filter_by(action='users_imported').all()
+        assert stats.batches == 3
+        assert sum(int(entry.details.split()[0]) for entry in entries) == 3
+        assert {entry.user_id for entry in entries} == {admin_user.id}
+        assert all('via CLI' in entry.details for entry in entries)
+        assert len(entries) == 2  # the last batch had only duplicates
+
+    def test_batch_uses_set_based_queries(self, imported_usernames, admin_user):
+        """Test a batch costs a fixed number of statements."""
+        rows = [(i, {'username': f'bulk{i:03d}',
+                     'email': f'bulk{i:03d}@example.com',
+                     'first_name': 'Bulk', 'last_name': 'User',
+                     'use_pam_auth': True})
+                for i in range(200)]
+
+        with assert_max_queries(4):
+            stats = import_users(rows, admin_user.id, batch_size=200)
+
+        assert stats.created == 200
+        assert User.query.filter(User.username.like('bulk%')).count() == 200
+
+    def test_dry_run(self, imported_usernames, admin_user):
+        """Test a dry run validates without inserting."""
+        stats = import_users(read_rows(io.StringIO(IMPORT_CSV), 'csv'),
+                             admin_user.id, dry_run=True)
+
+        assert stats.created == 3
+        assert User.query.count() == 1
+
+    def test_jsonl_import(self, imported_usernames, admin_user):
+        """Test JSONL input, including malformed lines."""
+        source = io.StringIO(
+            '{"username": "jl01", "email": "jl01@example.com", '
+            '"first_name": "J", "last_name": "L", "use_pam_auth": true}\n'
+            '\n'
+            '{not json}\n')
+        stats = import_users(read_rows(source, 'jsonl'), admin_user.id)
+
+        assert stats.created == 1
+        assert stats.errors[0][0] == 3
+        assert 'invalid JSON' in stats.errors[0][1]
+
+    def test_caches_see_imported_users(self, imported_usernames, admin_user):
+        """Test the stats and search index pick up imported users."""
+        user_stats.snapshot()
+        user_index.search('x')
+        import_users(read_rows(io.StringIO(IMPORT_CSV), 'csv'), admin_user.id)
+
+        assert user_stats.snapshot()['total_users'] == 4
+        assert [user['username'] for user in user_index.search('student')] \
+            == ['student01', 'student02']
+
+    def test_import_command_audits_actor(self, runner, imported_usernames,
+                                         admin_user, tmp_path):
+        """Test the CLI records the import under the acting admin."""
+        from cli import import_users as import_command
+
+        source = tmp_path / 'users.csv'
+        source.write_text(IMPORT_CSV)
+        result = runner.invoke(import_command,
+                               [str(source), '--actor', 'testadmin'])
+
+        assert result.exit_code == 0, result.output
+        assert 'Created 3 users' in result.output
+        entry = AuditLog.query.filter_by(action='users_imported').one()
+        assert entry.user_id == admin_user.id
+        assert entry.details.startswith('3 users imported via CLI (')
+        assert 'users.csv' in entry.details
+
+        result = runner.invoke(import_command, [str(source), '--actor',
+                                                'nobody'])
+        assert 'Admin nobody not found' in result.output